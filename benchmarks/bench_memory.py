@@ -0,0 +1,111 @@
+'''Throughput benchmarks for the in-memory cache backends.
+
+Usage: python benchmarks/bench_memory.py [scaling|copy] [--ops N] [--keys N]
+'''
+
+import sys
+import time
+import random
+import argparse
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+from wsgistate.memory import MemoryCache, ShardedMemoryCache
+
+
+def worker(cache, keys, ops, seed):
+    '''Runs a 90% get / 10% set workload against a cache.'''
+    rand = random.Random(seed)
+    get, set = cache.get, cache.set
+    for i in range(ops):
+        key = keys[rand.randrange(len(keys))]
+        if rand.random() < 0.9:
+            get(key)
+        else:
+            set(key, i)
+
+
+def run(cache, threads, ops, keys):
+    '''Gives operations per second for a number of concurrent threads.'''
+    for key in keys:
+        cache.set(key, key)
+    pool = [
+        threading.Thread(target=worker, args=(cache, keys, ops, i))
+        for i in range(threads)]
+    start = time.time()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return threads * ops / (time.time() - start)
+
+
+def scaling(args):
+    '''Throughput of MemoryCache, MemoryCache with a readers-writer lock and
+    ShardedMemoryCache by thread count.'''
+    keys = ['/page/%d' % i for i in range(args.keys)]
+    print('threads  %12s  %12s  %12s' % ('memory', 'memory rw', 'sharded'))
+    for threads in (1, 2, 4, 8, 16, 32):
+        memory = run(
+            MemoryCache(max_entries=args.keys), threads, args.ops, keys)
+        rw = run(
+            MemoryCache(max_entries=args.keys, lock='rw'),
+            threads, args.ops, keys)
+        sharded = run(
+            ShardedMemoryCache(max_entries=args.keys, shards=args.shards),
+            threads, args.ops, keys)
+        print('%7d  %12.0f  %12.0f  %12.0f' % (threads, memory, rw, sharded))
+
+
+def payload(chunks, size):
+    '''Builds a cache entry shaped like the ones WsgiMemoize stores.'''
+    return {
+        'status': '200 OK',
+        'headers': [('Content-Type', 'text/html'), ('Content-Length',
+                     str(chunks * size)), ('Cache-Control', 's-maxage=300')],
+        'exc_info': None,
+        'data': ['x' * size for i in range(chunks)],
+    }
+
+
+def copying(args):
+    '''Cache hits per second for each MemoryCache copy strategy.'''
+    shapes = [('small page', payload(1, 2048)),
+              ('chunked page', payload(64, 1024)),
+              ('large page', payload(256, 8192))]
+    print('%-13s' % 'payload' + ''.join(
+        '%12s' % mode for mode in ('deep', 'shallow', 'none', 'frozen')))
+    for name, value in shapes:
+        row = ['%-13s' % name]
+        for mode in ('deep', 'shallow', 'none', 'frozen'):
+            cache = MemoryCache(copy=mode)
+            cache.set('/', value)
+            get = cache.get
+            start = time.time()
+            for i in range(args.ops):
+                get('/')
+            row.append('%12.0f' % (args.ops / (time.time() - start)))
+        print(''.join(row))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('bench', nargs='?', default='scaling',
+                        choices=['scaling', 'copy'], help='benchmark to run')
+    parser.add_argument('--ops', type=int, default=20000,
+                        help='operations per thread')
+    parser.add_argument('--keys', type=int, default=10000,
+                        help='number of distinct keys')
+    parser.add_argument('--shards', type=int, default=16,
+                        help='shards for ShardedMemoryCache')
+    args = parser.parse_args(argv)
+    if args.bench == 'copy':
+        copying(args)
+    else:
+        scaling(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -44,7 +44,7 @@ setup(
     description='''WSGI session and caching middleware.''',
     long_description='''Session (flup-compatible), caching, memoizing,
 and HTTP cache control middleware for WSGI. Supports memory, filesystem,
-database, and memcached based backends.
+database, memcached and shared memory based backends.
 
 # Simple memoization example:
 
@@ -108,6 +108,8 @@ if __name__ == '__main__':
     mysql_memo=wsgistate.db:dbmemo_deploy
     oracle_memo=wsgistate.db:dbmemo_deploy
     postgres_memo=wsgistate.db:dbmemo_deploy
+    sharded_memo=wsgistate.sharded:shardedmemo_deploy
+    shm_memo=wsgistate.shm:shmmemo_deploy
     simple_memo=wsgistate.simple:simplememo_deploy
     sqlite_memo=wsgistate.db:dbmemo_deploy
     file_session=wsgistate.file:filesess_deploy
@@ -118,6 +120,8 @@ if __name__ == '__main__':
     mysql_session=wsgistate.db:dbsess_deploy
     oracle_session=wsgistate.db:dbsess_deploy
     postgres_session=wsgistate.db:dbsess_deploy
+    sharded_session=wsgistate.sharded:shardedsess_deploy
+    shm_session=wsgistate.shm:shmsess_deploy
     simple_session=wsgistate.simple:simplesess_deploy
     sqlite_session=wsgistate.db:dbsess_deploy
     file_urlsess=wsgistate.file:fileurlsess_deploy
@@ -128,6 +132,8 @@ if __name__ == '__main__':
     mysql_urlsess=wsgistate.db:dburlsess_deploy
     oracle_urlsess=wsgistate.db:dburlsess_deploy
     postgres_urlsess=wsgistate.db:dburlsess_deploy
+    sharded_urlsess=wsgistate.sharded:shardedurlsess_deploy
+    shm_urlsess=wsgistate.shm:shmurlsess_deploy
     simple_urlsess=wsgistate.simple:simpleurlsess_deploy
     sqlite_urlsess=wsgistate.db:dburlsess_deploy
     '''
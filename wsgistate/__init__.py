@@ -30,8 +30,22 @@
 
 '''Base Cache class'''
 
+import os
+import sys
+import weakref
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+from wsgistate.stats import Stats, NullStats, instrument
+
 __all__ = ['BaseCache', 'db', 'file', 'memory', 'memcached',
-           'session', 'simple', 'cache']
+           'session', 'shm', 'simple', 'cache', 'policy', 'stats',
+           'sharded', 'tiered']
+# Modules with Python 3 syntax
+if sys.version_info[0] >= 3:
+    __all__ += ['asyncmemcached', 'asgi']
 
 
 def synchronized(func):
@@ -51,9 +65,211 @@ def synchronized(func):
     return wrapper
 
 
+def shared(func):
+    '''Decorator to lock and unlock a method for reading only, so it may run
+    alongside other readers of a RWLock.
+
+    @param func Method to decorate
+    '''
+    def wrapper(self, *__args, **__kw):
+        self._lock.acquire_read()
+        try:
+            return func(self, *__args, **__kw)
+        finally:
+            self._lock.release_read()
+    wrapper.__name__ = func.__name__
+    wrapper.__dict__ = func.__dict__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+class RWLock(object):
+
+    '''Readers-writer lock.
+
+    Any number of threads may hold the lock for reading at once while a
+    thread holding it for writing excludes all others. Waiting writers
+    block new readers so writes aren't starved. acquire() and release()
+    take the lock for writing, reentrantly, so it can be used with
+    synchronized.
+    '''
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = self._waiting = self._depth = 0
+        self._writer = None
+
+    def acquire_read(self):
+        '''Acquire the lock for reading.'''
+        me = threading.current_thread()
+        with self._cond:
+            # Writers may read what they hold
+            if self._writer is me:
+                self._depth += 1
+                return
+            while self._writer is not None or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        '''Release the lock from reading.'''
+        with self._cond:
+            if self._writer is threading.current_thread():
+                self._depth -= 1
+                return
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire(self):
+        '''Acquire the lock for writing.'''
+        me = threading.current_thread()
+        with self._cond:
+            if self._writer is me:
+                self._depth += 1
+                return
+            self._waiting += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writer, self._depth = me, 1
+
+    def release(self):
+        '''Release the lock from writing.'''
+        with self._cond:
+            self._depth -= 1
+            if not self._depth:
+                self._writer = None
+                self._cond.notify_all()
+
+
+class Reaper(object):
+
+    '''Daemon thread that removes timed out items from a cache.
+
+    Every `interval` seconds the reaper calls the cache's reap() with
+    `batch` until it reports no more timed out items, so cleanup happens off
+    the request path and locks are held for one batch at a time. Forks wait
+    for the batch in progress to finish, so a child never inherits a cache
+    lock held by the parent's reaper, and reapers restart in the child.
+    Without os.register_at_fork() (Python 2 and before 3.7), reapers
+    restart on the child's first write to a cache with a reaper instead,
+    and a fork during a batch may leave that cache's lock held.
+    '''
+
+    _reapers = weakref.WeakSet()
+    # Reapers held off while a fork is in progress
+    _held = ()
+    # Process the reapers run in
+    _pid = os.getpid()
+    _forklock = threading.Lock()
+
+    def __init__(self, cache, interval, batch=100):
+        self._cache = weakref.ref(cache)
+        self.interval, self.batch = interval, batch
+        self._thread = None
+        # Held while reaping a batch
+        self._busy = threading.Lock()
+        Reaper._reapers.add(self)
+        self.start()
+
+    def start(self):
+        '''Start reaping.'''
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='wsgistate-reaper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Stop reaping and wait for the current batch to finish.'''
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    @property
+    def alive(self):
+        '''Tells if the reaper thread is running.'''
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        '''Reap in batches every interval until stopped.'''
+        stopped = self._stopped
+        while not stopped.wait(self.interval):
+            cache = self._cache()
+            if cache is None:
+                break
+            try:
+                while self._reap(cache, stopped):
+                    pass
+            # Reaping is best effort, like the caches it cleans
+            except Exception:
+                pass
+            del cache
+
+    def _reap(self, cache, stopped):
+        '''Reaps one batch unless stopped. Returns True if more items may
+        have timed out.'''
+        with self._busy:
+            return not stopped.is_set() and cache.reap(self.batch)
+
+    @classmethod
+    def _beforefork(cls):
+        '''Wait for batches in progress and hold off new ones.'''
+        held = list(cls._reapers)
+        for reaper in held:
+            reaper._busy.acquire()
+        cls._held = held
+
+    @classmethod
+    def _afterfork_parent(cls):
+        '''Let reapers go on after a fork.'''
+        held, cls._held = cls._held, ()
+        for reaper in held:
+            reaper._busy.release()
+
+    @classmethod
+    def _afterfork(cls):
+        '''Restart running reapers in a new child process.'''
+        held, cls._held = cls._held, ()
+        for reaper in held:
+            reaper._busy.release()
+        cls._pid = os.getpid()
+        for reaper in list(cls._reapers):
+            if not reaper._stopped.is_set():
+                reaper.start()
+
+    @classmethod
+    def _checkfork(cls):
+        '''Restart running reapers if this is a new child process that
+        _afterfork() didn't run in.'''
+        if cls._pid == os.getpid():
+            return
+        with cls._forklock:
+            if cls._pid == os.getpid():
+                return
+            cls._pid = os.getpid()
+            for reaper in list(cls._reapers):
+                # A batch the parent was reaping never finishes here
+                reaper._busy = threading.Lock()
+                if not reaper._stopped.is_set():
+                    reaper.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(
+        before=Reaper._beforefork,
+        after_in_parent=Reaper._afterfork_parent,
+        after_in_child=Reaper._afterfork)
+
+
 class BaseCache(object):
     '''Base Cache class.'''
 
+    # Tells if calls may come from several threads at once
+    threadsafe = True
+
     def __init__(self, *a, **kw):
         super(BaseCache, self).__init__()
         timeout = kw.get('timeout', 300)
@@ -62,6 +278,13 @@ class BaseCache(object):
         except (ValueError, TypeError):
             timeout = 300
         self.timeout = timeout
+        self._reaper = None
+        # Set stats=True to record statistics
+        if kw.get('stats', False) in (True, 'true', '1'):
+            self._stats = Stats()
+            instrument(self)
+        else:
+            self._stats = NullStats()
 
     def __getitem__(self, key):
         '''Fetch a given key from the cache.'''
@@ -88,14 +311,41 @@ class BaseCache(object):
         '''
         raise NotImplementedError()
 
-    def set(self, key, value):
+    def set(self, key, value, timeout=None):
         '''Set a value in the cache.
 
         @param key Keyword of item in cache.
         @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
         '''
         raise NotImplementedError()
 
+    def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        if key in self:
+            return False
+        self.set(key, value, timeout)
+        return True
+
+    def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        value = self.get(key)
+        if value is None:
+            return False
+        self.set(key, value, timeout)
+        return True
+
     def delete(self, key):
         '''Delete a key from the cache, failing silently.
 
@@ -116,3 +366,74 @@ class BaseCache(object):
             if val is not None:
                 d[k] = val
         return d
+
+    def set_many(self, mapping, timeout=None):
+        '''Set a bunch of values in the cache.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: self.timeout)
+        '''
+        for k, v in mapping.items():
+            self.set(k, v, timeout)
+
+    def delete_many(self, keys):
+        '''Delete a bunch of keys from the cache, failing silently.
+
+        @param keys Keywords of items in cache.
+        '''
+        for k in keys:
+            self.delete(k)
+
+    def stats(self):
+        '''Returns a dict of cache statistics.
+
+        Counts 'hits', 'misses', 'sets', 'deletes', 'expirations',
+        'evictions', 'culls' and 'rejections' (values too big to store)
+        since the cache was made, gives the 'hit_ratio', the current number
+        of 'entries' and 'bytes' (None if the backend can't tell) and per
+        operation 'latency' histograms.
+        '''
+        stats = self._stats.snapshot()
+        stats['entries'], stats['bytes'] = self._usage()
+        return stats
+
+    def _usage(self):
+        '''Gives the number of items in the cache and their size in bytes,
+        None when unknown.'''
+        return None, None
+
+    def reap(self, limit=100):
+        '''Remove up to limit timed out items. Returns True if more items
+        may have timed out.
+
+        @param limit Most items to examine (default: 100)
+        '''
+        return False
+
+    def close(self):
+        '''Stop any background reaper.'''
+        if self._reaper is not None:
+            self._reaper.stop()
+            self._reaper = None
+
+    def _startreaper(self, kw):
+        '''Starts a background reaper if 'reap_interval' is set.'''
+        try:
+            interval = float(kw.get('reap_interval') or 0)
+            batch = int(kw.get('reap_batch', 100))
+        except (ValueError, TypeError):
+            return
+        if interval > 0:
+            self._reaper = Reaper(self, interval, max(1, batch))
+
+    def _timeout(self, timeout):
+        '''Returns the timeout to use for an item.
+
+        @param timeout Seconds until item expires or None for the default
+        '''
+        # Threads don't survive fork, so each process starts its own
+        if self._reaper is not None:
+            Reaper._checkfork()
+        if timeout is None:
+            return self.timeout
+        return int(timeout)
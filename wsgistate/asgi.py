@@ -0,0 +1,738 @@
+# Copyright (c) 2026 the wsgistate contributors
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+'''ASGI middleware for response memoizing and sessions (Python 3 only).'''
+
+import os
+import time
+import asyncio
+import inspect
+import secrets
+import functools
+from io import StringIO
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+
+from wsgistate.cache import WsgiMemoize, _number, _PASS
+from wsgistate.session import SessionCache, SessionManager, _sessionid
+
+__all__ = ['AsyncCache', 'AsyncSessionCache', 'AsyncSessionManager',
+           'AsgiMemoize', 'AsgiCookieSession', 'AsgiURLSession',
+           'memoize', 'session', 'urlsession']
+
+
+def memoize(cache, **kw):
+    '''Decorator for ASGI response memoizing.'''
+    def decorator(application):
+        return AsgiMemoize(application, cache, **kw)
+    return decorator
+
+
+def session(cache, **kw):
+    '''Decorator for ASGI sessions.'''
+    def decorator(application):
+        return AsgiCookieSession(application, cache, **kw)
+    return decorator
+
+
+def urlsession(cache, **kw):
+    '''Decorator for ASGI URL encoded sessions.'''
+    def decorator(application):
+        return AsgiURLSession(application, cache, **kw)
+    return decorator
+
+
+def _wsgipath(path):
+    '''Gives an ASGI path, which servers decode as UTF-8, in the latin-1
+    decoded form WSGI servers give PATH_INFO in (PEP 3333).'''
+    return path.encode('utf-8').decode('latin-1')
+
+
+def _environ(scope):
+    '''Gives the CGI style variables of an ASGI HTTP scope, for sharing
+    key generation and header handling with the WSGI middleware.'''
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': _wsgipath(scope.get('root_path', '')),
+        'PATH_INFO': _wsgipath(scope['path']),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1')}
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        # Repeated headers are joined like a WSGI server joins them
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    return environ
+
+
+def _statusline(code):
+    '''Gives the HTTP status line of a status code.'''
+    try:
+        return '%d %s' % (code, HTTPStatus(code).phrase)
+    except ValueError:
+        return str(code)
+
+
+def _strheaders(headers):
+    '''Gives ASGI headers as a list of string tuples.'''
+    return [(k.decode('latin-1'), v.decode('latin-1')) for k, v in headers]
+
+
+def _rawheaders(headers):
+    '''Gives a list of string header tuples as ASGI headers.'''
+    return [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+
+def _bytes(chunk):
+    '''Gives a cached body chunk as bytes.'''
+    return chunk.encode('latin-1') if isinstance(chunk, str) else chunk
+
+
+async def _readbody(receive):
+    '''Reads a whole request body.'''
+    chunks = list()
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+def _replaybody(body, receive):
+    '''Gives a receive callable that sends an already read request body
+    before passing on to the server's.'''
+    sent = [False]
+
+    async def replay():
+        if sent[0]:
+            return await receive()
+        sent[0] = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+    return replay
+
+
+class AsyncCache(object):
+
+    '''Gives any cache coroutine methods.
+
+    Caches with coroutine methods, like AsyncMemCached, are awaited
+    directly. Calls to blocking caches run on a pool of `workers` threads
+    (default: 4) so they don't hold up the event loop. Caches that aren't
+    thread-safe, such as SimpleCache, get one thread, which runs their
+    calls in turn.
+    '''
+
+    def __init__(self, cache, workers=4):
+        self.cache = cache
+        self._native = inspect.iscoroutinefunction(cache.get)
+        self._workers = max(1, int(workers))
+        self._executor = self._pid = None
+
+    @property
+    def timeout(self):
+        '''Default timeout of the cache.'''
+        return self.cache.timeout
+
+    def _call(self, name, *args):
+        '''Gives an awaitable for a call to the cache.'''
+        method = getattr(self.cache, name)
+        if self._native:
+            return method(*args)
+        # Threads don't survive fork, so each process starts its own
+        if self._pid != os.getpid():
+            workers = self._workers
+            if not getattr(self.cache, 'threadsafe', False):
+                workers = 1
+            self._executor = ThreadPoolExecutor(workers)
+            self._pid = os.getpid()
+        return asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(method, *args))
+
+    async def get(self, key, default=None):
+        '''Fetch a given key from the cache.
+
+        @param key Keyword of item in cache.
+        @param default Default value (default: None)
+        '''
+        return await self._call('get', key, default)
+
+    async def set(self, key, value, timeout=None):
+        '''Set a value in the cache.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: cache timeout)
+        '''
+        return await self._call('set', key, value, timeout)
+
+    async def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: cache timeout)
+        '''
+        return await self._call('add', key, value, timeout)
+
+    async def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: cache timeout)
+        '''
+        return await self._call('touch', key, timeout)
+
+    async def delete(self, key):
+        '''Delete a key from the cache, failing silently.
+
+        @param key Keyword of item in cache.
+        '''
+        return await self._call('delete', key)
+
+    async def get_many(self, keys):
+        '''Fetch a bunch of keys from the cache.
+
+        @param keys Keywords of items in cache.
+        '''
+        return await self._call('get_many', list(keys))
+
+    async def set_many(self, mapping, timeout=None):
+        '''Set a bunch of values in the cache.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: cache timeout)
+        '''
+        return await self._call('set_many', mapping, timeout)
+
+    async def delete_many(self, keys):
+        '''Delete a bunch of keys from the cache, failing silently.
+
+        @param keys Keywords of items in cache.
+        '''
+        return await self._call('delete_many', list(keys))
+
+    async def close(self):
+        '''Closes the cache and stops the thread pool.'''
+        if hasattr(self.cache, 'close'):
+            await self._call('close')
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = self._pid = None
+
+
+class AsgiMemoize(WsgiMemoize):
+
+    '''ASGI middleware for response memoizing.
+
+    Takes the settings of WsgiMemoize and shares its cache keys, header
+    handling and cache entries, so ASGI and WSGI applications can share a
+    cache. Concurrent misses are coalesced on the event loop, stale
+    responses in a `grace` period are rendered again in background tasks
+    and responses always go to the client as the application sends them,
+    as with `stream`. Blocking caches run on `cache_workers` threads
+    (default: 4).
+    '''
+
+    def __init__(self, app, cache, **kw):
+        workers = int(_number(kw, 'cache_workers', 4))
+        if not isinstance(cache, AsyncCache):
+            cache = AsyncCache(cache, workers)
+        super(AsgiMemoize, self).__init__(app, cache, **kw)
+        # Background renders, kept referenced until they finish
+        self._tasks = set()
+
+    async def __call__(self, scope, receive, send):
+        # Verify requested response is cacheable
+        if scope['type'] != 'http' or scope['method'] not in self._allowed:
+            return await self.application(scope, receive, send)
+        environ = _environ(scope)
+        # Request bodies are part of the key without a query string
+        if self._userkey and not environ['QUERY_STRING']:
+            body = await _readbody(receive)
+            environ['wsgi.input'] = StringIO(body.decode('latin-1'))
+            environ['CONTENT_LENGTH'] = str(len(body))
+            receive = _replaybody(body, receive)
+        key = self._keygen(environ)
+        info, vkey = await self._alookup(key, environ)
+        if info is not None:
+            now = time.time()
+            stale = now - info.get('expires', now)
+            if stale > 0:
+                # Render again, falling back on the stale copy
+                if self._grace < stale <= self._stale_if_error:
+                    return await self._arescue(
+                        key, info, environ, scope, receive, send)
+                # Render expired responses again in the background
+                if self._grace:
+                    self._arevalidate(key, vkey, environ, scope)
+            return await self._asend(info, environ, send)
+        if self._coalesce:
+            return await self._acoalesced(
+                key, vkey, environ, scope, receive, send)
+        await self._arender(key, environ, scope, receive, send)
+
+    async def _alookup(self, key, environ):
+        '''Finds the cached response for a request. Returns the response or
+        None and the cache key it is stored under (see _lookup()).'''
+        info = await self._cache.get(key)
+        if info is not None and 'vary' in info:
+            vkey = self._variant(key, info['vary'], environ)
+            return await self._cache.get(vkey), vkey
+        return info, key
+
+    async def _asend(self, info, environ, send):
+        '''Sends a cached response, or 304 Not Modified if the client's copy
+        is still current.'''
+        status, headers, data = self._response(info, environ)
+        await send({'type': 'http.response.start', 'status': int(status[:3]),
+                    'headers': _rawheaders(headers)})
+        await send({'type': 'http.response.body',
+                    'body': b''.join(_bytes(c) for c in data)})
+
+    async def _acoalesced(self, key, vkey, environ, scope, receive, send):
+        '''Renders a missed response once for concurrent requests.'''
+        with self._lock:
+            passing = self._passing(vkey)
+        # Responses that can't be cached aren't worth waiting for
+        if passing:
+            return await self._arender(key, environ, scope, receive, send)
+        flight = self._flights.get(vkey)
+        # Wait for the request already rendering this key
+        if flight is not None:
+            try:
+                await asyncio.wait_for(flight.wait(), self._wait)
+            except asyncio.TimeoutError:
+                pass
+            if not flight.passed:
+                info = (await self._alookup(key, environ))[0]
+                if info is not None:
+                    return await self._asend(info, environ, send)
+            # Render if it can't be cached, failed or is taking too long
+            return await self._arender(key, environ, scope, receive, send)
+        flight = self._flights[vkey] = asyncio.Event()
+        flight.passed = False
+        leased = [False]
+
+        async def release():
+            '''Lets waiting requests go once.'''
+            if flight.is_set():
+                return
+            if leased[0]:
+                await self._cache.delete(self._leasekey(vkey))
+            del self._flights[vkey]
+            flight.set()
+
+        async def uncacheable():
+            '''Sends waiting requests to the application at once.'''
+            if flight.is_set():
+                return
+            self._pass(vkey)
+            # The lease now holds the marker for other processes
+            if leased[0]:
+                await self._cache.set(
+                    self._leasekey(vkey), _PASS, self._pass_timeout)
+            leased[0], flight.passed = False, True
+            await release()
+
+        try:
+            if self._lease:
+                leased[0] = await self._cache.add(
+                    self._leasekey(vkey), True, self._lease_timeout)
+                # Wait for the process holding the lease
+                if not leased[0]:
+                    info = await self._apoll(key, vkey, environ)
+                    if info is not None:
+                        return await self._asend(info, environ, send)
+            await self._arender(
+                key, environ, scope, receive, send, uncacheable)
+        finally:
+            await release()
+
+    async def _apoll(self, key, vkey, environ):
+        '''Waits for another process to cache a response. Returns the cached
+        response or None if it doesn't arrive in time.'''
+        deadline, pause = time.time() + self._wait, 0.005
+        lease = await self._cache.get(self._leasekey(vkey))
+        while time.time() < deadline:
+            # Another process found responses for the key can't be cached
+            if lease == _PASS:
+                self._pass(vkey)
+                break
+            await asyncio.sleep(pause)
+            info = (await self._alookup(key, environ))[0]
+            if info is not None:
+                return info
+            # Stop waiting if the lease holder gave up
+            lease = await self._cache.get(self._leasekey(vkey))
+            if lease is None:
+                break
+            pause = min(pause * 2, 0.1)
+        return None
+
+    def _arevalidate(self, key, vkey, environ, scope):
+        '''Starts a background render of a stale response.'''
+        if vkey in self._refreshing:
+            return
+        self._refreshing.add(vkey)
+        task = asyncio.ensure_future(
+            self._arefresh(key, vkey, environ, scope))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _arefresh(self, key, vkey, environ, scope):
+        '''Renders a response in the background, leaving the stale copy in
+        the cache if the application fails.'''
+        body = b''
+        if 'wsgi.input' in environ:
+            body = environ['wsgi.input'].getvalue().encode('latin-1')
+
+        async def disconnect():
+            return {'type': 'http.disconnect'}
+        try:
+            info, data = await self._acall(
+                dict(scope), _replaybody(body, disconnect))
+            # Keep serving stale copies of server errors
+            if info is None or info['status'][:1] == '5':
+                return
+            await self._astore(key, info, data, environ)
+        except Exception:
+            pass
+        finally:
+            self._refreshing.discard(vkey)
+
+    async def _arescue(self, key, info, environ, scope, receive, send):
+        '''Renders an expired response again, sending the stale copy
+        instead if the application raises or gives a server error.'''
+        held = list()
+
+        async def hold(message):
+            '''Holds the response back until it's known to be good'''
+            held.append(message)
+
+        try:
+            entry, data = await self._acall(scope, receive, hold)
+        except Exception:
+            return await self._asend(info, environ, send)
+        if data is None or held[0]['status'] >= 500:
+            return await self._asend(info, environ, send)
+        await self._astore(key, entry, data, environ)
+        start = held.pop(0)
+        headers = self._validated(entry, _strheaders(start['headers']))
+        await send(dict(start, headers=_rawheaders(headers)))
+        for message in held:
+            await send(message)
+
+    async def _acall(self, scope, receive, send=None, uncacheable=None):
+        '''Calls the application, collecting its response. Returns the
+        cache entry for the response (None if it can't be cached) and its
+        body chunks, or None for both if it wasn't sent in full.
+
+        @param send Server's send (default: None)
+        @param uncacheable Awaited if the response can't be cached
+            (default: None)
+        '''
+        response, chunks, state = [None], list(), {'size': 0, 'done': False}
+
+        async def cache_send(message):
+            '''Collects the response for the cache'''
+            if message['type'] == 'http.response.start':
+                headers = _strheaders(message.get('headers', ()))
+                response[0] = self._entry(
+                    _statusline(message['status']), headers, None)
+                message = dict(message, headers=_rawheaders(headers))
+                if response[0] is None and uncacheable is not None:
+                    await uncacheable()
+            elif message['type'] == 'http.response.body':
+                body = message.get('body', b'')
+                if response[0] is not None:
+                    chunks.append(body)
+                    state['size'] += len(body)
+                    # Stop collecting responses too big to cache
+                    if self._max_bytes and state['size'] > self._max_bytes:
+                        response[0] = None
+                        del chunks[:]
+                if not message.get('more_body', False):
+                    state['done'] = True
+            if send is not None:
+                await send(message)
+
+        await self.application(scope, receive, cache_send)
+        if not state['done']:
+            return None, None
+        return response[0], chunks
+
+    async def _arender(self, key, environ, scope, receive, send,
+                       uncacheable=None):
+        '''Runs the application and caches its response once it is sent.
+        A body sent in one message is held back with the response start
+        until the entity tag is added.
+
+        @param uncacheable Awaited if the response can't be cached
+            (default: None)
+        '''
+        held = list()
+
+        async def hold(message):
+            '''Holds back the response start and a one message body'''
+            if message['type'] == 'http.response.start':
+                held.append(message)
+                return
+            if held and message.get('more_body', False):
+                await send(held.pop())
+            if held:
+                held.append(message)
+            else:
+                await send(message)
+
+        info, data = await self._acall(scope, receive, hold, uncacheable)
+        await self._astore(key, info, data, environ)
+        if held:
+            start = held.pop(0)
+            headers = self._validated(info, _strheaders(start['headers']))
+            await send(dict(start, headers=_rawheaders(headers)))
+        for message in held:
+            await send(message)
+
+    async def _astore(self, key, info, data, environ):
+        '''Caches a response with one write unless it can't be cached.'''
+        items = self._items(key, info, data, environ)
+        if items is None:
+            return
+        mapping, timeout = items
+        if len(mapping) == 1:
+            await self._cache.set(key, mapping[key], timeout)
+        else:
+            await self._cache.set_many(mapping, timeout)
+
+
+class AsyncSessionCache(object):
+
+    '''Session cache for the event loop, with the check out and check in
+    semantics of SessionCache. A request checking out a session that is
+    already checked out waits for it to be checked in.
+    '''
+
+    def __init__(self, cache, **kw):
+        if not isinstance(cache, AsyncCache):
+            cache = AsyncCache(cache, int(_number(kw, 'cache_workers', 4)))
+        self.checkedout, self._closed, self.cache = dict(), False, cache
+        # Sets if session id is random on every access or not
+        self._random = kw.get('random', False)
+        self._secret = secrets.token_urlsafe(64)
+        self._condition = None
+
+    def _lock(self):
+        '''Gives the condition sessions are checked in on, made on first use
+        so it belongs to the running event loop.'''
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def create(self):
+        '''Create a new session with a unique identifier.
+
+        The newly-created session should eventually be released by
+        a call to checkin().
+        '''
+        sid, sess = await self.newid(), dict()
+        self.checkedout[sid] = sess
+        await self.cache.set(sid, sess)
+        return sid, sess
+
+    async def checkout(self, sid):
+        '''Checks out a session for use. Returns the session id and session
+        if it exists, otherwise returns None, None. It should eventually be
+        released by a call to checkin().
+
+        @param sid Session id
+        '''
+        lock = self._lock()
+        async with lock:
+            # If we know it's already checked out, wait.
+            while sid in self.checkedout:
+                await lock.wait()
+            # Hold the id while the cache is read
+            self.checkedout[sid] = None
+        try:
+            sess = await self.cache.get(sid)
+        except BaseException:
+            await self._release(sid)
+            raise
+        if sess is None:
+            await self._release(sid)
+            return None, None
+        # Randomize session id if set and remove old session id
+        if self._random:
+            newsid = await self.newid()
+            self.checkedout[newsid] = sess
+            await self.cache.delete(sid)
+            await self._release(sid)
+            return newsid, sess
+        self.checkedout[sid] = sess
+        return sid, sess
+
+    async def checkin(self, sid, sess):
+        '''Returns the session for use by other requests.
+
+        @param sid Session id
+        @param session Session dictionary
+        '''
+        try:
+            await self.cache.set(sid, sess)
+        finally:
+            await self._release(sid)
+
+    async def _release(self, sid):
+        '''Drops a session from the checked out ones.'''
+        lock = self._lock()
+        async with lock:
+            self.checkedout.pop(sid, None)
+            lock.notify_all()
+
+    async def shutdown(self):
+        '''Clean up outstanding sessions.'''
+        if not self._closed:
+            # Save any sessions that are still out there.
+            for sid, sess in list(self.checkedout.items()):
+                if sess is not None:
+                    await self.cache.set(sid, sess)
+            self.checkedout.clear()
+            await self.cache.close()
+            self._closed = True
+
+    async def newid(self):
+        '''Returns session key that is not being used.'''
+        sid = None
+        for num in range(10000):
+            sid = _sessionid(self._secret)
+            if sid not in self.checkedout and (
+                    await self.cache.get(sid) is None):
+                break
+        return sid
+
+
+class AsyncSessionManager(SessionManager):
+
+    '''Session manager for the event loop. Associate it with a session by
+    awaiting load().'''
+
+    def _get(self, environ):
+        '''Sessions are loaded by load() rather than on creation.'''
+
+    async def load(self, environ):
+        '''Attempt to associate with an existing Session, else a new one.'''
+        # Try cookie first.
+        value = self._cookieid(environ)
+        if value is not None:
+            self._checkedout(
+                value, await self._cache.checkout(value), False)
+        # Next, try query string.
+        if self.session is None:
+            value = self._queryid(environ)
+            if value is not None:
+                self._checkedout(
+                    value, await self._cache.checkout(value), True)
+        if self.session is None:
+            self._sid, self.session = await self._cache.create()
+            self.new = True
+
+    async def close(self):
+        '''Checks session back into session cache.'''
+        await self._cache.checkin(self._sid, self.session)
+        self.session = None
+
+
+class _AsgiSession(object):
+
+    '''ASGI middleware that adds a session service. The session manager is
+    put in the scope under `key`.'''
+
+    def __init__(self, application, cache, **kw):
+        if isinstance(cache, SessionCache):
+            cache = cache.cache
+        if not isinstance(cache, AsyncSessionCache):
+            cache = AsyncSessionCache(cache, **kw)
+        self.application, self.cache, self.kw = application, cache, kw
+        # scope key
+        self.key = kw.get('key', 'com.saddi.service.session')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.application(scope, receive, send)
+        environ = _environ(scope)
+        # New session manager instance each time
+        sess = AsyncSessionManager(self.cache, environ, **self.kw)
+        try:
+            await sess.load(environ)
+            scope = dict(scope)
+            scope[self.key] = sess
+            # Return initial response if new or session id is random
+            if sess.new:
+                return await self._initial(scope, environ, receive, send)
+            return await self.application(scope, receive, send)
+        # Always close session
+        finally:
+            if sess.session is not None:
+                await sess.close()
+
+
+class AsgiCookieSession(_AsgiSession):
+
+    '''ASGI middleware that adds a session service in a cookie.'''
+
+    async def _initial(self, scope, environ, receive, send):
+        '''Initial response to a cookie session.'''
+        sess = scope[self.key]
+
+        async def session_send(message):
+            '''Adds the session cookie to the response'''
+            if message['type'] == 'http.response.start':
+                headers = _strheaders(message.get('headers', ()))
+                sess.setcookie(headers)
+                message = dict(message, headers=_rawheaders(headers))
+            await send(message)
+        return await self.application(scope, receive, session_send)
+
+
+class AsgiURLSession(_AsgiSession):
+
+    '''ASGI middleware that adds a session service in the URL query
+    string.'''
+
+    async def _initial(self, scope, environ, receive, send):
+        '''Initial response to a query encoded session.'''
+        url = scope[self.key].seturl(environ)
+        # Redirect to URL with session in query component
+        await send({'type': 'http.response.start', 'status': 302,
+                    'headers': _rawheaders([('location', url)])})
+        await send({'type': 'http.response.body', 'body': (
+            'The browser is being redirected to %s' % url).encode('latin-1')})
@@ -0,0 +1,362 @@
+# Copyright (c) 2026 the wsgistate contributors
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+'''asyncio memcached cache backend (Python 3 only).'''
+
+import re
+import time
+import pickle
+import asyncio
+import binascii
+import contextlib
+from collections import deque
+
+__all__ = ['AsyncMemCached']
+
+# python-memcached value flags, so both clients can share servers
+_FLAG_PICKLE, _FLAG_INTEGER, _FLAG_LONG, _FLAG_TEXT = 1, 2, 4, 16
+
+# Keys memcached accepts
+_KEY = re.compile(b'^[^\x00-\x20\x7f]{1,250}$')
+
+# Longest relative expiration time; memcached reads longer ones as dates
+_MAX_RELATIVE = 60 * 60 * 24 * 30
+
+# Most keys asked for in one get command
+_GET_BATCH = 100
+
+# Failures that make an operation miss rather than raise
+_FAILURES = (OSError, EOFError, asyncio.TimeoutError,
+             asyncio.IncompleteReadError)
+
+
+class _ProtocolError(EOFError):
+
+    '''Unexpected reply from a memcached server.'''
+
+
+def _bkey(key):
+    '''Encodes a cache key for the wire.'''
+    bkey = key.encode('utf-8') if isinstance(key, str) else key
+    if not _KEY.match(bkey):
+        raise ValueError('Invalid memcached key %r' % (key,))
+    return bkey
+
+
+def _encode(value):
+    '''Serializes a value to bytes and flags.'''
+    if isinstance(value, bytes):
+        return value, 0
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL), _FLAG_PICKLE
+
+
+def _decode(data, flags):
+    '''Rebuilds a value from bytes and flags.'''
+    if flags & _FLAG_PICKLE:
+        return pickle.loads(data)
+    if flags & (_FLAG_INTEGER | _FLAG_LONG):
+        return int(data)
+    if flags & _FLAG_TEXT:
+        return data.decode('utf-8')
+    return data
+
+
+def _serverhash(bkey):
+    '''Hashes a key to a server the way python-memcached does.'''
+    return ((binascii.crc32(bkey) & 0xffffffff) >> 16) & 0x7fff
+
+
+async def _expect(reader, *replies):
+    '''Reads a one line reply. Returns True for the first expected reply and
+    False for the others.'''
+    line = await reader.readline()
+    if line not in replies:
+        raise _ProtocolError(line)
+    return line == replies[0]
+
+
+class _Pool(object):
+
+    '''Connections to one memcached server.'''
+
+    def __init__(self, address, size, timeout):
+        host, _, port = address.rpartition(':')
+        if not host:
+            host, port = port, 11211
+        self.host, self.port = host, int(port)
+        self._size, self._timeout = size, timeout
+        self._idle = deque()
+        # Made on first use so it belongs to the running loop
+        self._slots = None
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        '''Lends out a connection, closing it instead of reusing it if the
+        exchange on it fails.'''
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._size)
+        async with self._slots:
+            conn = None
+            while self._idle and conn is None:
+                conn = self._idle.pop()
+                if conn[1].is_closing():
+                    conn = None
+            if conn is None:
+                conn = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port),
+                    self._timeout)
+            try:
+                yield conn
+            except BaseException:
+                conn[1].close()
+                raise
+            self._idle.append(conn)
+
+    def close(self):
+        '''Closes idle connections.'''
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+class AsyncMemCached(object):
+
+    '''memcached cache backend for asyncio.
+
+    Has the methods of the other cache backends as coroutines and fails
+    silently like MemCached, treating unreachable servers as misses. Keys
+    are spread over the servers in `servers` (a list or ';' separated
+    'host:port' string) like python-memcached spreads them, and values are
+    stored in its format, so both can share servers. Each server has a pool
+    of up to `pool_size` connections (default: 4). get_many() sends every
+    server its gets at once before reading the replies, and writes send no
+    reply with `noreply` set (default: False).
+    '''
+
+    def __init__(self, servers, **kw):
+        timeout = kw.get('timeout', 300)
+        try:
+            self.timeout = int(timeout)
+        except (ValueError, TypeError):
+            self.timeout = 300
+        if isinstance(servers, str):
+            servers = servers.split(';')
+        servers = [s.strip() for s in servers if s.strip()]
+        if not servers:
+            raise ValueError('AsyncMemCached needs at least one server')
+        size = max(1, int(kw.get('pool_size', 4)))
+        # Seconds to wait for a server before giving up on it
+        self._io_timeout = float(kw.get('socket_timeout', 3))
+        self._pools = [_Pool(s, size, self._io_timeout) for s in servers]
+        # Skip replies to writes
+        self._noreply = kw.get('noreply', False) in (True, 'true', '1')
+
+    def _timeout(self, timeout):
+        '''Gives the memcached expiration time of an item.
+
+        @param timeout Seconds until item expires or None for the default
+        '''
+        timeout = self.timeout if timeout is None else int(timeout)
+        if timeout > _MAX_RELATIVE:
+            return int(time.time()) + timeout
+        return timeout
+
+    def _pool(self, bkey):
+        '''Gives the connection pool of the server a key is stored on.'''
+        return self._pools[_serverhash(bkey) % len(self._pools)]
+
+    def _batches(self, bkeys):
+        '''Groups encoded keys by the server they are stored on.'''
+        batches = dict()
+        for bkey in bkeys:
+            batches.setdefault(id(self._pool(bkey)), []).append(bkey)
+        return [(self._pool(b[0]), b) for b in batches.values()]
+
+    async def _call(self, pool, exchange, failed=None):
+        '''Runs an exchange on a pooled connection, returning failed if the
+        server can't be reached or misbehaves.'''
+        try:
+            async with pool.connection() as (reader, writer):
+                return await asyncio.wait_for(
+                    exchange(reader, writer), self._io_timeout)
+        except _FAILURES:
+            return failed
+
+    async def get(self, key, default=None):
+        '''Fetch a given key from the cache.  If the key does not exist, return
+        default, which itself defaults to None.
+
+        @param key Keyword of item in cache.
+        @param default Default value (default: None)
+        '''
+        bkey = _bkey(key)
+        found = await self._call(
+            self._pool(bkey), lambda r, w: self._get(r, w, [bkey]), {})
+        return found.get(bkey, default)
+
+    async def _get(self, reader, writer, bkeys):
+        '''Pipelines get commands for keys on one connection.'''
+        batches = [bkeys[i:i + _GET_BATCH]
+                   for i in range(0, len(bkeys), _GET_BATCH)]
+        for batch in batches:
+            writer.write(b'get ' + b' '.join(batch) + b'\r\n')
+        await writer.drain()
+        found = dict()
+        for batch in batches:
+            while True:
+                line = await reader.readline()
+                if line == b'END\r\n':
+                    break
+                parts = line.split()
+                if len(parts) != 4 or parts[0] != b'VALUE':
+                    raise _ProtocolError(line)
+                data = await reader.readexactly(int(parts[3]) + 2)
+                found[parts[1]] = _decode(data[:-2], int(parts[2]))
+        return found
+
+    async def get_many(self, keys):
+        '''Fetch a bunch of keys from the cache, from every server at once.
+        Returns a dict mapping each key in keys to its value. If the given
+        key is missing, it will be missing from the response dict.
+
+        @param keys Keywords of items in cache.
+        '''
+        bkeys = dict((_bkey(k), k) for k in keys)
+        results = await asyncio.gather(*[
+            self._call(pool, lambda r, w, b=batch: self._get(r, w, b), {})
+            for pool, batch in self._batches(bkeys)])
+        d = dict()
+        for found in results:
+            for bkey, value in found.items():
+                d[bkeys[bkey]] = value
+        return d
+
+    def _storecmd(self, command, bkey, value, timeout, noreply):
+        '''Builds a storage command.'''
+        data, flags = _encode(value)
+        return b'%s %s %d %d %d%s\r\n%s\r\n' % (
+            command, bkey, flags, self._timeout(timeout), len(data),
+            b' noreply' if noreply else b'', data)
+
+    def _noreplies(self, noreply):
+        '''Tells if a write should skip its reply.'''
+        return self._noreply if noreply is None else noreply
+
+    async def _send(self, pool, commands, replies, noreply):
+        '''Pipelines commands to one server. Returns how many succeeded, or
+        None if replies were skipped.
+
+        @param replies Expected replies, success first
+        '''
+        async def exchange(reader, writer):
+            writer.write(b''.join(commands))
+            await writer.drain()
+            if noreply:
+                return None
+            done = 0
+            for command in commands:
+                done += await _expect(reader, *replies)
+            return done
+        return await self._call(pool, exchange, 0)
+
+    async def set(self, key, value, timeout=None, noreply=None):
+        '''Set a value in the cache.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        @param noreply Skip the server's reply (default: self.noreply)
+        '''
+        bkey, noreply = _bkey(key), self._noreplies(noreply)
+        await self._send(self._pool(bkey), [self._storecmd(
+            b'set', bkey, value, timeout, noreply)], (b'STORED\r\n',),
+            noreply)
+
+    async def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        bkey = _bkey(key)
+        return bool(await self._send(self._pool(bkey), [self._storecmd(
+            b'add', bkey, value, timeout, False)],
+            (b'STORED\r\n', b'NOT_STORED\r\n'), False))
+
+    async def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        bkey = _bkey(key)
+        return bool(await self._send(self._pool(bkey), [
+            b'touch %s %d\r\n' % (bkey, self._timeout(timeout))],
+            (b'TOUCHED\r\n', b'NOT_FOUND\r\n'), False))
+
+    async def delete(self, key, noreply=None):
+        '''Delete a key from the cache, failing silently.
+
+        @param key Keyword of item in cache.
+        @param noreply Skip the server's reply (default: self.noreply)
+        '''
+        await self.delete_many([key], noreply)
+
+    async def set_many(self, mapping, timeout=None, noreply=None):
+        '''Set a bunch of values in the cache, pipelined to every server at
+        once.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: self.timeout)
+        @param noreply Skip the servers' replies (default: self.noreply)
+        '''
+        noreply = self._noreplies(noreply)
+        values = dict((_bkey(k), v) for k, v in mapping.items())
+        await asyncio.gather(*[
+            self._send(pool, [
+                self._storecmd(b'set', k, values[k], timeout, noreply)
+                for k in batch], (b'STORED\r\n',), noreply)
+            for pool, batch in self._batches(values)])
+
+    async def delete_many(self, keys, noreply=None):
+        '''Delete a bunch of keys from the cache, pipelined to every server
+        at once, failing silently.
+
+        @param keys Keywords of items in cache.
+        @param noreply Skip the servers' replies (default: self.noreply)
+        '''
+        noreply = self._noreplies(noreply)
+        suffix = b' noreply\r\n' if noreply else b'\r\n'
+        await asyncio.gather(*[
+            self._send(pool, [b'delete ' + k + suffix for k in batch],
+                       (b'DELETED\r\n', b'NOT_FOUND\r\n'), noreply)
+            for pool, batch in self._batches(_bkey(k) for k in keys)])
+
+    async def close(self):
+        '''Closes pooled connections.'''
+        for pool in self._pools:
+            pool.close()
@@ -28,13 +28,31 @@
 
 '''WSGI middleware for caching.'''
 
+import os
 import time
-import email
+import zlib
+import fnmatch
+import hashlib
+import email.utils
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 
 try:
     from StringIO import StringIO
 except ImportError:
     from io import StringIO
+try:
+    from urlparse import parse_qsl
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import parse_qsl, urlencode
 
 __all__ = ['WsgiMemoize', 'CacheHeader', 'memoize', 'public', 'private',
            'nocache', 'nostore', 'notransform', 'revalidate',
@@ -48,6 +66,189 @@ def memoize(cache, **kw):
     return decorator
 
 
+def _asbool(value):
+    '''Reads a boolean setting that may come from a Paste Deploy config
+    file as a string.'''
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 'yes', 'on', 'y', 't', '1')
+    return bool(value)
+
+
+def _number(kw, name, default):
+    '''Reads a non-negative number setting.'''
+    try:
+        return max(0.0, float(kw.get(name, default)))
+    except (ValueError, TypeError):
+        return default
+
+
+# Cache-Control directives that keep a response out of the cache
+_NO_STORE = frozenset(['no-store', 'no-cache', 'private'])
+
+# Statuses cached with the default timeout
+_CACHEABLE_STATUSES = ('200', '203', '204', '300', '301', '308')
+
+# Lease value marking a key whose responses can't be cached (hit-for-pass)
+_PASS = 'pass'
+
+# Headers sent with a 304 Not Modified answer
+_NOT_MODIFIED_HEADERS = set([
+    'cache-control', 'content-location', 'date', 'etag', 'expires',
+    'last-modified', 'vary'])
+
+
+def _etag(data):
+    '''Gives a strong entity tag for a response body.
+
+    @param data List of body chunks
+    '''
+    digest = hashlib.sha1()
+    for chunk in data:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('latin-1')
+        digest.update(chunk)
+    return '"%s"' % digest.hexdigest()
+
+
+# Media types compressed by default
+_COMPRESSIBLE = ('text/', 'application/json', 'application/javascript',
+                 'application/xml', 'application/xhtml+xml', 'image/svg+xml')
+
+# zlib window bits for the gzip format
+_GZIP = 16 + zlib.MAX_WBITS
+
+
+def _gzip(data, level):
+    '''Compresses body chunks into one gzip chunk.'''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP)
+    chunks = list()
+    for chunk in data:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('latin-1')
+        chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    return b''.join(chunks)
+
+
+def _acceptsgzip(value):
+    '''Tells if an Accept-Encoding header allows gzip.'''
+    if not value:
+        return False
+    codings = dict()
+    for coding in value.split(','):
+        coding, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, arg = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(arg)
+                except ValueError:
+                    quality = 0.0
+        codings[coding.strip().lower()] = quality
+    quality = codings.get('gzip', codings.get('x-gzip', codings.get('*')))
+    return bool(quality)
+
+
+def _gzipetag(etag):
+    '''Gives the entity tag of the gzipped form of a response.'''
+    return etag[:-1] + '-gzip"'
+
+
+def _addvary(headers, name):
+    '''Adds a field to a response's Vary header.
+
+    @param headers List of response header tuples, changed in place
+    @param name Request header name
+    '''
+    for idx, (key, value) in enumerate(headers):
+        if key.lower() != 'vary':
+            continue
+        fields = [f.strip().lower() for f in value.split(',')]
+        if name.lower() not in fields and '*' not in fields:
+            headers[idx] = (key, ', '.join([value, name]))
+        return
+    headers.append(('Vary', name))
+
+
+def _varyfields(headers):
+    '''Gives the sorted lower case request header names listed in a
+    response's Vary headers.
+
+    @param headers List of response header tuples
+    '''
+    fields = set()
+    for name, value in headers:
+        if name.lower() == 'vary':
+            fields.update(f.strip().lower() for f in value.split(','))
+    fields.discard('')
+    return sorted(fields)
+
+
+def _freshness(directives, fields):
+    '''Gives the seconds a response's own headers say it may be cached
+    for, or None if they don't say.
+
+    @param directives Dict of 'Cache-Control' directives
+    @param fields Dict of lower case response header names and values
+    '''
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            try:
+                return int(directives[name])
+            except (ValueError, TypeError):
+                # Malformed ages mean the response is already stale
+                return 0
+    if 'expires' in fields:
+        expires = _httpdate(fields['expires'])
+        if expires is None:
+            return 0
+        date = _httpdate(fields.get('date', '')) or time.time()
+        return int(expires - date)
+    return None
+
+
+def _httpdate(value):
+    '''Parses an HTTP date into seconds since the epoch or None.'''
+    try:
+        return email.utils.mktime_tz(email.utils.parsedate_tz(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def canonicalquery(query, ignore=()):
+    '''Gives a query string with its parameters sorted and re-encoded so
+    equivalent queries are equal.
+
+    @param query Query string
+    @param ignore Shell-style patterns of parameter names to drop
+    '''
+    params = [(k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+              if not any(fnmatch.fnmatchcase(k, p) for p in ignore)]
+    params.sort()
+    return urlencode(params)
+
+
+def hashkey(key, prefix='', readable=0):
+    '''Gives a fixed-length cache key for a key of any length.
+
+    @param key Cache key
+    @param prefix Namespace put in front of the key (default: '')
+    @param readable Leading characters of the key to keep in front of its
+        digest, less any whitespace or control characters, which memcached
+        keys can't hold (default: 0)
+    '''
+    data = key if isinstance(key, bytes) else key.encode('utf-8')
+    digest = hashlib.sha1(data).hexdigest()
+    if readable:
+        head = key[:readable]
+        if isinstance(head, bytes) and not isinstance(head, str):
+            head = head.decode('latin-1')
+        head = ''.join(c for c in head if c > ' ' and c != '\x7f')
+        return '%s%s#%s' % (prefix, head, digest)
+    return prefix + digest
+
+
 def getinput(environ):
     '''Non-destructively retrieves wsgi.input value.'''
     wsginput = environ['wsgi.input']
@@ -63,6 +264,24 @@ def getinput(environ):
     return qs
 
 
+def getcontrol(headers):
+    '''Parses 'Cache-Control' directives from response headers into a dict.
+
+    @param headers List of response header tuples
+    '''
+    directives = dict()
+    for name, value in headers:
+        if name.lower() != 'cache-control':
+            continue
+        for directive in value.split(','):
+            directive = directive.strip()
+            if not directive:
+                continue
+            name, _, arg = directive.partition('=')
+            directives[name.strip().lower()] = arg.strip().strip('"') or None
+    return directives
+
+
 def expiredate(seconds, value):
     '''Expire date headers for cache control.
 
@@ -70,8 +289,9 @@ def expiredate(seconds, value):
     @param value Value for Cache-Control header
     '''
     now = time.time()
-    return {'Cache-Control': value % seconds, 'Date': email.formatdate(now),
-            'Expires': email.formatdate(now + seconds)}
+    return {'Cache-Control': value % seconds,
+            'Date': email.utils.formatdate(now),
+            'Expires': email.utils.formatdate(now + seconds)}
 
 
 def control(application, value):
@@ -90,7 +310,7 @@ def expire(application, value):
     @param application WSGI application
     @param value 'Cache-Control' value
     '''
-    now = email.formatdate()
+    now = email.utils.formatdate()
     headers = {'Cache-Control': value, 'Date': now, 'Expires': now}
     return CacheHeader(application, headers)
 
@@ -118,7 +338,7 @@ def private(application):
 
 def nocache(application):
     '''Response that a cache can't send without origin server revalidation.'''
-    now = email.formatdate()
+    now = email.utils.formatdate()
     headers = {'Cache-Control': 'no-cache', 'Pragma': 'no-cache', 'Date': now,
                'Expires': now}
     return CacheHeader(application, headers)
@@ -159,7 +379,7 @@ def smaxage(seconds):
 
 def expires(seconds):
     '''Sets the time a response expires from the cache (HTTP 1.0).'''
-    headers = {'Expires': email.formatdate(time.time() + seconds)}
+    headers = {'Expires': email.utils.formatdate(time.time() + seconds)}
 
     def decorator(application):
         return CacheHeader(application, headers)
@@ -181,7 +401,7 @@ def vary(headers):
 
 def modified(seconds=None):
     '''Sets the time a response was modified.'''
-    headers = {'Modified': email.formatdate(seconds)}
+    headers = {'Modified': email.utils.formatdate(seconds)}
 
     def decorator(application):
         return CacheHeader(application, headers)
@@ -213,15 +433,139 @@ class CacheHeader(object):
                         headers.append(('Cache-Control', newval))
                         del headers[idx]
                         break
-                headers.extend((k, v) for k, v in theaders.iteritems())
+                headers.extend((k, v) for k, v in theaders.items())
                 return start_response(status, headers, exc_info)
 
             return self.application(environ, hdr_response)
         return self.application(environ, start_response)
 
 
+class _Workers(object):
+
+    '''Pool of daemon threads running queued calls, started on first use in
+    each process.'''
+
+    def __init__(self, size):
+        self._size, self._pid = max(1, size), None
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        '''Queue a call to run in the background.'''
+        if self._pid != os.getpid():
+            with self._lock:
+                # Threads don't survive a fork so start new ones
+                if self._pid != os.getpid():
+                    self._queue = Queue()
+                    for i in range(self._size):
+                        thread = threading.Thread(
+                            target=self._work, args=(self._queue,),
+                            name='wsgistate-revalidate')
+                        thread.daemon = True
+                        thread.start()
+                    self._pid = os.getpid()
+        self._queue.put((func, args))
+
+    def _work(self, queue):
+        '''Runs queued calls forever.'''
+        while True:
+            func, args = queue.get()
+            try:
+                func(*args)
+            # Background calls report failure themselves if they need to
+            except Exception:
+                pass
+
+
+class _Tee(object):
+
+    '''Response iterable that passes an application's chunks on to the
+    server as they are produced while collecting them for the cache.
+
+    Calls done() with the collected chunks once the response has been sent
+    in full, or with None if it was cut short or grew past `limit` bytes.
+    '''
+
+    def __init__(self, iterable, limit, done):
+        self._iterable, self._limit, self._done = iterable, limit, done
+        self._chunks, self._size = list(), 0
+
+    def __iter__(self):
+        for chunk in self._iterable:
+            if self._chunks is not None:
+                self._size += len(chunk)
+                # Stop collecting responses too big to cache
+                if self._limit and self._size > self._limit:
+                    self._chunks = None
+                else:
+                    self._chunks.append(chunk)
+            yield chunk
+        self._finish(self._chunks)
+
+    def close(self):
+        '''Closes the application's iterable.'''
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._finish(None)
+
+    def _finish(self, chunks):
+        '''Reports the collected response once.'''
+        done, self._done = self._done, None
+        if done is not None:
+            done(chunks)
+
+
 class WsgiMemoize(object):
-    '''WSGI middleware for response memoizing.'''
+
+    '''WSGI middleware for response memoizing.
+
+    Concurrent requests that miss the cache for the same key are coalesced:
+    the first one renders the response and the rest wait up to
+    `wait_timeout` seconds for it before rendering themselves. With
+    `lease` set, processes sharing a cache coalesce too by taking a lease
+    on the key with the cache's add(), which needs to be atomic for the
+    lease to be exclusive (memory, shared memory and memcached backends).
+    Once a render starts a response that can't be cached, the waiting
+    requests go straight to the application, and for `pass_timeout`
+    seconds (default: 30) requests for the key skip coalescing. With
+    `lease` set, the lease is replaced by a marker that tells other
+    processes the same.
+
+    With a `grace` period, responses are kept that many seconds past their
+    time to live. A request for a response in its grace period gets the
+    stale copy at once while `revalidate_workers` background threads render
+    a fresh one. If that render raises or gives a 5xx status, the stale
+    copy keeps being served until the grace period ends.
+
+    With a `stale_if_error` period, responses are also kept that many
+    seconds past their time to live, as with the 'stale-if-error'
+    extension of RFC 5861. A request for a response past its time to live
+    and any grace period renders it again, but gets the stale copy if the
+    application raises or gives a 5xx status.
+
+    With `stream` set, responses go to the client as the application
+    produces them and are cached once sent in full, rather than being
+    buffered first. Responses over `max_cacheable_bytes` aren't cached.
+    Buffered responses are sent with the same 'ETag' and 'Last-Modified'
+    headers as their cached copies; streamed ones only get the latter.
+
+    With `compress` set, text response bodies of at least
+    `compress_min_bytes` are stored gzip-compressed. Clients that accept
+    gzip get the stored bytes as they are; others get them decompressed.
+    Responses the application already gzipped are stored as they are and
+    decompressed for clients that need it. Cached responses that may be
+    sent either way carry 'Vary: Accept-Encoding'.
+
+    Responses with a 'Vary' header are stored per variant, under keys made
+    from the request headers it lists, and an index at the request's key
+    records those headers so lookups can find the request's variant.
+    Responses with 'Vary: *' aren't cached.
+
+    Whether and for how long a response is cached follows its status,
+    'Cache-Control', 'Expires' and 'Set-Cookie' headers (see _ttl()).
+    Not found responses are cached for `negative_timeout` seconds.
+    '''
 
     def __init__(self, app, cache, **kw):
         self.application, self._cache = app, cache
@@ -229,8 +573,64 @@ class WsgiMemoize(object):
         self._methkey = kw.get('key_methods', False)
         # Adds user submitted data to cache key
         self._userkey = kw.get('key_user_info', False)
+        # Query parameters left out of cache keys ('utm_*' style patterns)
+        ignore = kw.get('key_ignore', ())
+        if isinstance(ignore, str):
+            ignore = ignore.replace(',', ' ').split()
+        self._ignore = tuple(ignore)
+        # Hash keys to a fixed length for backends with key limits
+        self._hashkey = _asbool(kw.get('key_hash', False))
+        # Namespace put in front of cache keys
+        self._prefix = kw.get('key_prefix', '')
+        # Leading characters of a hashed key kept readable
+        self._readable = int(_number(kw, 'key_readable', 0))
         # Which HTTP responses by method are cached
         self._allowed = kw.get('allowed_methods', set(['GET', 'HEAD']))
+        # Which HTTP status codes are cached with the default timeout
+        statuses = kw.get('cacheable_statuses', _CACHEABLE_STATUSES)
+        if isinstance(statuses, str):
+            statuses = statuses.replace(',', ' ').split()
+        self._statuses = frozenset(str(s) for s in statuses)
+        # Seconds to cache 404 and 410 responses for (0 to not cache them)
+        self._negative = int(_number(kw, 'negative_timeout', 60))
+        # Cache responses that set cookies
+        self._cookies = _asbool(kw.get('cache_cookies', False))
+        # Render a missed response once for concurrent requests
+        self._coalesce = _asbool(kw.get('coalesce', True))
+        # Seconds to wait for another request's render
+        self._wait = _number(kw, 'wait_timeout', 10.0)
+        # Coalesce across processes with a lease in the cache
+        self._lease = _asbool(kw.get('lease', False))
+        # Seconds before the lease of a crashed process lapses
+        self._lease_timeout = max(1, int(_number(kw, 'lease_timeout', 30)))
+        # Renders in progress in this process by key
+        self._flights, self._lock = dict(), threading.Lock()
+        # Seconds to skip coalescing keys whose responses can't be cached
+        self._pass_timeout = max(1, int(_number(kw, 'pass_timeout', 30)))
+        # Keys skipping coalescing and when they stop
+        self._passes = dict()
+        # Seconds to serve a response after it expires while it's rendered
+        self._grace = _number(kw, 'grace', 0)
+        # Seconds to serve a response after it expires if rendering fails
+        self._stale_if_error = _number(kw, 'stale_if_error', 0)
+        # Keys being rendered in the background
+        self._refreshing = set()
+        self._workers = _Workers(int(_number(kw, 'revalidate_workers', 2)))
+        # Send responses to the client while they're collected
+        self._stream = _asbool(kw.get('stream', False))
+        # Largest response body in bytes that is cached (default: no limit)
+        self._max_bytes = int(_number(kw, 'max_cacheable_bytes', 0))
+        # Store text responses gzip-compressed
+        self._compress = _asbool(kw.get('compress', False))
+        # Smallest response body in bytes that is compressed
+        self._compress_min = int(_number(kw, 'compress_min_bytes', 1024))
+        # zlib compression level
+        self._compress_level = min(9, int(_number(kw, 'compress_level', 6)))
+        # Media type prefixes that are compressed
+        types = kw.get('compress_types', _COMPRESSIBLE)
+        if isinstance(types, str):
+            types = types.split()
+        self._compress_types = tuple(types)
 
     def __call__(self, environ, start_response):
         # Verify requested response is cacheable
@@ -239,35 +639,566 @@ class WsgiMemoize(object):
         # Generate cache key
         key = self._keygen(environ)
         # Query cache for key prescence
-        info = self._cache.get(key)
+        info, vkey = self._lookup(key, environ)
         # Return cached data
         if info is not None:
-            start_response(info['status'], info['headers'], info['exc_info'])
-            return info['data']
+            now = time.time()
+            stale = now - info.get('expires', now)
+            if stale > 0:
+                # Render again, falling back on the stale copy
+                if self._grace < stale <= self._stale_if_error:
+                    return self._rescue(key, info, environ, start_response)
+                # Render expired responses again in the background
+                if self._grace:
+                    self._revalidate(key, vkey, environ)
+            return self._replay(info, environ, start_response)
+        if self._coalesce:
+            return self._coalesced(key, vkey, environ, start_response)
+        return self._render(key, environ, start_response)
 
-        def cache_response(status, headers, exc_info=None):
-            '''Cache start_response info'''
-            # Add HTTP cache control headers
-            newhdrs = expiredate(self._cache.timeout, 's-maxage=%d')
-            headers.extend((k, v) for k, v in newhdrs.iteritems())
-            cachedict = {
-                'status': status, 'headers': headers, 'exc_info': exc_info}
-            self._cache.set(key, cachedict)
-            return start_response(status, headers, exc_info)
-
-        # Wrap data in list to trigger iterator (Roberto De Alemeida)
-        data = list(self.application(environ, cache_response))
-        # Fetch cached dictionary
+    def _lookup(self, key, environ):
+        '''Finds the cached response for a request. Returns the response or
+        None and the cache key it is stored under.
+
+        Responses that vary on request headers are stored under variant
+        keys, with an index at the request's key listing the headers.
+
+        @param key Cache key of the request
+        @param environ WSGI environ
+        '''
         info = self._cache.get(key)
-        # Store in dictionary
+        if info is not None and 'vary' in info:
+            vkey = self._variant(key, info['vary'], environ)
+            return self._cache.get(vkey), vkey
+        return info, key
+
+    def _variant(self, key, fields, environ):
+        '''Gives the cache key of the variant of a response that matches a
+        request.
+
+        @param key Cache key of the request
+        @param fields Lower case request header names the response varies on
+        @param environ WSGI environ
+        '''
+        values = list()
+        for field in fields:
+            name = field.upper().replace('-', '_')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            # Whitespace differences don't make a different variant
+            value = ' '.join(environ.get(name, '').split())
+            values.append('%s:%s' % (field, value))
+        data = '\n'.join(values)
+        # Python 2 gives headers as byte strings, hashed as they are
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        digest = hashlib.sha1(data)
+        return self._derived(key, '%s|vary=%s' % (key, digest.hexdigest()))
+
+    def _derived(self, key, derived):
+        '''Gives the cache key for a string derived from a request's cache
+        key. With 'key_hash' set, the string is hashed too, keeping the
+        readable front of the request's key, so it's no longer than that.
+
+        @param key Cache key of the request
+        @param derived String built on the key
+        '''
+        if not self._hashkey:
+            return derived
+        data = derived if isinstance(derived, bytes) else \
+            derived.encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+        return key[:-len(digest)] + digest
+
+    def _replay(self, info, environ, start_response):
+        '''Sends a cached response, or 304 Not Modified if the client's copy
+        is still current.'''
+        status, headers, data = self._response(info, environ)
+        start_response(status, headers, info['exc_info'])
+        return data
+
+    def _response(self, info, environ):
+        '''Gives the status, headers and body chunks to send a request from
+        a cached response.'''
+        headers, data = info['headers'], info['data']
+        compressed = info.get('gzip', False)
+        if compressed:
+            gzipped = _acceptsgzip(environ.get('HTTP_ACCEPT_ENCODING'))
+            headers = self._encoding(headers, gzipped)
+        if self._notmodified(info, environ):
+            headers = [(k, v) for k, v in headers
+                       if k.lower() in _NOT_MODIFIED_HEADERS]
+            return '304 Not Modified', headers, []
+        if compressed:
+            # Decompress only for clients that can't take gzip
+            if not gzipped:
+                data = [zlib.decompress(data[0], _GZIP)]
+            headers.append(('Content-Length', str(len(data[0]))))
+        return info['status'], headers, data
+
+    def _encoding(self, headers, gzipped):
+        '''Gives the headers for sending a gzipped response as it is or
+        decompressed.'''
+        if not gzipped:
+            return list(headers)
+        # The gzipped body is its own representation
+        headers = [(k, _gzipetag(v) if k.lower() == 'etag' else v)
+                   for k, v in headers]
+        headers.append(('Content-Encoding', 'gzip'))
+        return headers
+
+    def _notmodified(self, info, environ):
+        '''Tells if a request's conditional headers match a cached
+        response.'''
+        etag = info.get('etag')
+        if etag is None or not info['status'].startswith('200'):
+            return False
+        match = environ.get('HTTP_IF_NONE_MATCH')
+        # Entity tags take precedence over dates
+        if match is not None:
+            tags = [t.strip() for t in match.split(',')]
+            tags = [t[2:] if t.startswith('W/') else t for t in tags]
+            # If-None-Match uses weak comparison
+            return '*' in tags or etag in tags or (
+                info.get('gzip', False) and _gzipetag(etag) in tags)
+        since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if since is not None:
+            since = _httpdate(since)
+            return since is not None and info['modified'] <= since
+        return False
+
+    def _coalesced(self, key, vkey, environ, start_response):
+        '''Renders a missed response once for concurrent requests.
+
+        @param key Cache key of the request
+        @param vkey Cache key of the response variant if known, else key
+        '''
+        with self._lock:
+            passing = self._passing(vkey)
+            flight = None if passing else self._flights.get(vkey)
+            leader = not passing and flight is None
+            if leader:
+                flight = self._flights[vkey] = threading.Event()
+                flight.passed = False
+        # Responses that can't be cached aren't worth waiting for
+        if passing:
+            return self._render(key, environ, start_response)
+        # Wait for the request already rendering this key
+        if not leader:
+            flight.wait(self._wait)
+            if not flight.passed:
+                info = self._lookup(key, environ)[0]
+                if info is not None:
+                    return self._replay(info, environ, start_response)
+            # Render if it can't be cached, failed or is taking too long
+            return self._render(key, environ, start_response)
+        leased = [False]
+
+        def release():
+            '''Lets waiting requests go once, after the response is sent.'''
+            if flight.is_set():
+                return
+            if leased[0]:
+                self._cache.delete(self._leasekey(vkey))
+            with self._lock:
+                del self._flights[vkey]
+            flight.set()
+
+        def uncacheable():
+            '''Sends waiting requests to the application at once.'''
+            if flight.is_set():
+                return
+            self._pass(vkey, leased[0])
+            # The lease now holds the marker for other processes
+            leased[0], flight.passed = False, True
+            release()
+
+        try:
+            if self._lease:
+                leased[0] = self._cache.add(
+                    self._leasekey(vkey), True, self._lease_timeout)
+                # Wait for the process holding the lease
+                if not leased[0]:
+                    info = self._poll(key, vkey, environ)
+                    if info is not None:
+                        release()
+                        return self._replay(info, environ, start_response)
+            return self._render(
+                key, environ, start_response, release, uncacheable)
+        except BaseException:
+            release()
+            raise
+
+    def _passing(self, vkey):
+        '''Tells if a key skips coalescing. The caller must hold the
+        lock.'''
+        ends = self._passes.get(vkey)
+        if ends is None:
+            return False
+        if ends > time.time():
+            return True
+        del self._passes[vkey]
+        return False
+
+    def _pass(self, vkey, shared=False):
+        '''Makes a key skip coalescing for pass_timeout seconds.
+
+        @param vkey Cache key of the response variant
+        @param shared Tells other processes through the lease too
+        '''
+        now = time.time()
+        with self._lock:
+            # Forget keys whose pass has ended once there are many
+            if len(self._passes) >= 1024:
+                for k, ends in list(self._passes.items()):
+                    if ends <= now:
+                        del self._passes[k]
+            self._passes[vkey] = now + self._pass_timeout
+        if shared:
+            self._cache.set(
+                self._leasekey(vkey), _PASS, self._pass_timeout)
+
+    def _poll(self, key, vkey, environ):
+        '''Waits for another process to cache a response. Returns the cached
+        response or None if it doesn't arrive in time or can't be cached.'''
+        deadline, pause = time.time() + self._wait, 0.005
+        lease = self._cache.get(self._leasekey(vkey))
+        while time.time() < deadline:
+            # Another process found responses for the key can't be cached
+            if lease == _PASS:
+                self._pass(vkey)
+                break
+            time.sleep(pause)
+            info = self._lookup(key, environ)[0]
+            if info is not None:
+                return info
+            # Stop waiting if the lease holder gave up
+            lease = self._cache.get(self._leasekey(vkey))
+            if lease is None:
+                break
+            pause = min(pause * 2, 0.1)
+        return None
+
+    def _revalidate(self, key, vkey, environ):
+        '''Queues a background render of a stale response.'''
+        with self._lock:
+            if vkey in self._refreshing:
+                return
+            self._refreshing.add(vkey)
+        self._workers.submit(self._refresh, key, vkey, dict(environ))
+
+    def _refresh(self, key, vkey, environ):
+        '''Renders a response in the background, leaving the stale copy in
+        the cache if the application fails.'''
+        try:
+            response, written, iterable = self._start(environ)
+            data = written + self._collect(iterable)
+            # Keep serving stale copies of server errors
+            if response[0] is None or response[0]['status'][:1] == '5':
+                return
+            self._store(key, response[0], data, environ)
+        finally:
+            with self._lock:
+                self._refreshing.discard(vkey)
+
+    def _rescue(self, key, info, environ, start_response):
+        '''Renders an expired response again, sending the stale copy
+        instead if the application raises or gives a server error.
+
+        @param info Stale cache entry
+        '''
+        started = list()
+
+        def hold(status, headers, exc_info=None):
+            '''Holds the response back until it's known to be good'''
+            started.append((status, headers, exc_info))
+            return lambda data: None
+
+        try:
+            response, written, iterable = self._start(environ, hold)
+            data = written + self._collect(iterable)
+        except Exception:
+            return self._replay(info, environ, start_response)
+        # Error pages count as failures too
+        if not started or started[-1][2] is not None or \
+                started[-1][0][:1] == '5':
+            return self._replay(info, environ, start_response)
+        self._store(key, response[0], data, environ)
+        status, headers = started[-1][:2]
+        start_response(status, self._validated(response[0], headers))
+        return data
+
+    def _start(self, environ, start_response=None, uncacheable=None):
+        '''Calls the application, collecting its response locally. Returns a
+        list holding the cache entry for the response once it starts (None
+        if it can't be cached), the body chunks passed to write() and the
+        application's iterable.
+
+        @param environ WSGI environ
+        @param start_response Server's start_response (default: None)
+        @param uncacheable Called if the response can't be cached (default:
+            None)
+        '''
+        response, written = [None], list()
+
+        def cache_response(status, headers, exc_info=None):
+            '''Collects start_response info for the cache'''
+            # Responses replaced by an error page aren't cached
+            if exc_info is None:
+                response[0] = self._entry(status, headers, exc_info)
+            else:
+                response[0] = None
+            if response[0] is None and uncacheable is not None:
+                uncacheable()
+            if start_response is None:
+                return written.append
+            write = start_response(status, headers, exc_info)
+
+            def cache_write(data):
+                written.append(data)
+                return write(data)
+            return cache_write
+
+        return response, written, self.application(environ, cache_response)
+
+    def _collect(self, iterable):
+        '''Reads a whole response body and closes its iterable.'''
+        try:
+            # Wrap data in list to trigger iterator (Roberto De Alemeida),
+            # which also catches applications that start responses lazily
+            return list(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    def _store(self, key, info, data, environ):
+        '''Caches a response with one write unless it can't be cached.
+
+        @param key Cache key of the request
+        @param info Cache entry for the response or None
+        @param data List of body chunks
+        @param environ WSGI environ of the request
+        '''
+        items = self._items(key, info, data, environ)
+        if items is None:
+            return
+        mapping, timeout = items
+        if len(mapping) == 1:
+            self._cache.set(key, mapping[key], timeout)
+        else:
+            self._cache.set_many(mapping, timeout)
+
+    def _items(self, key, info, data, environ):
+        '''Finishes the cache entry for a response. Returns a dict of the
+        items to cache and their timeout, or None if the response can't be
+        cached.'''
+        if info is None:
+            return None
+        fields = _varyfields(info['headers'])
+        # Responses varying on anything can't be matched to requests
+        if '*' in fields:
+            return None
+        if self._max_bytes and sum(map(len, data)) > self._max_bytes:
+            return None
         info['data'] = data
-        # Store in cache
-        self._cache.set(key, info)
+        # Validators for answering conditional requests
+        headers = dict((k.lower(), v) for k, v in info['headers'])
+        info['headers'] = list(info['headers'])
+        info['etag'] = headers.get('etag')
+        if info['etag'] is None:
+            info['etag'] = _etag(data)
+            info['headers'].append(('ETag', info['etag']))
+        info['modified'] = _httpdate(headers.get('last-modified', ''))
+        if info['modified'] is None:
+            # HTTP dates have whole second precision
+            info['modified'] = int(time.time())
+            info['headers'].append((
+                'Last-Modified',
+                email.utils.formatdate(info['modified'], usegmt=True)))
+        if self._compress:
+            self._compressed(info, headers)
+            # Cached copies may be sent compressed or not
+            if info.get('gzip', False):
+                _addvary(info['headers'], 'Accept-Encoding')
+            # Bodies are stored in one encoding and sent in either
+            if 'content-encoding' not in [
+                    k.lower() for k, v in info['headers']]:
+                fields = [f for f in fields if f != 'accept-encoding']
+        # Keep responses for serving stale
+        timeout = info['timeout'] + max(self._grace, self._stale_if_error)
+        if not fields:
+            return {key: info}, timeout
+        # Store the variant along with the index of headers it varies on
+        return {key: {'vary': fields},
+                self._variant(key, fields, environ): info}, timeout
+
+    def _compressed(self, info, headers):
+        '''Stores a response body gzip-compressed if it's worth it.
+
+        @param info Cache entry
+        @param headers Dict of the application's lower case headers
+        '''
+        encoding = headers.get('content-encoding', 'identity').lower()
+        if encoding == 'identity':
+            if not info['status'].startswith('200'):
+                return
+            size = sum(map(len, info['data']))
+            ctype = headers.get('content-type', '').lower()
+            if size < self._compress_min or not ctype.startswith(
+                    self._compress_types):
+                return
+            info['data'] = [_gzip(info['data'], self._compress_level)]
+        elif encoding in ('gzip', 'x-gzip') and any(info['data']):
+            info['data'] = [b''.join(info['data'])]
+        else:
+            return
+        info['gzip'] = True
+        # Content headers are set to match each client's encoding
+        info['headers'] = [
+            (k, v) for k, v in info['headers']
+            if k.lower() not in ('content-encoding', 'content-length')]
+
+    def _entry(self, status, headers, exc_info):
+        '''Builds the cache entry for a response, adding HTTP cache control
+        headers if the application set none. Returns None if the response
+        can't be cached.'''
+        timeout = self._ttl(status, headers)
+        if timeout is None:
+            return None
+        names = set(k.lower() for k, v in headers)
+        # Add HTTP cache control headers
+        if 'cache-control' not in names:
+            newhdrs = expiredate(timeout, 's-maxage=%d')
+            headers.extend((k, v) for k, v in newhdrs.items()
+                           if k.lower() not in names)
+        # Validators go out with the first response too
+        if 'last-modified' not in names:
+            headers.append(('Last-Modified', email.utils.formatdate(
+                int(time.time()), usegmt=True)))
+        return {
+            'status': status, 'headers': headers, 'exc_info': exc_info,
+            'timeout': timeout, 'expires': time.time() + timeout}
+
+    def _leasekey(self, key):
+        '''Gives the cache key of the lease on rendering a key.'''
+        return self._derived(key, 'wsgistate.lease:' + key)
+
+    def _render(self, key, environ, start_response, done=None,
+                uncacheable=None):
+        '''Runs the application and caches its response with one write.
+
+        @param done Called once the response is sent (default: None)
+        @param uncacheable Called if the response can't be cached (default:
+            None)
+        '''
+        if self._stream:
+            response, written, iterable = self._start(
+                environ, start_response, uncacheable)
+
+            def finish(chunks):
+                '''Caches a streamed response once it is sent'''
+                try:
+                    if chunks is not None:
+                        self._store(
+                            key, response[0], written + chunks, environ)
+                finally:
+                    if done is not None:
+                        done()
+            return _Tee(iterable, self._max_bytes, finish)
+        held, write = list(), list()
+
+        def hold(status, headers, exc_info=None):
+            '''Holds the response back until its entity tag is known'''
+            held[:] = [(status, headers, exc_info)]
+
+            def send(data):
+                # Output passed to write() can't wait for the whole body
+                if held:
+                    write[:] = [start_response(*held.pop())]
+                return write[0](data)
+            return send
+
+        try:
+            response, written, iterable = self._start(
+                environ, hold, uncacheable)
+            data = self._collect(iterable)
+            self._store(key, response[0], written + data, environ)
+        finally:
+            if done is not None:
+                done()
+        if held:
+            status, headers, exc_info = held.pop()
+            start_response(
+                status, self._validated(response[0], headers), exc_info)
         # Return data as response to intial request
         return data
 
+    def _validated(self, info, headers):
+        '''Adds the entity tag of a response just cached, and 'Vary:
+        Accept-Encoding' if it's stored gzipped, to the headers it is first
+        sent with.
+
+        @param info Cache entry for the response or None
+        @param headers List of response header tuples
+        '''
+        if info is None or info.get('etag') is None:
+            return headers
+        headers = list(headers)
+        if info.get('gzip', False):
+            _addvary(headers, 'Accept-Encoding')
+        fields = dict((k.lower(), v) for k, v in headers)
+        if 'etag' in fields:
+            return headers
+        etag = info['etag']
+        # Bodies the application gzipped are sent as they are
+        encoding = fields.get('content-encoding', '').lower()
+        if info.get('gzip', False) and encoding in ('gzip', 'x-gzip'):
+            etag = _gzipetag(etag)
+        headers.append(('ETag', etag))
+        return headers
+
+    def _ttl(self, status, headers):
+        '''Gives the number of seconds to cache a response for, or None if
+        it mustn't be cached.
+
+        Responses marked 'no-store', 'no-cache' or 'private', responses
+        setting cookies (unless 'cache_cookies' is set) and partial or 304
+        responses aren't cached. Otherwise uses the application's
+        's-maxage' or 'max-age' 'Cache-Control' directive or its 'Expires'
+        header if it sets one, where zero or a past date means not to
+        cache. Without those, responses with a status in
+        'cacheable_statuses' get the cache's default timeout, 404 and 410
+        responses get 'negative_timeout' and others aren't cached.
+
+        @param status HTTP status line
+        @param headers List of response header tuples
+        '''
+        code = status[:3]
+        if code in ('206', '304'):
+            return None
+        directives = getcontrol(headers)
+        if _NO_STORE.intersection(directives):
+            return None
+        fields = dict((k.lower(), v) for k, v in headers)
+        if 'set-cookie' in fields and not self._cookies:
+            return None
+        timeout = _freshness(directives, fields)
+        if timeout is not None:
+            return timeout if timeout > 0 else None
+        if code in self._statuses:
+            return self._cache.timeout
+        if code in ('404', '410'):
+            return self._negative or None
+        return None
+
     def _keygen(self, environ):
-        '''Generates cache keys.'''
+        '''Generates cache keys.
+
+        Query strings are canonicalized so parameter order and ignored
+        parameters don't split entries. With 'key_hash' set, keys are
+        hashed to a fixed length, keeping 'key_readable' characters of the
+        key in front of the digest.
+        '''
         # Base of key is always path of request
         key = [environ['PATH_INFO']]
         # Add method name to key if configured that way
@@ -277,9 +1208,12 @@ class WsgiMemoize(object):
         if self._userkey:
             qs = environ.get('QUERY_STRING', '')
             if qs != '':
-                key.append(qs)
+                key.append(canonicalquery(qs, self._ignore))
             else:
                 win = getinput(environ)
                 if win != '':
                     key.append(win)
-        return ''.join(key)
+        key = ''.join(key)
+        if self._hashkey:
+            return hashkey(key, self._prefix, self._readable)
+        return self._prefix + key
@@ -144,6 +144,7 @@ class DbCache(BaseCache):
             self._max_entries = int(max_entries)
         except (ValueError, TypeError):
             self._max_entries = 300
+        self._startreaper(kw)
 
     def __len__(self):
         return self._cache.count().execute().fetchone()[0]
@@ -161,23 +162,23 @@ class DbCache(BaseCache):
         if row is None:
             return default
         if row.expires < datetime.now().replace(microsecond=0):
+            self._stats.incr('expirations')
             self.delete(key)
             return default
         return row.value
 
-    def set(self, key, value):
+    def set(self, key, value, timeout=None):
         '''Set a value in the cache.
 
         @param key Keyword of item in cache.
         @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
         '''
         if len(self) > self._max_entries:
             self._cull()
-        timeout, cache = self.timeout, self._cache
+        cache = self._cache
         # Get expiration time
-        expires = datetime.fromtimestamp(
-            time.time() + timeout
-        ).replace(microsecond=0)
+        expires = self._expires(timeout)
         #try:
         # Update database if key already present
         if key in self:
@@ -193,6 +194,80 @@ class DbCache(BaseCache):
         # To be threadsafe, updates/inserts are allowed to fail silently
         #except: pass
 
+    def get_many(self, keys):
+        '''Fetch a bunch of keys from the cache with one query. Returns a dict
+        mapping each key in keys to its value. If the given key is missing,
+        it will be missing from the response dict.
+
+        @param keys Keywords of items in cache.
+        '''
+        keys = list(keys)
+        if not keys:
+            return dict()
+        cache = self._cache
+        rows = select(
+            [cache.c.key, cache.c.value, cache.c.expires],
+            cache.c.key.in_(keys)).execute().fetchall()
+        now = datetime.now().replace(microsecond=0)
+        d, expired = dict(), list()
+        for row in rows:
+            if row.expires < now:
+                expired.append(row.key)
+            else:
+                d[row.key] = row.value
+        if expired:
+            self._stats.incr('expirations', len(expired))
+            self.delete_many(expired)
+        return d
+
+    def set_many(self, mapping, timeout=None):
+        '''Set a bunch of values in the cache with one query to find existing
+        keys and one batched update and insert.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: self.timeout)
+        '''
+        if not mapping:
+            return
+        if len(self) > self._max_entries:
+            self._cull()
+        cache = self._cache
+        expires = self._expires(timeout)
+        existing = set(
+            row[0] for row in select(
+                [cache.c.key], cache.c.key.in_(list(mapping))
+            ).execute().fetchall())
+        updates = tuple(
+            {'oldkey': k, 'value': v, 'expires': expires}
+            for k, v in mapping.items() if k in existing)
+        inserts = tuple(
+            {'key': k, 'value': v, 'expires': expires}
+            for k, v in mapping.items() if k not in existing)
+        # Update rows for keys already present
+        if updates:
+            update(
+                cache, cache.c.key == bindparam('oldkey')
+            ).execute(*updates)
+        # Insert new keys
+        if inserts:
+            insert(cache).execute(*inserts)
+
+    def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        cache = self._cache
+        now = datetime.now().replace(microsecond=0)
+        result = update(
+            cache,
+            (cache.c.key == key) & (cache.c.expires >= now),
+            dict(expires=self._expires(timeout)),
+        ).execute()
+        return result.rowcount > 0
+
     def delete(self, k):
         '''Delete a key from the cache, failing silently.
 
@@ -200,12 +275,52 @@ class DbCache(BaseCache):
         '''
         delete(self._cache, self._cache.c.key == k).execute()
 
+    def delete_many(self, keys):
+        '''Delete a bunch of keys from the cache with one query, failing
+        silently.
+
+        @param keys Keywords of items in cache.
+        '''
+        keys = list(keys)
+        if keys:
+            delete(self._cache, self._cache.c.key.in_(keys)).execute()
+
+    def reap(self, limit=100):
+        '''Remove up to limit timed out items. Returns True if more items
+        may have timed out.
+
+        @param limit Most items to remove (default: 100)
+        '''
+        cache = self._cache
+        now = datetime.now().replace(microsecond=0)
+        ids = [
+            row[0] for row in select(
+                [cache.c.id], cache.c.expires < now, limit=limit
+            ).execute().fetchall()
+        ]
+        if ids:
+            delete(cache, cache.c.id.in_(ids)).execute()
+            self._stats.incr('expirations', len(ids))
+        return len(ids) >= limit
+
+    def _usage(self):
+        '''Gives the number of rows in the cache table.'''
+        return len(self), None
+
+    def _expires(self, timeout):
+        '''Gives the expiration time for an item set now.'''
+        return datetime.fromtimestamp(
+            time.time() + self._timeout(timeout)
+        ).replace(microsecond=0)
+
     def _cull(self):
         '''Remove items in cache to make more room.'''
+        self._stats.incr('culls')
         cache, maxcull = self._cache, self._maxcull
         # Remove items that have timed out
         now = datetime.now().replace(microsecond=0)
-        delete(cache, cache.c.expires < now).execute()
+        result = delete(cache, cache.c.expires < now).execute()
+        self._stats.incr('expirations', max(0, result.rowcount))
         # Remove any items over the maximum allowed number in the cache
         if len(self) >= self._max_entries:
             # Upper limit for key query
@@ -221,3 +336,4 @@ class DbCache(BaseCache):
             # Delete keys
             fkeys = tuple({'key': k} for k in delkeys)
             delete(cache, cache.c.key.in_(bindparam('key'))).execute(*fkeys)
+            self._stats.incr('evictions', len(delkeys))
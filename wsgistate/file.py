@@ -36,11 +36,16 @@ except ImportError:
 
 import os
 import time
+import random
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
 
 try:
-    from urllib import quote_plus
+    from urllib import quote_plus, unquote_plus
 except ImportError:
-    from urllib.parse import quote_plus
+    from urllib.parse import quote_plus, unquote_plus
 
 from wsgistate.simple import SimpleCache
 from wsgistate.cache import WsgiMemoize
@@ -117,8 +122,14 @@ class FileCache(SimpleCache):
 
     '''File-based cache backend'''
 
+    threadsafe = True
+
     def __init__(self, *a, **kw):
+        # Set maximum number of items to cull if over max
+        self._maxcull = kw.pop('maxcull', 10)
         super(FileCache, self).__init__(*a, **kw)
+        # Request threads share the in-process eviction policy
+        self._policylock = threading.Lock()
         # Create directory
         try:
             self._dir = a[0]
@@ -127,7 +138,10 @@ class FileCache(SimpleCache):
         if not os.path.exists(self._dir):
                 self._createdir()
         # Remove unneeded methods and attributes
-        del self._cache
+        del self._cache, self._expiry
+        # File names left to check in the current background sweep
+        self._sweep = list()
+        self._startreaper(kw)
 
     def __contains__(self, key):
         '''Tell if a given key is in the cache.'''
@@ -140,47 +154,209 @@ class FileCache(SimpleCache):
         @param key Keyword of item in cache.
         @param default Default value (default: None)
         '''
+        value = self._load(key)
+        if value is None:
+            return default
+        self._track(key)
+        return value
+
+    def _load(self, key):
+        '''Reads a key's value from its file, removing it if it has timed
+        out.'''
         try:
             with open(self._key_to_file(key), 'rb') as fd:
                 exp, value = pickle.load(fd)
             # Remove item if time has expired.
             if exp < time.time():
+                self._stats.incr('expirations')
                 self.delete(key)
-                return default
+                return None
             return value
         except (IOError, OSError, EOFError, pickle.PickleError):
             pass
-        return default
+        return None
 
-    def set(self, key, value):
+    def set(self, key, value, timeout=None):
         '''Set a value in the cache.
 
         @param key Keyword of item in cache.
         @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
         '''
         if len(self.keys()) > self._max_entries:
-            self._cull()
-        try:
-            fname = self._key_to_file(key)
-            with open(fname, 'wb') as fd:
-                pickle.dump((time.time() + self.timeout, value), fd, 2)
-        except (IOError, OSError):
-            pass
+            self._cull(key=key)
+        if self._dump(key, value, time.time() + self._timeout(timeout)):
+            self._track(key)
+
+    def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        if self.get(key) is not None:
+            return False
+        self.set(key, value, timeout)
+        return True
+
+    def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        value = self.get(key)
+        if value is None:
+            return False
+        return self._dump(key, value, time.time() + self._timeout(timeout))
 
     def delete(self, key):
         '''Delete a key from the cache, failing silently.
 
         @param key Keyword of item in cache.
         '''
+        with self._policylock:
+            self._policy.remove(key)
         try:
             os.remove(self._key_to_file(key))
         except (IOError, OSError):
             pass
 
+    def get_many(self, keys):
+        '''Fetch a bunch of keys from the cache. Returns a dict mapping each
+        key in keys to its value. If the given key is missing, it will be
+        missing from the response dict.
+
+        One directory listing finds which keys have files, so missing keys
+        cost no file opens.
+
+        @param keys Keywords of items in cache.
+        '''
+        try:
+            names = set(self.keys())
+        except OSError:
+            return dict()
+        d = dict()
+        for key in keys:
+            if quote_plus(key) not in names:
+                continue
+            value = self._load(key)
+            if value is not None:
+                self._track(key)
+                d[key] = value
+        return d
+
+    def set_many(self, mapping, timeout=None):
+        '''Set a bunch of values in the cache.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: self.timeout)
+        '''
+        # Make room for the whole batch at once
+        if len(self.keys()) + len(mapping) > self._max_entries:
+            self._cull()
+        expires = time.time() + self._timeout(timeout)
+        for key, value in mapping.items():
+            if self._dump(key, value, expires):
+                self._track(key)
+
+    def delete_many(self, keys):
+        '''Delete a bunch of keys from the cache, failing silently.
+
+        @param keys Keywords of items in cache.
+        '''
+        for key in keys:
+            self.delete(key)
+
     def keys(self):
         '''Returns a list of keys in the cache.'''
         return os.listdir(self._dir)
 
+    def _usage(self):
+        '''Gives the number of items in the cache and the size of their
+        files in bytes.'''
+        entries, nbytes = 0, 0
+        for name in self.keys():
+            try:
+                nbytes += os.path.getsize(os.path.join(self._dir, name))
+            except OSError:
+                continue
+            entries += 1
+        return entries, nbytes
+
+    def reap(self, limit=100):
+        '''Remove timed out items from up to limit files. Returns True if
+        the current pass over the cache directory isn't finished.
+
+        @param limit Most files to check (default: 100)
+        '''
+        sweep = self._sweep
+        if not sweep:
+            try:
+                sweep.extend(self.keys())
+            except OSError:
+                return False
+        now = time.time()
+        for i in range(min(limit, len(sweep))):
+            name = sweep.pop()
+            try:
+                with open(os.path.join(self._dir, name), 'rb') as fd:
+                    exp = pickle.load(fd)[0]
+                # Drops the key from the eviction policy too
+                if exp < now:
+                    self.delete(unquote_plus(name))
+                    self._stats.incr('expirations')
+            except (IOError, OSError, EOFError, pickle.PickleError):
+                pass
+        return bool(sweep)
+
+    def _track(self, key):
+        '''Records a use of a key with the eviction policy.'''
+        with self._policylock:
+            super(FileCache, self)._track(key)
+
+    def _cull(self, size=0, key=None):
+        '''Remove items in cache to make room.
+
+        @param size Unused; files aren't budgeted in bytes (default: 0)
+        @param key Keyword of the item that needs room (default: None)
+        '''
+        self._stats.incr('culls')
+        num, maxcull = 0, self._maxcull
+        # Cull number of items allowed (set by self._maxcull)
+        for name in self.keys():
+            # Remove only maximum # of items allowed by maxcull
+            if num <= maxcull:
+                # Remove items if expired
+                if self._load(unquote_plus(name)) is None:
+                    num += 1
+            else:
+                break
+        # Remove any additional items up to max # of items allowed by maxcull
+        while len(self.keys()) >= self._max_entries and num <= maxcull:
+            # Cull remainder of allowed quota with the eviction policy
+            with self._policylock:
+                victim = self._policy.evict(key)
+            # Cull items only other processes have used at random
+            if victim is None:
+                victim = unquote_plus(random.choice(self.keys()))
+            self._stats.incr('evictions')
+            self.delete(victim)
+            num += 1
+
+    def _dump(self, key, value, expires):
+        '''Writes a key's value and expiration time to its file. Returns True
+        if the file was written.'''
+        try:
+            with open(self._key_to_file(key), 'wb') as fd:
+                pickle.dump((expires, value), fd, 2)
+        except (IOError, OSError):
+            return False
+        return True
+
     def _createdir(self):
         '''Creates the cache directory.'''
         try:
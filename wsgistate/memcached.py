@@ -97,13 +97,36 @@ class MemCached(BaseCache):
             return default
         return val
 
-    def set(self, key, value):
+    def set(self, key, value, timeout=None):
         '''Set a value in the cache.
 
         @param key Keyword of item in cache.
         @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
         '''
-        self._cache.set(key, value, self.timeout)
+        self._cache.set(key, value, self._timeout(timeout))
+
+    def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        return bool(self._cache.add(key, value, self._timeout(timeout)))
+
+    def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        # memcache.Client.touch needs python-memcached 1.54 or later
+        if not hasattr(self._cache, 'touch'):
+            return super(MemCached, self).touch(key, timeout)
+        return bool(self._cache.touch(key, self._timeout(timeout)))
 
     def delete(self, key):
         '''Delete a key from the cache, failing silently.
@@ -122,6 +145,35 @@ class MemCached(BaseCache):
         '''
         return self._cache.get_multi(keys)
 
+    def set_many(self, mapping, timeout=None):
+        '''Set a bunch of values in the cache with one round trip per server.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: self.timeout)
+        '''
+        self._cache.set_multi(dict(mapping), self._timeout(timeout))
+
+    def delete_many(self, keys):
+        '''Delete a bunch of keys from the cache with one round trip per
+        server, failing silently.
+
+        @param keys Keywords of items in cache.
+        '''
+        self._cache.delete_multi(list(keys))
+
+    def _usage(self):
+        '''Gives the number of items and bytes the memcached servers report,
+        None when they can't be reached.'''
+        try:
+            servers = self._cache.get_stats()
+        except Exception:
+            servers = None
+        if not servers:
+            return None, None
+        entries = sum(int(s.get('curr_items', 0)) for n, s in servers)
+        nbytes = sum(int(s.get('bytes', 0)) for n, s in servers)
+        return entries, nbytes
+
     def _cull(self):
         '''Stub.'''
         pass
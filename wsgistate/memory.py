@@ -31,23 +31,37 @@
 '''Thread-safe in-memory cache backend.'''
 
 import copy
+import time
+from collections import deque
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 try:
     import threading
 except ImportError:
     import dummy_threading as threading
 
-from wsgistate import synchronized
+from wsgistate import BaseCache, RWLock, synchronized, shared
 from wsgistate.simple import SimpleCache
 from wsgistate.cache import WsgiMemoize
 from wsgistate.session import CookieSession, URLSession, SessionCache
 
-__all__ = ['MemoryCache', 'memoize', 'session', 'urlsession']
+__all__ = ['MemoryCache', 'ShardedMemoryCache', 'memoize', 'session',
+           'urlsession']
+
+
+def _memorycache(*a, **kw):
+    '''Makes a sharded cache if more than one shard is configured.'''
+    if int(kw.get('shards', 1)) > 1:
+        return ShardedMemoryCache(*a, **kw)
+    return MemoryCache(*a, **kw)
 
 
 def memorymemo_deploy(global_conf, **kw):
     '''Paste Deploy loader for caching.'''
     def decorator(application):
-        _memory_memo_cache = MemoryCache(kw.get('cache'), **kw)
+        _memory_memo_cache = _memorycache(kw.get('cache'), **kw)
         return WsgiMemoize(application, _memory_memo_cache, **kw)
     return decorator
 
@@ -55,7 +69,7 @@ def memorymemo_deploy(global_conf, **kw):
 def memorysess_deploy(global_conf, **kw):
     '''Paste Deploy loader for sessions.'''
     def decorator(application):
-        _memory_base_cache = MemoryCache(kw.get('cache'), **kw)
+        _memory_base_cache = _memorycache(kw.get('cache'), **kw)
         _memory_session_cache = SessionCache(_memory_base_cache, **kw)
         return CookieSession(application, _memory_session_cache, **kw)
     return decorator
@@ -67,7 +81,7 @@ def memoryurlsess_deploy(global_conf, **kw):
     @param initstr Database initialization string
     '''
     def decorator(application):
-        _memory_ubase_cache = MemoryCache(kw.get('cache'), **kw)
+        _memory_ubase_cache = _memorycache(kw.get('cache'), **kw)
         _memory_url_cache = SessionCache(_memory_ubase_cache, **kw)
         return URLSession(application, _memory_url_cache, **kw)
     return decorator
@@ -76,7 +90,7 @@ def memoryurlsess_deploy(global_conf, **kw):
 def memoize(**kw):
     '''Decorator for caching.'''
     def decorator(application):
-        _mem_memo_cache = MemoryCache(**kw)
+        _mem_memo_cache = _memorycache(**kw)
         return WsgiMemoize(application, _mem_memo_cache, **kw)
     return decorator
 
@@ -84,7 +98,7 @@ def memoize(**kw):
 def session(**kw):
     '''Decorator for sessions.'''
     def decorator(application):
-        _mem_base_cache = MemoryCache(**kw)
+        _mem_base_cache = _memorycache(**kw)
         _mem_session_cache = SessionCache(_mem_base_cache, **kw)
         return CookieSession(application, _mem_session_cache, **kw)
     return decorator
@@ -93,21 +107,65 @@ def session(**kw):
 def urlsession(**kw):
     '''Decorator for URL encoded sessions.'''
     def decorator(application):
-        _mem_ubase_cache = MemoryCache(**kw)
+        _mem_ubase_cache = _memorycache(**kw)
         _mem_url_cache = SessionCache(_mem_ubase_cache, **kw)
         return URLSession(application, _mem_url_cache, **kw)
     return decorator
 
 
+def _identity(value):
+    '''Returns a value unchanged.'''
+    return value
+
+
+def _freeze(value):
+    '''Serializes a value to immutable bytes.'''
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+# How cached values are isolated from callers, as (on set, on get) pairs:
+# 'deep' and 'shallow' copy on every hit, 'none' hands out the cached object
+# itself and 'frozen' stores values serialized and rebuilds them on every hit
+_COPIES = {
+    'deep': (_identity, copy.deepcopy),
+    'shallow': (_identity, copy.copy),
+    'none': (_identity, _identity),
+    'frozen': (_freeze, pickle.loads),
+}
+
+
+# Most reads buffered for the eviction policy between writes
+_READ_BUFFER = 1024
+
+
 class MemoryCache(SimpleCache):
 
     '''Thread-safe in-memory cache backend.'''
 
+    threadsafe = True
+
     def __init__(self, *a, **kw):
         super(MemoryCache, self).__init__(*a, **kw)
-        self._lock = threading.Condition()
+        # Set locking mode: 'exclusive' serializes every call and 'rw' lets
+        # reads run in parallel with each other
+        mode = kw.get('lock', 'exclusive')
+        if mode == 'rw':
+            self._lock, self._shared = RWLock(), True
+        elif mode == 'exclusive':
+            self._lock, self._shared = threading.Condition(), False
+        else:
+            raise ValueError('Unknown lock mode %r' % mode)
+        # Keys hit under a shared lock, replayed to the eviction policy by
+        # the next write; the oldest are dropped if it fills up
+        self._reads = deque(maxlen=_READ_BUFFER)
+        # Set copy strategy for cached values
+        strategy = kw.get('copy', 'deep')
+        try:
+            self._freeze, self._thaw = _COPIES[strategy]
+        except KeyError:
+            raise ValueError('Unknown copy strategy %r' % strategy)
+        self._startreaper(kw)
 
-    @synchronized
     def get(self, key, default=None):
         '''Fetch a given key from the cache. If the key does not exist, return
         default, which itself defaults to None.
@@ -115,16 +173,119 @@ class MemoryCache(SimpleCache):
         @param key Keyword of item in cache.
         @param default Default value (default: None)
         '''
-        return copy.deepcopy(super(MemoryCache, self).get(key))
+        if self._shared:
+            value = self._peek(key)
+        else:
+            value = self._get(key)
+        if value is None:
+            return default
+        # Copy outside of the lock
+        return self._thaw(value)
 
     @synchronized
-    def set(self, key, value):
+    def _get(self, key):
+        '''Fetch a given key from the cache without copying it.'''
+        return super(MemoryCache, self).get(key)
+
+    @shared
+    def _peek(self, key):
+        '''Fetch a given key from the cache without copying it or changing
+        the cache.'''
+        values = self._cache.get(key)
+        # Timed out items are left for the next write to remove
+        if values is None or values[0] < time.time():
+            return None
+        self._reads.append(key)
+        return values[1]
+
+    def get_many(self, keys):
+        '''Fetch a bunch of keys from the cache under one lock. Returns a dict
+        mapping each key in keys to its value. If the given key is missing,
+        it will be missing from the response dict.
+
+        @param keys Keywords of items in cache.
+        '''
+        if self._shared:
+            values = self._peek_many(keys)
+        else:
+            values = self._get_many(keys)
+        # Copy outside of the lock
+        thaw = self._thaw
+        return dict((k, thaw(v)) for k, v in values.items())
+
+    @synchronized
+    def _get_many(self, keys):
+        '''Fetch a bunch of keys from the cache without copying them.'''
+        get, d = super(MemoryCache, self).get, dict()
+        for key in keys:
+            value = get(key)
+            if value is not None:
+                d[key] = value
+        return d
+
+    @shared
+    def _peek_many(self, keys):
+        '''Fetch a bunch of keys from the cache without copying them or
+        changing the cache.'''
+        cache, reads, now, d = self._cache, self._reads, time.time(), dict()
+        for key in keys:
+            values = cache.get(key)
+            if values is not None and values[0] >= now:
+                reads.append(key)
+                d[key] = values[1]
+        return d
+
+    def set(self, key, value, timeout=None):
         '''Set a value in the cache.
 
         @param key Keyword of item in cache.
         @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        self._set(key, self._freeze(value), timeout)
+
+    def set_many(self, mapping, timeout=None):
+        '''Set a bunch of values in the cache under one lock.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: self.timeout)
+        '''
+        freeze = self._freeze
+        self._set_many(
+            dict((k, freeze(v)) for k, v in mapping.items()), timeout)
+
+    @synchronized
+    def _set_many(self, mapping, timeout):
+        '''Set already frozen values in the cache.'''
+        store = super(MemoryCache, self).set
+        for key, value in mapping.items():
+            store(key, value, timeout)
+
+    @synchronized
+    def _set(self, key, value, timeout):
+        '''Set an already frozen value in the cache.'''
+        super(MemoryCache, self).set(key, value, timeout)
+
+    @synchronized
+    def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
         '''
-        super(MemoryCache, self).set(key, value)
+        return super(MemoryCache, self).add(key, value, timeout)
+
+    @synchronized
+    def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        return super(MemoryCache, self).touch(key, timeout)
 
     @synchronized
     def delete(self, key):
@@ -133,3 +294,210 @@ class MemoryCache(SimpleCache):
         @param key Keyword of item in cache.
         '''
         super(MemoryCache, self).delete(key)
+
+    @synchronized
+    def delete_many(self, keys):
+        '''Delete a bunch of keys from the cache under one lock, failing
+        silently.
+
+        @param keys Keywords of items in cache.
+        '''
+        delete = super(MemoryCache, self).delete
+        for key in keys:
+            delete(key)
+
+    @synchronized
+    def _usage(self):
+        '''Gives the number of items in the cache and their size in bytes.'''
+        return super(MemoryCache, self)._usage()
+
+    @synchronized
+    def reap(self, limit=100):
+        '''Remove up to limit timed out items, earliest first. Returns True
+        if more items have timed out.
+
+        @param limit Most items to examine (default: 100)
+        '''
+        return super(MemoryCache, self).reap(limit)
+
+    def _purge(self, now=None, limit=None):
+        '''Replays buffered reads to the eviction policy and removes items
+        that have timed out.
+
+        @param now Current time (default: time.time())
+        @param limit Most index entries to examine (default: unlimited)
+        '''
+        reads, cache, policy = self._reads, self._cache, self._policy
+        for i in range(len(reads)):
+            key = reads.popleft()
+            if key in cache:
+                policy.access(key)
+        super(MemoryCache, self)._purge(now, limit)
+
+    @synchronized
+    def _cull(self, size=0, key=None):
+        '''Remove items in cache to make room.
+
+        @param size Size in bytes of the item that needs room (default: 0)
+        @param key Keyword of the item that needs room (default: None)
+        '''
+        super(MemoryCache, self)._cull(size, key)
+
+
+class ShardedMemoryCache(BaseCache):
+
+    '''Thread-safe in-memory cache backend partitioned into independently
+    locked shards.
+
+    Keys are hashed to one of `shards` MemoryCache partitions, each with its
+    own lock, eviction and share of `max_entries`, so threads working on
+    different keys rarely contend for the same lock.
+    '''
+
+    def __init__(self, *a, **kw):
+        super(ShardedMemoryCache, self).__init__(*a, **kw)
+        shards = int(kw.get('shards', 16))
+        if shards < 1:
+            raise ValueError('shards must be a positive integer')
+        # Split max entries between shards
+        max_entries = kw.get('max_entries', 300)
+        try:
+            max_entries = int(max_entries)
+        except (ValueError, TypeError):
+            max_entries = 300
+        shardkw = dict(kw, max_entries=max(1, max_entries // shards))
+        # Split max bytes between shards
+        try:
+            max_bytes = int(kw.get('max_bytes') or 0)
+        except (ValueError, TypeError):
+            max_bytes = 0
+        if max_bytes:
+            shardkw['max_bytes'] = max(1, max_bytes // shards)
+        # One reaper sweeps every shard
+        shardkw.pop('reap_interval', None)
+        # Calls are recorded once, here, and shards count their
+        # expirations, evictions and culls in the same stats
+        shardkw['stats'] = False
+        self._shards = [MemoryCache(*a, **shardkw) for i in range(shards)]
+        for shard in self._shards:
+            shard._stats = self._stats
+        self._startreaper(kw)
+
+    @property
+    def nbytes(self):
+        '''Current total size of values in bytes.'''
+        return sum(shard.nbytes for shard in self._shards)
+
+    def _shard(self, key):
+        '''Gives the partition a key is stored in.'''
+        return self._shards[hash(key) % len(self._shards)]
+
+    def get(self, key, default=None):
+        '''Fetch a given key from the cache. If the key does not exist, return
+        default, which itself defaults to None.
+
+        @param key Keyword of item in cache.
+        @param default Default value (default: None)
+        '''
+        return self._shard(key).get(key, default)
+
+    def set(self, key, value, timeout=None):
+        '''Set a value in the cache.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        self._shard(key).set(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        return self._shard(key).add(key, value, timeout)
+
+    def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        return self._shard(key).touch(key, timeout)
+
+    def delete(self, key):
+        '''Delete a key from the cache, failing silently.
+
+        @param key Keyword of item in cache.
+        '''
+        self._shard(key).delete(key)
+
+    def get_many(self, keys):
+        '''Fetch a bunch of keys from the cache, one batch per shard. Returns
+        a dict mapping each key in keys to its value. If the given key is
+        missing, it will be missing from the response dict.
+
+        @param keys Keywords of items in cache.
+        '''
+        d = dict()
+        for shard, batch in self._batches(keys):
+            d.update(shard.get_many(batch))
+        return d
+
+    def set_many(self, mapping, timeout=None):
+        '''Set a bunch of values in the cache, one batch per shard.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: self.timeout)
+        '''
+        for shard, batch in self._batches(mapping):
+            shard.set_many(dict((k, mapping[k]) for k in batch), timeout)
+
+    def delete_many(self, keys):
+        '''Delete a bunch of keys from the cache, one batch per shard,
+        failing silently.
+
+        @param keys Keywords of items in cache.
+        '''
+        for shard, batch in self._batches(keys):
+            shard.delete_many(batch)
+
+    def _usage(self):
+        '''Gives the number of items in all shards and their size in
+        bytes.'''
+        usage = [shard._usage() for shard in self._shards]
+        entries = sum(u[0] for u in usage)
+        if any(u[1] is None for u in usage):
+            return entries, None
+        return entries, sum(u[1] for u in usage)
+
+    def _batches(self, keys):
+        '''Groups keys by the partition they are stored in.'''
+        batches = dict()
+        for key in keys:
+            batches.setdefault(hash(key) % len(self._shards), []).append(key)
+        return [(self._shards[i], batch) for i, batch in batches.items()]
+
+    def keys(self):
+        '''Returns a list of keys in the cache.'''
+        keys = list()
+        for shard in self._shards:
+            keys.extend(shard.keys())
+        return keys
+
+    def reap(self, limit=100):
+        '''Remove up to limit timed out items from each shard. Returns True
+        if more items have timed out.
+
+        @param limit Most items to examine per shard (default: 100)
+        '''
+        return any([shard.reap(limit) for shard in self._shards])
+
+    def _cull(self):
+        '''Remove items in each shard to make room.'''
+        for shard in self._shards:
+            shard._cull()
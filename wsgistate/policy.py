@@ -0,0 +1,390 @@
+# Copyright (c) 2026 the wsgistate contributors
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+'''Cache eviction policies.'''
+
+import random
+from collections import OrderedDict
+
+__all__ = ['BasePolicy', 'RandomPolicy', 'LRUPolicy', 'ARCPolicy',
+           'TinyLFUPolicy', 'CountMinSketch', 'getpolicy']
+
+
+def _promote(od, key):
+    '''Moves a key to the most recently used end of an OrderedDict.'''
+    try:
+        od.move_to_end(key)
+    # Python 2 OrderedDict has no move_to_end
+    except AttributeError:
+        od[key] = od.pop(key)
+
+
+def _oldest(od):
+    '''Gives the least recently used key of an OrderedDict.'''
+    return next(iter(od))
+
+
+def getpolicy(eviction, capacity):
+    '''Makes an eviction policy.
+
+    @param eviction Policy name or BasePolicy subclass
+    @param capacity Maximum number of items the cache holds
+    '''
+    if isinstance(eviction, type) and issubclass(eviction, BasePolicy):
+        return eviction(capacity)
+    try:
+        return policies[eviction](capacity)
+    except (KeyError, TypeError):
+        raise ValueError('Unknown eviction strategy %r' % (eviction,))
+
+
+class BasePolicy(object):
+
+    '''Base eviction policy.
+
+    A policy tracks the keys stored in a cache and chooses which one to evict
+    when the cache is full. The cache calls insert() for each new key,
+    access() on each hit, remove() when a key is deleted or expires and
+    evict() when it needs room.
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+
+    def __contains__(self, key):
+        '''Tell if a key is tracked by the policy.'''
+        raise NotImplementedError()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def insert(self, key):
+        '''Start tracking a newly stored key.
+
+        @param key Keyword of item in cache.
+        '''
+        raise NotImplementedError()
+
+    def access(self, key):
+        '''Record a cache hit on a key.
+
+        @param key Keyword of item in cache.
+        '''
+        raise NotImplementedError()
+
+    def remove(self, key):
+        '''Stop tracking a deleted or expired key, failing silently.
+
+        @param key Keyword of item in cache.
+        '''
+        raise NotImplementedError()
+
+    def evict(self, key=None):
+        '''Stop tracking and return the key to evict, or None if no keys are
+        tracked.
+
+        @param key Keyword of item that needs room (default: None)
+        '''
+        raise NotImplementedError()
+
+
+class RandomPolicy(BasePolicy):
+
+    '''Evicts keys at random.'''
+
+    def __init__(self, capacity):
+        super(RandomPolicy, self).__init__(capacity)
+        # Keys and the index of each key in the list of keys
+        self._keys, self._index = list(), dict()
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._keys)
+
+    def insert(self, key):
+        if key not in self._index:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+
+    def access(self, key):
+        pass
+
+    def remove(self, key):
+        idx = self._index.pop(key, None)
+        if idx is None:
+            return
+        # Fill the hole with the last key
+        last = self._keys.pop()
+        if idx < len(self._keys):
+            self._keys[idx], self._index[last] = last, idx
+
+    def evict(self, key=None):
+        if not self._keys:
+            return None
+        victim = random.choice(self._keys)
+        self.remove(victim)
+        return victim
+
+
+class LRUPolicy(BasePolicy):
+
+    '''Evicts the least recently used key.'''
+
+    def __init__(self, capacity):
+        super(LRUPolicy, self).__init__(capacity)
+        # Ordered oldest to most recently used
+        self._keys = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def insert(self, key):
+        self._keys[key] = True
+        _promote(self._keys, key)
+
+    def access(self, key):
+        if key in self._keys:
+            _promote(self._keys, key)
+
+    def remove(self, key):
+        self._keys.pop(key, None)
+
+    def evict(self, key=None):
+        if not self._keys:
+            return None
+        return self._keys.popitem(last=False)[0]
+
+
+class ARCPolicy(BasePolicy):
+
+    '''Adaptive Replacement Cache (Megiddo and Modha).
+
+    Balances a list of keys seen once (T1) against a list of keys seen more
+    than once (T2), steering the split with ghost lists of recently evicted
+    keys (B1, B2), so scans of one-hit keys can't flush out popular ones.
+    '''
+
+    def __init__(self, capacity):
+        super(ARCPolicy, self).__init__(capacity)
+        self._t1, self._t2 = OrderedDict(), OrderedDict()
+        self._b1, self._b2 = OrderedDict(), OrderedDict()
+        # Target size of T1
+        self._p = 0.0
+
+    def __contains__(self, key):
+        return key in self._t1 or key in self._t2
+
+    def __len__(self):
+        return len(self._t1) + len(self._t2)
+
+    def insert(self, key):
+        t1, t2, b1, b2 = self._t1, self._t2, self._b1, self._b2
+        c = self.capacity
+        if key in self:
+            self.access(key)
+        elif key in b1:
+            # Recently evicted from T1 so favor recency
+            self._p = min(c, self._p + max(len(b2) / float(len(b1)), 1.0))
+            del b1[key]
+            t2[key] = True
+        elif key in b2:
+            # Recently evicted from T2 so favor frequency
+            self._p = max(0.0, self._p - max(len(b1) / float(len(b2)), 1.0))
+            del b2[key]
+            t2[key] = True
+        else:
+            t1[key] = True
+            # Bound ghost lists to the capacity of the cache
+            if len(t1) + len(b1) > c and b1:
+                b1.popitem(last=False)
+            if len(t1) + len(t2) + len(b1) + len(b2) > 2 * c and b2:
+                b2.popitem(last=False)
+
+    def access(self, key):
+        if key in self._t1:
+            del self._t1[key]
+            self._t2[key] = True
+        elif key in self._t2:
+            _promote(self._t2, key)
+
+    def remove(self, key):
+        self._t1.pop(key, None)
+        self._t2.pop(key, None)
+
+    def evict(self, key=None):
+        t1, t2 = self._t1, self._t2
+        if not (t1 or t2):
+            return None
+        if t1 and (not t2 or len(t1) > self._p or
+                   (key in self._b2 and len(t1) == int(self._p))):
+            victim, ghosts = t1.popitem(last=False)[0], self._b1
+        else:
+            victim, ghosts = t2.popitem(last=False)[0], self._b2
+        # Remember evicted keys up to the capacity of the cache
+        ghosts[victim] = True
+        if len(ghosts) > self.capacity:
+            ghosts.popitem(last=False)
+        return victim
+
+
+class CountMinSketch(object):
+
+    '''Approximate access frequency counter.
+
+    Counts are capped at 15 and halved after every `sample` increments so
+    the sketch keeps track of recent popularity in fixed memory.
+    '''
+
+    _seeds = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F)
+
+    def __init__(self, capacity):
+        width = 16
+        while width < capacity:
+            width <<= 1
+        self._mask = width - 1
+        self._rows = [[0] * width for seed in self._seeds]
+        self._sample, self._additions = 10 * width, 0
+
+    def _indexes(self, key):
+        '''Gives the counter index for a key in each row.'''
+        h = hash(key)
+        mask = self._mask
+        return [((h * seed) >> 7 ^ h) & mask for seed in self._seeds]
+
+    def increment(self, key):
+        '''Count an access to a key.'''
+        for row, idx in zip(self._rows, self._indexes(key)):
+            if row[idx] < 15:
+                row[idx] += 1
+        self._additions += 1
+        if self._additions >= self._sample:
+            self._reset()
+
+    def frequency(self, key):
+        '''Gives the estimated access frequency of a key.'''
+        return min(
+            row[idx] for row, idx in zip(self._rows, self._indexes(key)))
+
+    def _reset(self):
+        '''Halve every count to age out past popularity.'''
+        for row in self._rows:
+            row[:] = [count >> 1 for count in row]
+        self._additions //= 2
+
+
+class TinyLFUPolicy(BasePolicy):
+
+    '''Window TinyLFU (Einziger, Friedman and Manes).
+
+    New keys enter a small LRU window. A key leaving the window only stays
+    in the main segmented LRU if a count-min sketch says it is accessed
+    more often than the key main would otherwise evict, so one-hit keys
+    can't displace popular ones.
+    '''
+
+    def __init__(self, capacity):
+        super(TinyLFUPolicy, self).__init__(capacity)
+        c = self.capacity
+        # 1% of capacity is the window, 80% of the rest is protected
+        self._window_max = max(1, c // 100)
+        self._protected_max = max(1, (c - self._window_max) * 4 // 5)
+        self._window = OrderedDict()
+        self._probation, self._protected = OrderedDict(), OrderedDict()
+        self._sketch = CountMinSketch(c)
+        # Most recent key to leave the window
+        self._candidate = None
+
+    def __contains__(self, key):
+        return (key in self._window or key in self._probation or
+                key in self._protected)
+
+    def __len__(self):
+        return (len(self._window) + len(self._probation) +
+                len(self._protected))
+
+    def insert(self, key):
+        if key in self:
+            self.access(key)
+            return
+        self._sketch.increment(key)
+        window = self._window
+        window[key] = True
+        # Keys leaving the window become candidates for main
+        if len(window) > self._window_max:
+            candidate = window.popitem(last=False)[0]
+            self._probation[candidate] = True
+            self._candidate = candidate
+
+    def access(self, key):
+        self._sketch.increment(key)
+        if key in self._window:
+            _promote(self._window, key)
+        elif key in self._probation:
+            # Second hit promotes to the protected segment
+            del self._probation[key]
+            self._protected[key] = True
+            if len(self._protected) > self._protected_max:
+                demoted = self._protected.popitem(last=False)[0]
+                self._probation[demoted] = True
+        elif key in self._protected:
+            _promote(self._protected, key)
+
+    def remove(self, key):
+        self._window.pop(key, None)
+        self._probation.pop(key, None)
+        self._protected.pop(key, None)
+
+    def evict(self, key=None):
+        for segment in (self._probation, self._protected, self._window):
+            if segment:
+                break
+        else:
+            return None
+        victim = _oldest(segment)
+        candidate = self._candidate
+        self._candidate = None
+        # Keep the newest candidate only if it is more popular than the
+        # key main would evict in its place
+        if (segment is self._probation and candidate in segment and
+                candidate != victim):
+            freq = self._sketch.frequency
+            if freq(candidate) <= freq(victim):
+                victim = candidate
+        del segment[victim]
+        return victim
+
+
+# Eviction policies by name
+policies = {
+    'random': RandomPolicy,
+    'lru': LRUPolicy,
+    'arc': ARCPolicy,
+    'tinylfu': TinyLFUPolicy,
+}
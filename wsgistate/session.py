@@ -30,8 +30,6 @@ import os
 import string
 import weakref
 import atexit
-import cgi
-import urllib
 import random
 import sys
 import hashlib
@@ -50,9 +48,10 @@ except ImportError:
     from http.cookies import SimpleCookie
 
 try:
-    from urllib import quote
+    from urllib import quote, urlencode
+    from urlparse import parse_qsl
 except ImportError:
-    from urllib.parse import quote
+    from urllib.parse import quote, urlencode, parse_qsl
 
 try:
     import threading
@@ -67,6 +66,15 @@ __all__ = ['SessionCache', 'SessionManager', 'CookieSession', 'URLSession',
            'session', 'urlsession']
 
 
+def _sessionid(secret):
+    '''Makes a random session id.'''
+    # str() rather than bytes() so Python 3 hashes digits, like Python 2
+    return hashlib.new('sha1', (
+        str(random.randint(0, platform_c_maxint - 1)) +
+        str(random.randint(0, platform_c_maxint - 1)) + secret
+        ).encode('utf-8')).hexdigest()
+
+
 def _shutdown(ref):
     cache = ref()
     if cache is not None:
@@ -165,6 +173,8 @@ class SessionCache(object):
                 self.cache.set(sid, sess)
             self.checkedout.clear()
             self.cache._cull()
+            # Stop any background reaper
+            self.cache.close()
             self._closed = True
 
     # Utilities
@@ -173,10 +183,7 @@ class SessionCache(object):
         'Returns session key that is not being used.'
         sid = None
         for num in xrange(10000):
-            sid = hashlib.new('sha1',
-                bytes(random.randint(0, platform_c_maxint - 1)) +
-                bytes(random.randint(0, platform_c_maxint - 1)) + self._secret.encode('utf-8')
-                ).hexdigest()
+            sid = _sessionid(self._secret)
             if sid not in self.cache:
                 break
         return sid
@@ -192,32 +199,53 @@ class SessionManager(object):
         self._path = kw.get('path', '/')
         self.session = self._sid = self._csid = None
         self.expired = self.current = self.new = self.inurl = False
+        self._qdict = dict()
         self._get(environ)
 
     def _fromcookie(self, environ):
         '''Attempt to load the associated session using the identifier from
         the cookie.
         '''
-        cookie = SimpleCookie(environ.get('HTTP_COOKIE'))
-        morsel = cookie.get(self._fieldname, None)
-        if morsel is not None:
-            self._sid, self.session = self._cache.checkout(morsel.value)
-            self._csid = morsel.value
-            if self._csid != self._sid:
-                self.new = True
+        value = self._cookieid(environ)
+        if value is not None:
+            self._checkedout(value, self._cache.checkout(value), False)
 
     def _fromquery(self, environ):
         '''Attempt to load the associated session using the identifier from
         the query string.
         '''
-        self._qdict = dict(cgi.parse_qsl(environ.get('QUERY_STRING', '')))
-        value = self._qdict.get(self._fieldname)
+        value = self._queryid(environ)
         if value is not None:
-            self._sid, self.session = self._cache.checkout(value)
-            if self._sid is not None:
-                self._csid, self.inurl = value, True
-                if self._csid != self._sid:
-                    self.current = self.new = True
+            self._checkedout(value, self._cache.checkout(value), True)
+
+    def _cookieid(self, environ):
+        '''Gives the session identifier in the cookie or None.'''
+        cookie = SimpleCookie(environ.get('HTTP_COOKIE'))
+        morsel = cookie.get(self._fieldname, None)
+        return None if morsel is None else morsel.value
+
+    def _queryid(self, environ):
+        '''Gives the session identifier in the query string or None.'''
+        self._qdict = dict(parse_qsl(environ.get('QUERY_STRING', '')))
+        return self._qdict.get(self._fieldname)
+
+    def _checkedout(self, value, checkout, inurl):
+        '''Associates with the session checked out for an identifier.
+
+        @param value Session identifier from the request
+        @param checkout Session id and session the cache checked out
+        @param inurl True if the identifier came from the query string
+        '''
+        sid, sess = checkout
+        if not inurl:
+            self._sid, self.session, self._csid = sid, sess, value
+            if self._csid != self._sid:
+                self.new = True
+        elif sid is not None:
+            self._sid, self.session = sid, sess
+            self._csid, self.inurl = value, True
+            if self._csid != self._sid:
+                self.current = self.new = True
 
     def _get(self, environ):
         '''Attempt to associate with an existing Session.'''
@@ -252,7 +280,7 @@ class SessionManager(object):
             self._qdict[self._fieldname] = self._sid
         else:
             self._qdict = {self._fieldname: self._sid}
-        return '?'.join([path, urllib.urlencode(self._qdict)])
+        return '?'.join([path, urlencode(self._qdict)])
 
 
 class _Session(object):
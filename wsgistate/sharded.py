@@ -0,0 +1,383 @@
+# Copyright (c) 2026 the wsgistate contributors
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+'''Cache that spreads keys over several caches with consistent hashing.'''
+
+import os
+import bisect
+import hashlib
+import importlib
+from multiprocessing.pool import ThreadPool
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+from wsgistate import BaseCache
+from wsgistate.cache import WsgiMemoize
+from wsgistate.session import CookieSession, URLSession, SessionCache
+
+__all__ = ['ShardedCache', 'memoize', 'session', 'urlsession']
+
+# Backends that 'backends' settings can name, by scheme
+_BACKENDS = {
+    'simple': ('wsgistate.simple', 'SimpleCache'),
+    'memory': ('wsgistate.memory', 'MemoryCache'),
+    'file': ('wsgistate.file', 'FileCache'),
+    'db': ('wsgistate.db', 'DbCache'),
+    'memcached': ('wsgistate.memcached', 'MemCached'),
+    'shm': ('wsgistate.shm', 'ShmCache'),
+}
+
+
+def backends(specs, **kw):
+    '''Makes caches from a list of 'scheme:argument' specifications, like
+    'file:/var/cache/a' or 'memcached:127.0.0.1:11211', as a dict keyed by
+    specification.
+
+    @param specs Specifications as a list or a whitespace separated string
+    '''
+    if isinstance(specs, str):
+        specs = specs.split()
+    # The remaining settings configure every backend
+    kw.pop('backends', None)
+    # One reaper, the ShardedCache's, sweeps every shard
+    kw.pop('reap_interval', None)
+    caches = dict()
+    for spec in specs:
+        scheme, _, arg = spec.partition(':')
+        try:
+            module, name = _BACKENDS[scheme]
+        except KeyError:
+            raise ValueError('Unknown cache backend %r' % spec)
+        cls = getattr(importlib.import_module(module), name)
+        caches[spec] = cls(arg, **kw) if arg else cls(**kw)
+    return caches
+
+
+def shardedmemo_deploy(global_conf, **kw):
+    '''Paste Deploy loader for caching.'''
+    def decorator(application):
+        _sharded_memo_cache = ShardedCache(
+            backends(kw['backends'], **kw), **kw)
+        return WsgiMemoize(application, _sharded_memo_cache, **kw)
+    return decorator
+
+
+def shardedsess_deploy(global_conf, **kw):
+    '''Paste Deploy loader for sessions.'''
+    def decorator(application):
+        _sharded_base_cache = ShardedCache(
+            backends(kw['backends'], **kw), **kw)
+        _sharded_session_cache = SessionCache(_sharded_base_cache, **kw)
+        return CookieSession(application, _sharded_session_cache, **kw)
+    return decorator
+
+
+def shardedurlsess_deploy(global_conf, **kw):
+    '''Paste Deploy loader for URL encoded sessions.'''
+    def decorator(application):
+        _sharded_ubase_cache = ShardedCache(
+            backends(kw['backends'], **kw), **kw)
+        _sharded_url_cache = SessionCache(_sharded_ubase_cache, **kw)
+        return URLSession(application, _sharded_url_cache, **kw)
+    return decorator
+
+
+def memoize(shards, **kw):
+    '''Decorator for caching.
+
+    @param shards Caches to spread keys over
+    '''
+    def decorator(application):
+        _sharded_memo_cache = ShardedCache(shards, **kw)
+        return WsgiMemoize(application, _sharded_memo_cache, **kw)
+    return decorator
+
+
+def session(shards, **kw):
+    '''Decorator for sessions.
+
+    @param shards Caches to spread keys over
+    '''
+    def decorator(application):
+        _sharded_base_cache = ShardedCache(shards, **kw)
+        _sharded_session_cache = SessionCache(_sharded_base_cache, **kw)
+        return CookieSession(application, _sharded_session_cache, **kw)
+    return decorator
+
+
+def urlsession(shards, **kw):
+    '''Decorator for URL encoded sessions.
+
+    @param shards Caches to spread keys over
+    '''
+    def decorator(application):
+        _sharded_ubase_cache = ShardedCache(shards, **kw)
+        _sharded_url_cache = SessionCache(_sharded_ubase_cache, **kw)
+        return URLSession(application, _sharded_url_cache, **kw)
+    return decorator
+
+
+def _hash(value):
+    '''Gives the position of a value on the ring.'''
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return int(hashlib.md5(value).hexdigest()[:8], 16)
+
+
+class ShardedCache(BaseCache):
+
+    '''Cache that spreads keys over several caches (shards) with a
+    consistent-hash ring.
+
+    Each shard is placed on the ring at `vnodes` points (default: 100)
+    derived from its name and a key goes to the shard owning the next point
+    after the key's hash, so adding or removing one of N shards moves only
+    about 1/N of the keys. Name shards by passing a dict of names and
+    caches; shards passed as a list are named by position. Batches are
+    split per shard and run in parallel on up to `workers` threads
+    (default: one per shard).
+    '''
+
+    def __init__(self, shards, **kw):
+        super(ShardedCache, self).__init__(shards, **kw)
+        try:
+            self._vnodes = max(1, int(kw.get('vnodes', 100)))
+        except (ValueError, TypeError):
+            self._vnodes = 100
+        if not isinstance(shards, dict):
+            shards = dict((str(i), s) for i, s in enumerate(shards))
+        if not shards:
+            raise ValueError('ShardedCache needs at least one shard')
+        self._shards = dict(shards)
+        self._lock = threading.Lock()
+        self._ring()
+        try:
+            self._workers = int(kw.get('workers') or 0)
+        except (ValueError, TypeError):
+            self._workers = 0
+        self._pool, self._pid = None, None
+        self._startreaper(kw)
+
+    def _ring(self):
+        '''Places the shards on the ring.'''
+        points = sorted(
+            (_hash('%s#%d' % (name, i)), name)
+            for name in self._shards for i in range(self._vnodes))
+        # Swap in whole so lookups never see a half built ring
+        self._points = (
+            [p[0] for p in points], [p[1] for p in points], dict(self._shards))
+
+    def add_shard(self, name, cache):
+        '''Adds a shard to the ring, moving about 1/N of the keys to it.
+
+        @param name Shard name
+        @param cache Cache
+        '''
+        with self._lock:
+            shards = dict(self._shards)
+            shards[name] = cache
+            self._shards = shards
+            self._ring()
+
+    def remove_shard(self, name):
+        '''Removes a shard from the ring, moving its keys to the others.
+        Returns the removed cache.
+
+        @param name Shard name
+        '''
+        with self._lock:
+            if len(self._shards) == 1:
+                raise ValueError('ShardedCache needs at least one shard')
+            shards = dict(self._shards)
+            cache = shards.pop(name)
+            self._shards = shards
+            self._ring()
+        return cache
+
+    @property
+    def shards(self):
+        '''Dict of shard names and caches.'''
+        return dict(self._shards)
+
+    @property
+    def threadsafe(self):
+        '''Tells if every shard is thread-safe.'''
+        return all(getattr(s, 'threadsafe', False)
+                   for s in self._shards.values())
+
+    def shardname(self, key):
+        '''Gives the name of the shard a key is stored in.'''
+        return self._locate(key, self._points)
+
+    def _locate(self, key, points):
+        '''Gives the name of the shard owning a key on a ring.'''
+        hashes, names = points[:2]
+        idx = bisect.bisect(hashes, _hash(key))
+        return names[idx if idx < len(names) else 0]
+
+    def _shard(self, key):
+        '''Gives the shard a key is stored in.'''
+        points = self._points
+        return points[2][self._locate(key, points)]
+
+    def _batches(self, keys):
+        '''Groups keys by the shard they are stored in.'''
+        points, batches = self._points, dict()
+        for key in keys:
+            batches.setdefault(self._locate(key, points), []).append(key)
+        return [(points[2][n], batch) for n, batch in batches.items()]
+
+    def _parallel(self, func, batches):
+        '''Calls func(shard, batch) for every batch, in parallel if there's
+        more than one, and returns the results.'''
+        if len(batches) < 2:
+            return [func(shard, batch) for shard, batch in batches]
+        if self._pid != os.getpid():
+            with self._lock:
+                # Threads don't survive a fork so start new ones
+                if self._pid != os.getpid():
+                    self._pool = ThreadPool(
+                        self._workers or len(self._shards))
+                    self._pid = os.getpid()
+        return self._pool.map(lambda b: func(*b), batches)
+
+    def get(self, key, default=None):
+        '''Fetch a given key from the cache. If the key does not exist, return
+        default, which itself defaults to None.
+
+        @param key Keyword of item in cache.
+        @param default Default value (default: None)
+        '''
+        return self._shard(key).get(key, default)
+
+    def set(self, key, value, timeout=None):
+        '''Set a value in the cache.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        self._shard(key).set(key, value, self._timeout(timeout))
+
+    def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        return self._shard(key).add(key, value, self._timeout(timeout))
+
+    def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        return self._shard(key).touch(key, self._timeout(timeout))
+
+    def delete(self, key):
+        '''Delete a key from the cache, failing silently.
+
+        @param key Keyword of item in cache.
+        '''
+        self._shard(key).delete(key)
+
+    def get_many(self, keys):
+        '''Fetch a bunch of keys from the cache, one batch per shard. Returns
+        a dict mapping each key in keys to its value. If the given key is
+        missing, it will be missing from the response dict.
+
+        @param keys Keywords of items in cache.
+        '''
+        d = dict()
+        for found in self._parallel(
+                lambda shard, batch: shard.get_many(batch),
+                self._batches(keys)):
+            d.update(found)
+        return d
+
+    def set_many(self, mapping, timeout=None):
+        '''Set a bunch of values in the cache, one batch per shard.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: self.timeout)
+        '''
+        timeout = self._timeout(timeout)
+        self._parallel(
+            lambda shard, batch: shard.set_many(
+                dict((k, mapping[k]) for k in batch), timeout),
+            self._batches(mapping))
+
+    def delete_many(self, keys):
+        '''Delete a bunch of keys from the cache, one batch per shard,
+        failing silently.
+
+        @param keys Keywords of items in cache.
+        '''
+        self._parallel(
+            lambda shard, batch: shard.delete_many(batch),
+            self._batches(keys))
+
+    def _usage(self):
+        '''Gives the number of items in all shards and their size in bytes,
+        None when any shard can't tell.'''
+        usage = [shard._usage() for shard in self._shards.values()]
+        entries = [u[0] for u in usage]
+        nbytes = [u[1] for u in usage]
+        return (None if None in entries else sum(entries),
+                None if None in nbytes else sum(nbytes))
+
+    def reap(self, limit=100):
+        '''Remove up to limit timed out items from each shard. Returns True
+        if more items have timed out.
+
+        Shards that reap themselves are left to their own reapers, and
+        shards that aren't thread-safe aren't reaped, since the reaper runs
+        in a background thread.
+
+        @param limit Most items to examine per shard (default: 100)
+        '''
+        return any([s.reap(limit) for s in self._shards.values()
+                    if getattr(s, '_reaper', None) is None and
+                    getattr(s, 'threadsafe', False)])
+
+    def _cull(self):
+        '''Remove items in each shard to make room.'''
+        for shard in self._shards.values():
+            shard._cull()
+
+    def close(self):
+        '''Stop background reapers and worker threads.'''
+        super(ShardedCache, self).close()
+        for shard in self._shards.values():
+            shard.close()
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.close()
+        self._pool, self._pid = None, None
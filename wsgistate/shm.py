@@ -0,0 +1,393 @@
+# Copyright (c) 2026 the wsgistate contributors
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+'''Shared memory cache backend for pre-fork servers.'''
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import mmap
+import time
+import struct
+import hashlib
+import multiprocessing
+
+from wsgistate import BaseCache
+from wsgistate.cache import WsgiMemoize
+from wsgistate.session import CookieSession, URLSession, SessionCache
+
+__all__ = ['ShmCache', 'memoize', 'session', 'urlsession']
+
+# Slot header: state, key length, value length, key hash, expiration time
+# and last access time
+_HEADER = struct.Struct('<BIIQdd')
+_EMPTY, _USED = 0, 1
+
+
+def shmmemo_deploy(global_conf, **kw):
+    '''Paste Deploy loader for caching.'''
+    def decorator(application):
+        _shm_memo_cache = ShmCache(**kw)
+        return WsgiMemoize(application, _shm_memo_cache, **kw)
+    return decorator
+
+
+def shmsess_deploy(global_conf, **kw):
+    '''Paste Deploy loader for sessions.'''
+    def decorator(application):
+        _shm_base_cache = ShmCache(**kw)
+        _shm_session_cache = SessionCache(_shm_base_cache, **kw)
+        return CookieSession(application, _shm_session_cache, **kw)
+    return decorator
+
+
+def shmurlsess_deploy(global_conf, **kw):
+    '''Paste Deploy loader for URL encoded sessions.'''
+    def decorator(application):
+        _shm_ubase_cache = ShmCache(**kw)
+        _shm_url_cache = SessionCache(_shm_ubase_cache, **kw)
+        return URLSession(application, _shm_url_cache, **kw)
+    return decorator
+
+
+def memoize(**kw):
+    '''Decorator for caching.'''
+    def decorator(application):
+        _shm_memo_cache = ShmCache(**kw)
+        return WsgiMemoize(application, _shm_memo_cache, **kw)
+    return decorator
+
+
+def session(**kw):
+    '''Decorator for sessions.'''
+    def decorator(application):
+        _shm_base_cache = ShmCache(**kw)
+        _shm_session_cache = SessionCache(_shm_base_cache, **kw)
+        return CookieSession(application, _shm_session_cache, **kw)
+    return decorator
+
+
+def urlsession(**kw):
+    '''Decorator for URL encoded sessions.'''
+    def decorator(application):
+        _shm_ubase_cache = ShmCache(**kw)
+        _shm_url_cache = SessionCache(_shm_ubase_cache, **kw)
+        return URLSession(application, _shm_url_cache, **kw)
+    return decorator
+
+
+def _intkw(kw, name, default):
+    '''Gets a positive integer setting.'''
+    try:
+        value = int(kw.get(name, default))
+    except (ValueError, TypeError):
+        value = default
+    return max(1, value)
+
+
+class ShmCache(BaseCache):
+
+    '''Shared memory cache backend for pre-fork servers.
+
+    Items live in a fixed-size hash table in an anonymous shared memory
+    map. Only processes forked after the cache is created share it, so it
+    must be created in the server's master process before the workers are
+    forked (with the application preloaded); a cache each worker creates
+    for itself is private to that worker.
+
+    The table is split into buckets of `ways` slots, each holding up to
+    `slot_size` bytes of key and pickled value (default: 65536). A key can
+    only be stored in the bucket its hash picks, and a full bucket evicts
+    its least recently used item. Buckets are guarded by a stripe of
+    `locks` process-shared locks. Items too big for a slot are not cached
+    and are counted as 'rejections'. Statistics are counted per process.
+    The operating system only commits memory for the parts of the map
+    that have been written.
+    '''
+
+    def __init__(self, *a, **kw):
+        super(ShmCache, self).__init__(*a, **kw)
+        self._ways = _intkw(kw, 'ways', 8)
+        # Largest key and pickled value in bytes a slot holds
+        self._slot_data = _intkw(kw, 'slot_size', 65536)
+        self._slot_size = _HEADER.size + self._slot_data
+        self._buckets = max(
+            1, _intkw(kw, 'max_entries', 1024) // self._ways)
+        self._map = mmap.mmap(
+            -1, self._buckets * self._ways * self._slot_size)
+        self._locks = [
+            multiprocessing.Lock()
+            for i in range(min(self._buckets, _intkw(kw, 'locks', 64)))]
+
+    def get(self, key, default=None):
+        '''Fetch a given key from the cache.  If the key does not exist, return
+        default, which itself defaults to None.
+
+        @param key Keyword of item in cache.
+        @param default Default value (default: None)
+        '''
+        bkey, khash = self._hash(key)
+        with self._lock(khash):
+            data = self._read(bkey, khash, time.time())
+        if data is None:
+            return default
+        return pickle.loads(data)
+
+    def get_many(self, keys):
+        '''Fetch a bunch of keys from the cache, taking each lock once.
+        Returns a dict mapping each key in keys to its value. If the given
+        key is missing, it will be missing from the response dict.
+
+        @param keys Keywords of items in cache.
+        '''
+        found, now = dict(), time.time()
+        for lock, batch in self._batches(keys):
+            with lock:
+                for key, bkey, khash in batch:
+                    data = self._read(bkey, khash, now)
+                    if data is not None:
+                        found[key] = data
+        # Unpickle outside of the locks
+        return dict((k, pickle.loads(v)) for k, v in found.items())
+
+    def set(self, key, value, timeout=None):
+        '''Set a value in the cache.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        bkey, khash = self._hash(key)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock(khash):
+            self._store(bkey, khash, data, timeout)
+
+    def set_many(self, mapping, timeout=None):
+        '''Set a bunch of values in the cache, taking each lock once.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: self.timeout)
+        '''
+        dumps, protocol = pickle.dumps, pickle.HIGHEST_PROTOCOL
+        data = dict((k, dumps(v, protocol)) for k, v in mapping.items())
+        for lock, batch in self._batches(data):
+            with lock:
+                for key, bkey, khash in batch:
+                    self._store(bkey, khash, data[key], timeout)
+
+    def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        bkey, khash = self._hash(key)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock(khash):
+            offset = self._find(bkey, khash)
+            if offset is not None and self._expires(offset) >= time.time():
+                return False
+            return self._store(bkey, khash, data, timeout)
+
+    def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        bkey, khash = self._hash(key)
+        with self._lock(khash):
+            offset = self._find(bkey, khash)
+            now = time.time()
+            if offset is None or self._expires(offset) < now:
+                return False
+            header = _HEADER.unpack_from(self._map, offset)
+            _HEADER.pack_into(
+                self._map, offset,
+                *(header[:4] + (now + self._timeout(timeout), now)))
+            return True
+
+    def delete(self, key):
+        '''Delete a key from the cache, failing silently.
+
+        @param key Keyword of item in cache.
+        '''
+        bkey, khash = self._hash(key)
+        with self._lock(khash):
+            offset = self._find(bkey, khash)
+            if offset is not None:
+                self._clear(offset)
+
+    def delete_many(self, keys):
+        '''Delete a bunch of keys from the cache, taking each lock once and
+        failing silently.
+
+        @param keys Keywords of items in cache.
+        '''
+        for lock, batch in self._batches(keys):
+            with lock:
+                for key, bkey, khash in batch:
+                    offset = self._find(bkey, khash)
+                    if offset is not None:
+                        self._clear(offset)
+
+    def keys(self):
+        '''Returns a list of keys in the cache.'''
+        keys, now = list(), time.time()
+        for bucket in range(self._buckets):
+            with self._locks[bucket % len(self._locks)]:
+                for offset in self._slots(bucket):
+                    header = _HEADER.unpack_from(self._map, offset)
+                    if header[0] == _USED and header[4] >= now:
+                        start = offset + _HEADER.size
+                        keys.append(
+                            self._map[start:start + header[1]].decode('utf-8'))
+        return keys
+
+    def _hash(self, key):
+        '''Gives a key as bytes and a hash of it that is the same in every
+        process.'''
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return key, struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0]
+
+    def _lock(self, khash):
+        '''Gives the lock guarding the bucket for a key hash.'''
+        return self._locks[(khash % self._buckets) % len(self._locks)]
+
+    def _batches(self, keys):
+        '''Groups keys with their bytes and hash by the lock guarding them.'''
+        batches, locks = dict(), self._locks
+        for key in keys:
+            bkey, khash = self._hash(key)
+            idx = (khash % self._buckets) % len(locks)
+            batches.setdefault(idx, []).append((key, bkey, khash))
+        return [(locks[idx], batch) for idx, batch in batches.items()]
+
+    def _slots(self, bucket):
+        '''Gives the offsets of the slots in a bucket.'''
+        size = self._slot_size
+        first = bucket * self._ways * size
+        return range(first, first + self._ways * size, size)
+
+    def _find(self, bkey, khash):
+        '''Gives the offset of the slot holding a key or None. The caller
+        must hold the bucket's lock.'''
+        mm, hsize = self._map, _HEADER.size
+        for offset in self._slots(khash % self._buckets):
+            state, klen, vlen, slot_hash = _HEADER.unpack_from(mm, offset)[:4]
+            if (state == _USED and slot_hash == khash and
+                    mm[offset + hsize:offset + hsize + klen] == bkey):
+                return offset
+        return None
+
+    def _read(self, bkey, khash, now):
+        '''Gives the pickled value of a key or None, removing it if it has
+        timed out. The caller must hold the bucket's lock.'''
+        offset = self._find(bkey, khash)
+        if offset is None:
+            return None
+        header = _HEADER.unpack_from(self._map, offset)
+        # Delete if item timed out
+        if header[4] < now:
+            self._stats.incr('expirations')
+            self._clear(offset)
+            return None
+        _HEADER.pack_into(self._map, offset, *(header[:5] + (now,)))
+        start = offset + _HEADER.size + header[1]
+        return self._map[start:start + header[2]]
+
+    def _store(self, bkey, khash, data, timeout):
+        '''Writes an item to its bucket, evicting the least recently used
+        item if the bucket is full. The caller must hold the bucket's lock.
+        Returns True if the item fit in a slot.'''
+        mm, hsize = self._map, _HEADER.size
+        offset = self._find(bkey, khash)
+        # Never store items that can't fit in a slot
+        if len(bkey) + len(data) > self._slot_data:
+            self._stats.incr('rejections')
+            if offset is not None:
+                self._clear(offset)
+            return False
+        if offset is None:
+            now, oldest = time.time(), None
+            for slot in self._slots(khash % self._buckets):
+                header = _HEADER.unpack_from(mm, slot)
+                # Reuse empty or timed out slots first
+                if header[0] == _EMPTY or header[4] < now:
+                    if header[0] == _USED:
+                        self._stats.incr('expirations')
+                    offset, oldest = slot, None
+                    break
+                if oldest is None or header[5] < oldest:
+                    offset, oldest = slot, header[5]
+            if oldest is not None:
+                self._stats.incr('evictions')
+        now = time.time()
+        start = offset + hsize
+        mm[start:start + len(bkey)] = bkey
+        mm[start + len(bkey):start + len(bkey) + len(data)] = data
+        _HEADER.pack_into(
+            mm, offset, _USED, len(bkey), len(data), khash,
+            now + self._timeout(timeout), now)
+        return True
+
+    def _expires(self, offset):
+        '''Gives the expiration time of the item in a slot.'''
+        return _HEADER.unpack_from(self._map, offset)[4]
+
+    def _clear(self, offset):
+        '''Empties a slot.'''
+        _HEADER.pack_into(self._map, offset, _EMPTY, 0, 0, 0, 0.0, 0.0)
+
+    def _usage(self):
+        '''Gives the number of live items in the cache and the size of their
+        keys and values in bytes.'''
+        entries, nbytes, now = 0, 0, time.time()
+        for bucket in range(self._buckets):
+            with self._locks[bucket % len(self._locks)]:
+                for offset in self._slots(bucket):
+                    header = _HEADER.unpack_from(self._map, offset)
+                    if header[0] == _USED and header[4] >= now:
+                        entries += 1
+                        nbytes += header[1] + header[2]
+        return entries, nbytes
+
+    def _cull(self):
+        '''Remove timed out items.'''
+        self._stats.incr('culls')
+        now = time.time()
+        for bucket in range(self._buckets):
+            with self._locks[bucket % len(self._locks)]:
+                for offset in self._slots(bucket):
+                    header = _HEADER.unpack_from(self._map, offset)
+                    if header[0] == _USED and header[4] < now:
+                        self._stats.incr('expirations')
+                        self._clear(offset)
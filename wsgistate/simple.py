@@ -31,8 +31,14 @@
 '''Single-process in-memory cache backend.'''
 
 import time
+import heapq
 import random
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 from wsgistate import BaseCache
+from wsgistate.policy import getpolicy
 from wsgistate.cache import WsgiMemoize
 from wsgistate.session import CookieSession, URLSession, SessionCache
 
@@ -94,23 +100,51 @@ def urlsession(**kw):
     return decorator
 
 
+def sizeof(value):
+    '''Estimates the memory held by a cached value from its serialized
+    length.
+
+    @param value Cached value
+    '''
+    if isinstance(value, bytes):
+        return len(value)
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
 class SimpleCache(BaseCache):
 
     '''Single-process in-memory cache backend.'''
 
+    threadsafe = False
+
     def __init__(self, *a, **kw):
         super(SimpleCache, self).__init__(*a, **kw)
         # Get random seed
         random.seed()
         self._cache = dict()
+        # Min-heap of (expiration time, key) pairs, invalidated lazily
+        self._expiry = list()
         # Set max entries
         max_entries = kw.get('max_entries', 300)
         try:
             self._max_entries = int(max_entries)
         except (ValueError, TypeError):
             self._max_entries = 300
-        # Set maximum number of items to cull if over max
-        self._maxcull = kw.get('maxcull', 10)
+        # Eviction policy once the cache is full ('random', 'lru', 'arc',
+        # 'tinylfu' or a policy.BasePolicy subclass)
+        self._policy = getpolicy(
+            kw.get('eviction', 'random'), self._max_entries)
+        # 'maxcull' is accepted but unused: eviction policies remove only
+        # what is needed to make room
+        # Set max total size of values in bytes (default: unlimited)
+        try:
+            self._max_bytes = int(kw.get('max_bytes') or 0)
+        except (ValueError, TypeError):
+            self._max_bytes = 0
+        # Size estimator for values
+        self._sizeof = kw.get('sizeof', sizeof)
+        # Current total size of values in bytes
+        self.nbytes = 0
 
     def get(self, key, default=None):
         '''Fetch a given key from the cache.  If the key does not exist, return
@@ -124,51 +158,174 @@ class SimpleCache(BaseCache):
             return default
         # Delete if item timed out and return default.
         if values[0] < time.time():
+            self._stats.incr('expirations')
             self.delete(key)
             return default
+        self._policy.access(key)
         return values[1]
 
-    def set(self, key, value):
+    def set(self, key, value, timeout=None):
         '''Set a value in the cache.
 
         @param key Keyword of item in cache.
         @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
         '''
-        # Cull timed out values if over max # of entries
-        if len(self._cache) >= self._max_entries:
-            self._cull()
+        now = time.time()
+        # Reclaim slots held by timed out items first
+        self._purge(now)
+        # Release any space held by the current value
+        self._release(key)
+        size = self._max_bytes and self._sizeof(value)
+        # Never store values that can't fit in the cache at all
+        if size > self._max_bytes:
+            self._stats.incr('rejections')
+            self._policy.remove(key)
+            return
+        # Evict values if over max # of entries or bytes
+        if self._full(size):
+            # The old value is gone, so the key can't be a victim
+            self._policy.remove(key)
+            self._cull(size, key)
 
         # Set value and timeout in cache
-        self._cache[key] = (time.time() + self.timeout, value)
+        expires = now + self._timeout(timeout)
+        self._cache[key] = (expires, value, size)
+        self.nbytes += size
+        self._schedule(key, expires)
+        self._track(key)
+
+    def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        values = self._cache.get(key)
+        if values is not None and values[0] >= time.time():
+            return False
+        self.set(key, value, timeout)
+        return True
+
+    def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        values = self._cache.get(key)
+        now = time.time()
+        if values is None or values[0] < now:
+            return False
+        expires = now + self._timeout(timeout)
+        self._cache[key] = (expires,) + values[1:]
+        self._schedule(key, expires)
+        return True
 
     def delete(self, key):
         '''Delete a key from the cache, failing silently.
 
         @param key Keyword of item in cache.
         '''
-        try:
-            del self._cache[key]
-        except KeyError:
-            pass
+        self._remove(key)
 
     def keys(self):
         '''Returns a list of keys in the cache.'''
         return self._cache.keys()
 
-    def _cull(self):
-        '''Remove items in cache to make room.'''
-        num, maxcull = 0, self._maxcull
-        # Cull number of items allowed (set by self._maxcull)
-        for key in self.keys():
-            # Remove only maximum # of items allowed by maxcull
-            if num <= maxcull:
-                # Remove items if expired
-                if self.get(key) is None:
-                    num += 1
-            else:
-                break
-        # Remove any additional items up to max # of items allowed by maxcull
-        while len(self.keys()) >= self._max_entries and num <= maxcull:
-            # Cull remainder of allowed quota at random
-            self.delete(random.choice(self.keys()))
+    def _usage(self):
+        '''Gives the number of items in the cache and their size in bytes,
+        None unless 'max_bytes' is set.'''
+        return len(self._cache), self.nbytes if self._max_bytes else None
+
+    def _track(self, key):
+        '''Records a use of a key with the eviction policy.'''
+        if key in self._policy:
+            self._policy.access(key)
+        else:
+            self._policy.insert(key)
+
+    def _release(self, key):
+        '''Delete a key's value from the cache and release its space.'''
+        values = self._cache.pop(key, None)
+        if values is not None:
+            self.nbytes -= values[2]
+
+    def _remove(self, key):
+        '''Delete a key from the cache and its eviction policy.'''
+        self._release(key)
+        self._policy.remove(key)
+
+    def _full(self, size=0):
+        '''Tells if the cache needs room to fit a new item.
+
+        @param size Size of new item in bytes
+        '''
+        if len(self._cache) >= self._max_entries:
+            return True
+        return bool(self._max_bytes) and self.nbytes + size > self._max_bytes
+
+    def _schedule(self, key, expires):
+        '''Adds a key to the expiration index.
+
+        @param key Keyword of item in cache.
+        @param expires Expiration time of item.
+        '''
+        expiry = self._expiry
+        heapq.heappush(expiry, (expires, key))
+        # Rebuild the index once overwritten or deleted items dominate it
+        if len(expiry) > 2 * len(self._cache) + 64:
+            expiry[:] = [(v[0], k) for k, v in self._cache.items()]
+            heapq.heapify(expiry)
+
+    def reap(self, limit=100):
+        '''Remove up to limit timed out items, earliest first. Returns True
+        if more items have timed out.
+
+        SimpleCache isn't thread-safe, so only MemoryCache runs a background
+        reaper with this.
+
+        @param limit Most items to examine (default: 100)
+        '''
+        now = time.time()
+        self._purge(now, limit)
+        expiry = self._expiry
+        return bool(expiry) and expiry[0][0] < now
+
+    def _purge(self, now=None, limit=None):
+        '''Removes items that have timed out, earliest first.
+
+        @param now Current time (default: time.time())
+        @param limit Most index entries to examine (default: unlimited)
+        '''
+        if now is None:
+            now = time.time()
+        cache, expiry, num = self._cache, self._expiry, 0
+        while expiry and expiry[0][0] < now and num != limit:
+            expires, key = heapq.heappop(expiry)
             num += 1
+            values = cache.get(key)
+            # Skip index entries for items overwritten or deleted since
+            if values is not None and values[0] == expires:
+                self._stats.incr('expirations')
+                self._remove(key)
+
+    def _cull(self, size=0, key=None):
+        '''Remove items in cache to make room.
+
+        @param size Size in bytes of the item that needs room (default: 0)
+        @param key Keyword of the item that needs room (default: None)
+        '''
+        self._stats.incr('culls')
+        # Remove all timed out items
+        self._purge()
+        # Evict items chosen by the eviction policy until there's room
+        while self._cache and self._full(size):
+            victim = self._policy.evict(key)
+            if victim is None:
+                break
+            self._stats.incr('evictions')
+            self._release(victim)
@@ -0,0 +1,299 @@
+# Copyright (c) 2026 the wsgistate contributors
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+'''Cache statistics.'''
+
+import time
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+__all__ = ['Stats', 'NullStats', 'instrument', 'COUNTERS', 'OPERATIONS']
+
+# Event counters every cache reports ('rejections' counts values too big
+# to store)
+COUNTERS = ('hits', 'misses', 'sets', 'deletes', 'expirations', 'evictions',
+            'culls', 'rejections')
+
+# Cache methods that are timed
+OPERATIONS = ('get', 'set', 'add', 'touch', 'delete', 'get_many', 'set_many',
+              'delete_many')
+
+# Latency histogram bucket i counts calls taking under 2**i microseconds;
+# the last bucket counts everything slower
+_BUCKETS = 24
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class _Calls(threading.local):
+
+    '''Marks a thread as inside a recorded call to a cache.'''
+
+    active = False
+
+
+_MISSING = object()
+
+
+def instrument(cache):
+    '''Records calls to a cache's public methods in its stats.
+
+    Wraps the methods of the cache instance, so calls a backend makes to its
+    base class's methods aren't recorded. Only the outermost recorded call
+    to the cache in a thread counts, so caches built on their own methods
+    count each call once, while caches inside other caches record the calls
+    made to them.
+
+    @param cache Cache with a '_stats' attribute
+    '''
+    calls = _Calls()
+    for op in OPERATIONS:
+        method = getattr(cache, op, None)
+        if method is None:
+            continue
+        if op == 'get':
+            setattr(cache, op, _wrapget(method, cache._stats, calls))
+        else:
+            setattr(cache, op, _wrap(op, method, cache._stats, calls))
+
+
+def _wrapget(method, stats, calls):
+    '''Wraps a bound cache get method to record lookups. Lookups are the hot
+    path so this skips the extra call _wrap makes.
+
+    @param method Bound method
+    @param stats Stats to record in
+    @param calls Marks calls in progress to the cache
+    '''
+    def wrapper(key, default=None):
+        if calls.active:
+            return method(key, default)
+        calls.active = True
+        start = _clock()
+        try:
+            value = method(key, _MISSING)
+        finally:
+            calls.active = False
+        if value is _MISSING:
+            stats.record('get', _clock() - start, 'misses')
+            return default
+        stats.record('get', _clock() - start, 'hits')
+        return value
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+def _wrap(op, method, stats, calls):
+    '''Wraps a bound cache method to record its calls.
+
+    @param op Operation name
+    @param method Bound method
+    @param stats Stats to record in
+    @param calls Marks calls in progress to the cache
+    '''
+    # Each call gives its result, the event to count and how many
+    if op == 'get_many':
+        def call(keys):
+            keys = list(keys)
+            found = method(keys)
+            # Count misses here and hits with the latency
+            stats.incr('misses', len(keys) - len(found))
+            return found, 'hits', len(found)
+    elif op in ('set_many', 'delete_many'):
+        event = op[:-5] + 's'
+
+        def call(items, *args, **kw):
+            if op == 'delete_many':
+                items = list(items)
+            method(items, *args, **kw)
+            return None, event, len(items)
+    elif op in ('set', 'delete'):
+        event = op + 's'
+
+        def call(*args, **kw):
+            return method(*args, **kw), event, 1
+    elif op == 'add':
+        def call(*args, **kw):
+            stored = method(*args, **kw)
+            return stored, 'sets', 1 if stored else 0
+    else:
+        def call(*args, **kw):
+            return method(*args, **kw), None, 0
+
+    def wrapper(*args, **kw):
+        if calls.active:
+            return method(*args, **kw)
+        calls.active = True
+        start = _clock()
+        try:
+            result, event, num = call(*args, **kw)
+        finally:
+            calls.active = False
+        stats.record(op, _clock() - start, event, num)
+        return result
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class _Counters(threading.local):
+
+    '''Each thread's counters.'''
+
+    def __init__(self, stats):
+        # Event counts and operation name -> [calls, total seconds,
+        # histogram buckets]
+        self.counters = (dict.fromkeys(COUNTERS, 0), dict())
+        # Register this thread's counters for snapshots
+        stats._register(self.counters)
+
+
+def _add(total, counters):
+    '''Adds a thread's counters to a total.'''
+    counts, latency = total
+    tcounts, tlatency = counters
+    for name, num in list(tcounts.items()):
+        counts[name] += num
+    for op, record in list(tlatency.items()):
+        sums = latency.setdefault(op, [0, 0.0, [0] * _BUCKETS])
+        sums[0] += record[0]
+        sums[1] += record[1]
+        for idx, num in enumerate(record[2]):
+            sums[2][idx] += num
+
+
+class Stats(object):
+
+    '''Cache statistics.
+
+    Each thread updates its own counters without locking; snapshot() adds
+    up the counters of every thread. The counters of threads that have
+    ended are folded into one total so short-lived threads don't pile up.
+    '''
+
+    def __init__(self):
+        # Counters of every live thread that has used the cache, with the
+        # thread
+        self._threads = list()
+        # Counters of threads that have ended
+        self._retired = (dict.fromkeys(COUNTERS, 0), dict())
+        self._lock = threading.Lock()
+        self._local = _Counters(self)
+
+    def _register(self, counters):
+        '''Adds the counters of a thread, retiring those of ended
+        threads.'''
+        with self._lock:
+            self._retire()
+            self._threads.append((threading.current_thread(), counters))
+
+    def _retire(self):
+        '''Folds the counters of ended threads into the total. The caller
+        must hold the lock.'''
+        live = list()
+        for thread, counters in self._threads:
+            if thread.is_alive():
+                live.append((thread, counters))
+            else:
+                _add(self._retired, counters)
+        self._threads[:] = live
+
+    def incr(self, name, num=1):
+        '''Add to an event counter.
+
+        @param name Counter name
+        @param num Amount to add (default: 1)
+        '''
+        self._local.counters[0][name] += num
+
+    def record(self, op, seconds, event=None, num=1):
+        '''Record how long an operation took and what happened.
+
+        @param op Operation name
+        @param seconds Duration in seconds
+        @param event Event counter to add to (default: None)
+        @param num Amount to add to the event counter (default: 1)
+        '''
+        counts, latency = self._local.counters
+        if event is not None:
+            counts[event] += num
+        record = latency.get(op)
+        if record is None:
+            record = latency[op] = [0, 0.0, [0] * _BUCKETS]
+        record[0] += 1
+        record[1] += seconds
+        idx = int(seconds * 1e6).bit_length()
+        record[2][idx if idx < _BUCKETS else _BUCKETS - 1] += 1
+
+    def snapshot(self, *others):
+        '''Returns the counters summed over every thread as a dict.
+
+        Latency is reported per operation as a dict with the number of
+        calls, total seconds and a histogram of (upper bound in seconds,
+        calls) pairs, leaving out empty buckets. The slowest bucket has no
+        upper bound (None).
+
+        @param others More Stats to add in
+        '''
+        total = (dict.fromkeys(COUNTERS, 0), dict())
+        for stats in (self,) + others:
+            with stats._lock:
+                stats._retire()
+                _add(total, stats._retired)
+                for thread, counters in stats._threads:
+                    _add(total, counters)
+        counts, latency = total
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = counts['hits'] / float(lookups or 1)
+        counts['latency'] = dict(
+            (op, {'count': record[0], 'seconds': record[1],
+                  'histogram': [
+                      (2 ** idx / 1e6 if idx < _BUCKETS - 1 else None, num)
+                      for idx, num in enumerate(record[2]) if num]})
+            for op, record in latency.items())
+        return counts
+
+    def reset(self):
+        '''Zero every counter.'''
+        with self._lock:
+            for counts, latency in [self._retired] + [
+                    c for t, c in self._threads]:
+                counts.update(dict.fromkeys(COUNTERS, 0))
+                latency.clear()
+
+
+class NullStats(Stats):
+
+    '''Statistics that record nothing, for caches with stats turned off.'''
+
+    def incr(self, name, num=1):
+        pass
+
+    def record(self, op, seconds, event=None, num=1):
+        pass
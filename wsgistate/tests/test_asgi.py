@@ -0,0 +1,299 @@
+'''Tests for the ASGI middleware. Skipped where asyncio isn't available.'''
+
+import unittest
+
+try:
+    import asyncio
+    from wsgistate import memory, simple, tiered, cache, session, asgi
+except (ImportError, SyntaxError):
+    asyncio = None
+
+KEY = 'com.saddi.service.session'
+
+
+def _sequence(send, messages, delay=0):
+    '''Sends ASGI messages in turn, after delay seconds. Returns a future
+    done once all are sent.'''
+    messages = list(messages)
+    done = asyncio.get_event_loop().create_future()
+
+    def step(previous):
+        if previous.exception() is not None:
+            done.set_exception(previous.exception())
+        elif not messages:
+            done.set_result(None)
+        else:
+            asyncio.ensure_future(
+                send(messages.pop(0))).add_done_callback(step)
+    asyncio.ensure_future(asyncio.sleep(delay)).add_done_callback(step)
+    return done
+
+
+def _response(status, headers, body):
+    '''Gives the ASGI messages of a response.'''
+    headers = [(k.encode('latin-1'), v.encode('latin-1'))
+               for k, v in headers]
+    return [{'type': 'http.response.start', 'status': status,
+             'headers': headers},
+            {'type': 'http.response.body', 'body': body}]
+
+
+def _scope(path='/', query='', headers=()):
+    '''Gives an ASGI HTTP scope.'''
+    return {'type': 'http', 'method': 'GET', 'path': path, 'root_path': '',
+            'query_string': query.encode('latin-1'),
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                        for k, v in headers]}
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available')
+class TestAsgi(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.calls = list()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def request(self, app, scope):
+        '''Runs a request. Returns the status, headers dict and body.'''
+        sent = list()
+
+        def send(message):
+            sent.append(message)
+            return asyncio.sleep(0)
+
+        def receive():
+            return asyncio.sleep(0, {'type': 'http.disconnect'})
+        self.wait(app(scope, receive, send))
+        headers = dict((k.decode('latin-1').lower(), v.decode('latin-1'))
+                       for k, v in sent[0]['headers'])
+        body = b''.join(m.get('body', b'') for m in sent[1:])
+        return sent[0]['status'], headers, body
+
+    def app(self, headers=(), delay=0):
+        '''Gives an application counting its calls.'''
+        def application(scope, receive, send):
+            self.calls.append(scope['path'])
+            return _sequence(send, _response(
+                200, [('Content-Type', 'text/plain')] + list(headers),
+                b'hello'), delay)
+        return application
+
+    def session_app(self, scope, receive, send):
+        '''Counts requests in the session.'''
+        sess = scope[KEY].session
+        sess['count'] = sess.get('count', 0) + 1
+        return _sequence(send, _response(
+            200, [], str(sess['count']).encode('ascii')))
+
+    def test_memoize(self):
+        '''Tests responses are cached with validators.'''
+        app = asgi.AsgiMemoize(self.app(), memory.MemoryCache())
+        status, headers, body = self.request(app, _scope())
+        self.assertEqual((status, body), (200, b'hello'))
+        self.assertEqual('s-maxage' in headers['cache-control'], True)
+        again = self.request(app, _scope())
+        self.assertEqual(again[0], 200)
+        self.assertEqual(again[2], b'hello')
+        # The response that is cached carries the validators too
+        self.assertEqual(headers['etag'], again[1]['etag'])
+        self.assertEqual(
+            headers['last-modified'], again[1]['last-modified'])
+        self.assertEqual(self.calls, ['/'])
+        # Conditional requests get 304 from the cache
+        status, headers, body = self.request(app, _scope(
+            headers=[('If-None-Match', again[1]['etag'])]))
+        self.assertEqual((status, body), (304, b''))
+        self.assertEqual(self.calls, ['/'])
+
+    def test_memoize_nostore(self):
+        '''Tests responses marked no-store aren't cached.'''
+        app = asgi.AsgiMemoize(
+            self.app([('Cache-Control', 'no-store')]), memory.MemoryCache())
+        self.request(app, _scope())
+        self.request(app, _scope())
+        self.assertEqual(self.calls, ['/', '/'])
+
+    def test_memoize_coalesce(self):
+        '''Tests concurrent misses render once.'''
+        app = asgi.AsgiMemoize(self.app(delay=0.05), memory.MemoryCache())
+        sent = list()
+
+        def send(message):
+            sent.append(message)
+            return asyncio.sleep(0)
+
+        def receive():
+            return asyncio.sleep(0, {'type': 'http.disconnect'})
+        self.wait(asyncio.gather(*[
+            self.loop.create_task(app(_scope(), receive, send))
+            for i in range(5)]))
+        self.assertEqual(self.calls, ['/'])
+        self.assertEqual(
+            [m['body'] for m in sent if 'body' in m], [b'hello'] * 5)
+
+    def test_memoize_pass(self):
+        '''Tests requests don't wait on responses that can't be cached.'''
+        async def application(scope, receive, send):
+            self.calls.append(scope['path'])
+            start, body = _response(200, [('Set-Cookie', 'a=b')], b'hello')
+            await send(start)
+            await asyncio.sleep(0.2)
+            await send(body)
+        testcache = memory.MemoryCache()
+        app = asgi.AsgiMemoize(application, testcache, lease=True)
+
+        def receive():
+            return asyncio.sleep(0, {'type': 'http.disconnect'})
+
+        def send(message):
+            return asyncio.sleep(0)
+        start = self.loop.time()
+        self.wait(asyncio.gather(*[
+            self.loop.create_task(app(_scope(), receive, send))
+            for i in range(4)]))
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(self.loop.time() - start < 0.35, True)
+        # Other processes learn to pass from the lease key
+        self.assertEqual(testcache.get('wsgistate.lease:/'), 'pass')
+
+    def test_memoize_compress(self):
+        '''Tests compressed entries are sent as the client accepts.'''
+        body = b'hello world ' * 200
+
+        def application(scope, receive, send):
+            self.calls.append(scope['path'])
+            return _sequence(send, _response(
+                200, [('Content-Type', 'text/plain')], body))
+        app = asgi.AsgiMemoize(application, memory.MemoryCache(),
+                               compress=True)
+        self.request(app, _scope())
+        status, headers, gzipped = self.request(
+            app, _scope(headers=[('Accept-Encoding', 'gzip')]))
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(len(gzipped) < len(body), True)
+        self.assertEqual(self.request(app, _scope())[2], body)
+        self.assertEqual(self.calls, ['/'])
+
+    def test_memoize_stale_if_error(self):
+        '''Tests stale responses are sent if rendering them fails.'''
+        def application(scope, receive, send):
+            self.calls.append(scope['path'])
+            if len(self.calls) == 2:
+                raise ValueError()
+            status = 503 if len(self.calls) == 3 else 200
+            return _sequence(send, _response(
+                status, [('Cache-Control', 'max-age=1')],
+                str(len(self.calls)).encode('ascii')))
+        app = asgi.AsgiMemoize(application, memory.MemoryCache(),
+                               stale_if_error=5)
+        self.assertEqual(self.request(app, _scope())[2], b'1')
+        self.wait(asyncio.sleep(1.1))
+        self.assertEqual(self.request(app, _scope())[2], b'1')
+        self.assertEqual(self.request(app, _scope())[2], b'1')
+        self.assertEqual(self.request(app, _scope())[:3:2], (200, b'4'))
+        self.assertEqual(self.request(app, _scope())[2], b'4')
+        self.assertEqual(len(self.calls), 4)
+
+    def test_memoize_shared(self):
+        '''Tests WSGI middleware replays responses ASGI middleware cached.'''
+        testcache = memory.MemoryCache()
+        started = list()
+
+        def start_response(status, headers, exc_info=None):
+            started.append(status)
+        wsgiapp = cache.WsgiMemoize(None, testcache, key_user_info=True)
+        asgiapp = asgi.AsgiMemoize(self.app(), testcache, key_user_info=True)
+        self.request(asgiapp, _scope('/shared', 'b=2&a=1'))
+        body = wsgiapp({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/shared',
+                        'QUERY_STRING': 'a=1&b=2'}, start_response)
+        self.assertEqual((started, body), (['200 OK'], [b'hello']))
+        self.assertEqual(self.calls, ['/shared'])
+
+    def test_memoize_shared_nonascii(self):
+        '''Tests WSGI and ASGI middleware share keys of non-ASCII
+        paths.'''
+        testcache = memory.MemoryCache()
+        wsgiapp = cache.WsgiMemoize(None, testcache)
+        asgiapp = asgi.AsgiMemoize(self.app(), testcache)
+        self.request(asgiapp, _scope('/caf\xe9'))
+        # WSGI servers decode the UTF-8 bytes of the path as latin-1
+        body = wsgiapp({'REQUEST_METHOD': 'GET',
+                        'PATH_INFO': '/caf\xc3\xa9'}, lambda *a: None)
+        self.assertEqual(body, [b'hello'])
+        self.assertEqual(self.calls, ['/caf\xe9'])
+
+    def test_asynccache(self):
+        '''Tests blocking caches are called off the event loop.'''
+        testcache = asgi.AsyncCache(memory.MemoryCache(), workers=2)
+        self.wait(testcache.set('test', 'test'))
+        self.assertEqual(self.wait(testcache.get('test')), 'test')
+        self.assertEqual(self.wait(testcache.add('test', 'test2')), False)
+        self.wait(testcache.set_many({'a': 1, 'b': 2}))
+        self.assertEqual(
+            self.wait(testcache.get_many(['a', 'b', 'c'])), {'a': 1, 'b': 2})
+        self.wait(testcache.delete('test'))
+        self.assertEqual(self.wait(testcache.get('test', 1)), 1)
+        self.wait(testcache.close())
+
+    def test_asynccache_threadsafe(self):
+        '''Tests caches that aren't thread-safe get one thread.'''
+        for testcache, workers in [(simple.SimpleCache(), 1),
+                                   (memory.MemoryCache(), 3),
+                                   (tiered.TieredCache(
+                                       simple.SimpleCache()), 1)]:
+            testcache = asgi.AsyncCache(testcache, workers=3)
+            self.wait(testcache.set('test', 'test'))
+            self.assertEqual(testcache._executor._max_workers, workers)
+            self.wait(testcache.close())
+
+    def test_cookiesession(self):
+        '''Tests session cookies.'''
+        testcache = session.SessionCache(memory.MemoryCache())
+        app = asgi.AsgiCookieSession(self.session_app, testcache)
+        status, headers, body = self.request(app, _scope())
+        self.assertEqual(body, b'1')
+        cookie = headers['set-cookie'].split(';')[0]
+        for i in range(3):
+            status, headers, body = self.request(
+                app, _scope(headers=[('Cookie', cookie)]))
+        self.assertEqual(body, b'4')
+        self.assertEqual('set-cookie' in headers, False)
+        self.assertEqual(app.cache.checkedout, {})
+
+    def test_sessions_wait(self):
+        '''Tests a checked out session waits for its check in.'''
+        testcache = asgi.AsyncSessionCache(memory.MemoryCache())
+        sid, sess = self.wait(testcache.create())
+        order = list()
+
+        def checkin():
+            order.append('checkin')
+            return testcache.checkin(sid, sess)
+        waiter = self.loop.create_task(testcache.checkout(sid))
+        waiter.add_done_callback(lambda f: order.append('checkout'))
+        self.wait(asyncio.sleep(0.01))
+        self.wait(checkin())
+        self.assertEqual(self.wait(waiter), (sid, sess))
+        self.assertEqual(order, ['checkin', 'checkout'])
+
+    def test_urlsession(self):
+        '''Tests URL encoded sessions.'''
+        app = asgi.AsgiURLSession(self.session_app, memory.MemoryCache())
+        status, headers, body = self.request(app, _scope('/test'))
+        self.assertEqual(status, 302)
+        path, query = headers['location'].split('?')
+        self.assertEqual(path, '/test')
+        self.assertEqual(query.startswith('_SID_='), True)
+        self.request(app, _scope('/test', query))
+        status, headers, body = self.request(app, _scope('/test', query))
+        self.assertEqual((status, body), (200, b'2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
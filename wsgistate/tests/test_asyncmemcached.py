@@ -0,0 +1,184 @@
+'''Tests for the asyncio memcached backend against an in-process fake
+memcached server. Skipped where asyncio isn't available.'''
+
+import time
+import unittest
+
+try:
+    import asyncio
+    from wsgistate.asyncmemcached import AsyncMemCached
+except (ImportError, SyntaxError):
+    asyncio = None
+
+if asyncio is not None:
+
+    class FakeMemcached(asyncio.Protocol):
+
+        '''Speaks enough of the memcached text protocol for the tests.'''
+
+        def __init__(self, server):
+            self.server, self.buffer = server, b''
+
+        def connection_made(self, transport):
+            self.transport = transport
+            self.server.connections += 1
+
+        def data_received(self, data):
+            self.buffer += data
+            while True:
+                end = self.buffer.find(b'\r\n')
+                if end < 0:
+                    return
+                parts = self.buffer[:end].split()
+                data, rest = None, self.buffer[end + 2:]
+                if parts[0] in (b'set', b'add'):
+                    size = int(parts[4])
+                    if len(rest) < size + 2:
+                        return
+                    data, rest = rest[:size], rest[size + 2:]
+                self.buffer = rest
+                self.server.commands.append(parts[0])
+                noreply = parts[-1] == b'noreply'
+                reply = self.handle(parts, data)
+                if not noreply:
+                    self.transport.write(reply)
+
+        def handle(self, parts, data):
+            items, now = self.server.items, time.time()
+            for key, item in list(items.items()):
+                if item[2] < now:
+                    del items[key]
+            if parts[0] == b'get':
+                reply = list()
+                for key in parts[1:]:
+                    if key in items:
+                        flags, value = items[key][:2]
+                        reply.append(b'VALUE %s %d %d\r\n%s\r\n' % (
+                            key, flags, len(value), value))
+                return b''.join(reply) + b'END\r\n'
+            if parts[0] in (b'set', b'add'):
+                if parts[0] == b'add' and parts[1] in items:
+                    return b'NOT_STORED\r\n'
+                items[parts[1]] = (
+                    int(parts[2]), data, now + int(parts[3]))
+                return b'STORED\r\n'
+            if parts[0] == b'touch':
+                if parts[1] not in items:
+                    return b'NOT_FOUND\r\n'
+                items[parts[1]] = items[parts[1]][:2] + (
+                    now + int(parts[2]),)
+                return b'TOUCHED\r\n'
+            if parts[0] == b'delete':
+                if items.pop(parts[1], None) is None:
+                    return b'NOT_FOUND\r\n'
+                return b'DELETED\r\n'
+            return b'ERROR\r\n'
+
+    class FakeServer(object):
+
+        '''In-process fake memcached server.'''
+
+        def __init__(self, loop):
+            self.items, self.commands, self.connections = dict(), list(), 0
+            self._server = loop.run_until_complete(loop.create_server(
+                lambda: FakeMemcached(self), '127.0.0.1', 0))
+            self.address = '127.0.0.1:%d' % (
+                self._server.sockets[0].getsockname()[1])
+
+        def close(self):
+            self._server.close()
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available')
+class TestAsyncMemCached(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.servers = [FakeServer(self.loop), FakeServer(self.loop)]
+        self.cache = AsyncMemCached(
+            ';'.join(s.address for s in self.servers), pool_size=2)
+
+    def tearDown(self):
+        self.wait(self.cache.close())
+        for server in self.servers:
+            server.close()
+        self.loop.close()
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_set_get(self):
+        '''Tests set, get and delete.'''
+        self.wait(self.cache.set('test', {'a': [1, 2]}))
+        self.wait(self.cache.set('bytes', b'raw'))
+        self.assertEqual(self.wait(self.cache.get('test')), {'a': [1, 2]})
+        self.assertEqual(self.wait(self.cache.get('bytes')), b'raw')
+        self.assertEqual(self.wait(self.cache.get('none', 1)), 1)
+        self.wait(self.cache.delete('test'))
+        self.assertEqual(self.wait(self.cache.get('test')), None)
+
+    def test_add_touch(self):
+        '''Tests add and touch.'''
+        self.assertEqual(self.wait(self.cache.add('test', 'test')), True)
+        self.assertEqual(self.wait(self.cache.add('test', 'test2')), False)
+        self.assertEqual(self.wait(self.cache.get('test')), 'test')
+        self.assertEqual(self.wait(self.cache.touch('test', 60)), True)
+        self.assertEqual(self.wait(self.cache.touch('none')), False)
+
+    def test_timeout(self):
+        '''Tests items expire.'''
+        self.wait(self.cache.set('test', 'test', 1))
+        time.sleep(1.1)
+        self.assertEqual(self.wait(self.cache.get('test')), None)
+
+    def test_many(self):
+        '''Tests batches are pipelined to every server.'''
+        items = dict(('test%d' % i, i) for i in range(250))
+        self.wait(self.cache.set_many(items))
+        # Both servers got a share of the keys
+        self.assertEqual(all(s.items for s in self.servers), True)
+        self.assertEqual(
+            self.wait(self.cache.get_many(list(items) + ['none'])), items)
+        # 250 keys split over two servers take two gets on each
+        gets = sum(s.commands.count(b'get') for s in self.servers)
+        self.assertEqual(gets, 4)
+        self.wait(self.cache.delete_many(['test%d' % i for i in range(100)]))
+        self.assertEqual(
+            sorted(self.wait(self.cache.get_many(items)).values()),
+            list(range(100, 250)))
+
+    def test_noreply(self):
+        '''Tests writes that skip replies leave connections usable.'''
+        cache = AsyncMemCached(self.servers[0].address, noreply=True)
+        self.wait(cache.set('test', 'test'))
+        self.wait(cache.set_many({'test2': 2, 'test3': 3}))
+        self.wait(cache.delete('test2'))
+        self.assertEqual(
+            self.wait(cache.get_many(['test', 'test2', 'test3'])),
+            {'test': 'test', 'test3': 3})
+        self.assertEqual(self.servers[0].connections, 1)
+        self.wait(cache.close())
+
+    def test_pool(self):
+        '''Tests concurrent calls share at most pool_size connections.'''
+        self.wait(self.cache.set('test', 'test'))
+        results = self.wait(asyncio.gather(*[
+            self.loop.create_task(self.cache.get('test'))
+            for i in range(20)]))
+        self.assertEqual(results, ['test'] * 20)
+        self.assertEqual(
+            max(s.connections for s in self.servers), 2)
+
+    def test_unreachable(self):
+        '''Tests unreachable servers are misses.'''
+        address = self.servers[1].address
+        self.servers[1].close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        cache = AsyncMemCached(address, socket_timeout=1)
+        self.assertEqual(self.wait(cache.get('test', 'default')), 'default')
+        self.assertEqual(self.wait(cache.add('test', 'test')), False)
+        self.assertRaises(ValueError, self.wait, cache.get('bad key'))
+
+
+if __name__ == '__main__':
+    unittest.main()
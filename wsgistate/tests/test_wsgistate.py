@@ -28,9 +28,15 @@
 import unittest
 import StringIO
 import os
+import sys
 import time
+import bisect
+import random
+import threading
+import warnings
 import urlparse
 from wsgistate import simple, memory, db, file, cache, memcached, session
+from wsgistate import policy, shm, tiered, sharded
 
 
 class TestWsgiState(unittest.TestCase):
@@ -62,6 +68,29 @@ class TestWsgiState(unittest.TestCase):
         start_response('200 OK', [])
         return ['passed']
 
+    def hit_ratio(self, eviction):
+        '''Replays a memoizing trace of popular pages mixed with one-hit
+        pages against a SimpleCache and returns its hit ratio.'''
+        rand = random.Random(7)
+        weights, total = [], 0.0
+        for i in range(1, 1001):
+            total += 1.0 / i ** 0.9
+            weights.append(total)
+        testcache = simple.SimpleCache(max_entries=100, eviction=eviction)
+        hits = 0
+        for i in range(10000):
+            if rand.random() < 0.3:
+                key = '/once/%d' % i
+            else:
+                key = '/page/%d' % bisect.bisect(
+                    weights, rand.random() * total)
+            if testcache.get(key) is not None:
+                hits += 1
+            else:
+                testcache.set(key, key)
+        self.assertEqual(len(testcache.keys()), 100)
+        return hits / 10000.0
+
     def test_sc_set_getitem(self):
         '''Tests __setitem__ and __setitem__ on SimpleCache.'''
         testcache = simple.SimpleCache()
@@ -116,6 +145,142 @@ class TestWsgiState(unittest.TestCase):
         time.sleep(1)
         self.assertEqual(testcache.get('test'), None)
 
+    def test_sc_set_timeout(self):
+        '''Tests per item timeout in SimpleCache.'''
+        testcache = simple.SimpleCache()
+        testcache.set('test', 'test', 1)
+        testcache.set('test2', 'test2')
+        time.sleep(1)
+        self.assertEqual(testcache.get('test'), None)
+        self.assertEqual(testcache.get('test2'), 'test2')
+
+    def test_sc_add(self):
+        '''Tests add on SimpleCache.'''
+        testcache = simple.SimpleCache()
+        self.assertEqual(testcache.add('test', 'test'), True)
+        self.assertEqual(testcache.add('test', 'test2'), False)
+        self.assertEqual(testcache.get('test'), 'test')
+
+    def test_sc_touch(self):
+        '''Tests touch on SimpleCache.'''
+        testcache = simple.SimpleCache(timeout=1)
+        testcache.set('test', 'test')
+        self.assertEqual(testcache.touch('test', 300), True)
+        self.assertEqual(testcache.touch('test2'), False)
+        time.sleep(1)
+        self.assertEqual(testcache.get('test'), 'test')
+
+    def test_sc_lru(self):
+        '''Tests LRU eviction in SimpleCache.'''
+        testcache = simple.SimpleCache(max_entries=2, eviction='lru')
+        testcache.set('test', 'test')
+        testcache.set('test2', 'test2')
+        testcache.get('test')
+        testcache.set('test3', 'test3')
+        self.assertEqual(testcache.get('test2'), None)
+        self.assertEqual(testcache.get('test'), 'test')
+        self.assertEqual(testcache.get('test3'), 'test3')
+
+    def test_sc_max_bytes(self):
+        '''Tests byte budget in SimpleCache.'''
+        testcache = simple.SimpleCache(max_bytes=100, sizeof=len)
+        for i in range(10):
+            testcache.set('test%d' % i, 'x' * 30)
+        self.assertEqual(testcache.nbytes <= 100, True)
+        self.assertEqual(testcache.nbytes, 30 * len(testcache.keys()))
+        testcache.set('test', 'x' * 101)
+        self.assertEqual(testcache.get('test'), None)
+        for key in list(testcache.keys()):
+            testcache.delete(key)
+        self.assertEqual(testcache.nbytes, 0)
+
+    def test_sc_lru_max_bytes(self):
+        '''Tests byte budget with LRU eviction in SimpleCache.'''
+        testcache = simple.SimpleCache(
+            max_bytes=100, sizeof=len, eviction='lru')
+        testcache.set('test', 'x' * 40)
+        testcache.set('test2', 'x' * 40)
+        testcache.get('test')
+        testcache.set('test3', 'x' * 40)
+        self.assertEqual(testcache.get('test2'), None)
+        self.assertEqual(testcache.nbytes, 80)
+
+    def test_sc_policy_random(self):
+        '''Tests hit ratio of random eviction on a trace.'''
+        self.assertEqual(self.hit_ratio('random') > 0.2, True)
+
+    def test_sc_policy_lru(self):
+        '''Tests hit ratio of LRU eviction on a trace.'''
+        self.assertEqual(self.hit_ratio('lru') > 0.25, True)
+
+    def test_sc_policy_arc(self):
+        '''Tests hit ratio of ARC eviction beats LRU on a trace.'''
+        self.assertEqual(
+            self.hit_ratio('arc') > self.hit_ratio('lru') + 0.05, True)
+
+    def test_sc_policy_tinylfu(self):
+        '''Tests hit ratio of W-TinyLFU eviction beats LRU on a trace.'''
+        self.assertEqual(
+            self.hit_ratio('tinylfu') > self.hit_ratio('lru') + 0.05, True)
+
+    def test_sc_policy_class(self):
+        '''Tests SimpleCache with a policy class and an unknown policy.'''
+        testcache = simple.SimpleCache(
+            max_entries=2, eviction=policy.LRUPolicy)
+        testcache.set('test', 'test')
+        testcache.set('test2', 'test2')
+        testcache.set('test3', 'test3')
+        self.assertEqual(sorted(testcache.keys()), ['test2', 'test3'])
+        self.assertRaises(ValueError, simple.SimpleCache, eviction='test')
+
+    def test_sc_evict_key(self):
+        '''Tests SimpleCache tells the policy which key needs room.'''
+        evicted = list()
+
+        class Recorder(policy.ARCPolicy):
+            def evict(self, key=None):
+                evicted.append(key)
+                return super(Recorder, self).evict(key)
+        testcache = simple.SimpleCache(max_entries=2, eviction=Recorder)
+        for key in ('test', 'test2', 'test3'):
+            testcache.set(key, key)
+        self.assertEqual(evicted, ['test3'])
+
+    def test_sc_maxcull(self):
+        '''Tests maxcull, shared with FileCache and DbCache settings, is
+        accepted quietly.'''
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            simple.SimpleCache(maxcull=5)
+            memory.ShardedMemoryCache(maxcull=5)
+        self.assertEqual(caught, [])
+
+    def test_sc_overwrite_full(self):
+        '''Tests a key overwritten in a full cache isn't its own victim.'''
+        testcache = simple.SimpleCache(
+            max_bytes=12, sizeof=len, eviction='lru', stats=True)
+        for key in ('a', 'b', 'c'):
+            testcache.set(key, 'xxxx')
+        testcache.get('a')
+        testcache.get('c')
+        testcache.set('b', 'xxxxxx')
+        self.assertEqual(sorted(testcache.keys()), ['b', 'c'])
+        self.assertEqual(testcache.stats()['evictions'], 1)
+        self.assertEqual(len(testcache._policy), 2)
+
+    def test_sc_expired_first(self):
+        '''Tests timed out items are evicted first in SimpleCache.'''
+        testcache = simple.SimpleCache(timeout=1, max_entries=3)
+        testcache.set('test', 'test')
+        testcache.set('test2', 'test2')
+        testcache.timeout = 300
+        # Overwritten items are not expired by their old timeout
+        testcache.set('test2', 'test2')
+        testcache.set('test3', 'test3')
+        time.sleep(1)
+        testcache.set('test4', 'test4')
+        self.assertEqual(sorted(testcache.keys()), ['test2', 'test3', 'test4'])
+
     def test_mc_set_getitem(self):
         '''Tests __setitem__ and __setitem__ on MemoryCache.'''
         testcache = memory.MemoryCache()
@@ -142,6 +307,87 @@ class TestWsgiState(unittest.TestCase):
         testcache.delete('test')
         self.assertEqual(testcache.get('test'), None)
 
+    def test_mc_stats(self):
+        '''Tests statistics on MemoryCache.'''
+        testcache = memory.MemoryCache(
+            max_entries=2, max_bytes=1000, stats=True)
+        testcache.set('test', 'test')
+        testcache.set('test2', 'test2', -1)
+        self.assertEqual(testcache.get('test'), 'test')
+        self.assertEqual(testcache.get('test3', 'default'), 'default')
+        testcache.get_many(('test', 'test3'))
+        testcache.set('test3', 'test3')
+        testcache.set('test4', 'test4')
+        testcache.delete('test4')
+        stats = testcache.stats()
+        self.assertEqual(
+            (stats['hits'], stats['misses'], stats['sets'],
+             stats['deletes'], stats['expirations'], stats['evictions'],
+             stats['culls']), (2, 2, 4, 1, 1, 1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['bytes'], testcache.nbytes)
+        self.assertEqual(stats['latency']['get']['count'], 2)
+        self.assertEqual(stats['latency']['get_many']['count'], 1)
+        self.assertEqual(
+            sum(n for b, n in stats['latency']['set']['histogram']), 4)
+
+    def test_stats_threads(self):
+        '''Tests statistics add up the counters of every thread.'''
+        testcache = memory.ShardedMemoryCache(shards=4, stats=True)
+
+        def worker():
+            for i in range(100):
+                testcache.set(i, i)
+                testcache.get(i)
+        threads = [threading.Thread(target=worker) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = testcache.stats()
+        self.assertEqual((stats['sets'], stats['hits']), (400, 400))
+        self.assertEqual(stats['entries'], 100)
+
+    def test_stats_off(self):
+        '''Tests statistics can be turned off.'''
+        testcache = simple.SimpleCache(stats=False)
+        testcache.set('test', 'test')
+        testcache.get('test')
+        stats = testcache.stats()
+        self.assertEqual((stats['sets'], stats['hits']), (0, 0))
+        self.assertEqual(stats['latency'], {})
+        # Statistics are off by default
+        testcache = simple.SimpleCache()
+        testcache.get('test')
+        self.assertEqual(testcache.stats()['latency'], {})
+
+    def test_stats_ended_threads(self):
+        '''Tests counters of ended threads are folded into one total.'''
+        testcache = simple.SimpleCache(stats=True)
+
+        def worker(num):
+            testcache.set(num, num)
+            testcache.get(num)
+        for i in range(50):
+            thread = threading.Thread(target=worker, args=(i,))
+            thread.start()
+            thread.join()
+        stats = testcache.stats()
+        self.assertEqual((stats['sets'], stats['hits']), (50, 50))
+        self.assertEqual(len(testcache._stats._threads) <= 2, True)
+
+    def test_stats_nested(self):
+        '''Tests caches inside other caches record their own calls.'''
+        l2 = memory.MemoryCache(stats=True)
+        testcache = tiered.TieredCache(l2, stats=True)
+        testcache.set('test', 'test')
+        testcache.l1.delete('test')
+        testcache.get('test')
+        self.assertEqual(
+            (testcache.stats()['sets'], testcache.stats()['hits']), (1, 1))
+        self.assertEqual((l2.stats()['sets'], l2.stats()['hits']), (1, 1))
+
     def test_mc_set_getmany(self):
         '''Tests delete on MemoryCache.'''
         testcache = memory.MemoryCache()
@@ -151,6 +397,18 @@ class TestWsgiState(unittest.TestCase):
             sorted(testcache.get_many(('test', 'test2')).values()),
             ['test', 'test2'])
 
+
+    def test_mc_setmany_deletemany(self):
+        '''Tests set_many and delete_many on MemoryCache.'''
+        testcache = memory.MemoryCache()
+        testcache.set_many({'test': 'test', 'test2': 'test2'})
+        self.assertEqual(testcache.get('test2'), 'test2')
+        self.assertEqual(
+            testcache.get_many(('test', 'test2', 'test3')),
+            {'test': 'test', 'test2': 'test2'})
+        testcache.delete_many(('test', 'test3'))
+        self.assertEqual(testcache.get_many(('test', 'test2')),
+                         {'test2': 'test2'})
     def test_mc_in_true(self):
         '''Tests in (true) on MemoryCache.'''
         testcache = memory.MemoryCache()
@@ -170,6 +428,126 @@ class TestWsgiState(unittest.TestCase):
         time.sleep(1)
         self.assertEqual(testcache.get('test'), None)
 
+    def test_mc_set_timeout(self):
+        '''Tests per item timeout in MemoryCache.'''
+        testcache = memory.MemoryCache()
+        testcache.set('test', 'test', 1)
+        testcache.set('test2', 'test2')
+        time.sleep(1)
+        self.assertEqual(testcache.get('test'), None)
+        self.assertEqual(testcache.get('test2'), 'test2')
+
+    def test_mc_add(self):
+        '''Tests add on MemoryCache.'''
+        testcache = memory.MemoryCache()
+        self.assertEqual(testcache.add('test', 'test'), True)
+        self.assertEqual(testcache.add('test', 'test2'), False)
+        self.assertEqual(testcache.get('test'), 'test')
+
+    def test_mc_lru(self):
+        '''Tests LRU eviction in MemoryCache.'''
+        testcache = memory.MemoryCache(max_entries=2, eviction='lru')
+        testcache.set('test', 'test')
+        testcache.set('test2', 'test2')
+        testcache.get('test')
+        testcache.set('test3', 'test3')
+        self.assertEqual(testcache.get('test2'), None)
+        self.assertEqual(testcache.get('test'), 'test')
+        self.assertEqual(testcache.get('test3'), 'test3')
+
+    def test_mc_rw_lru(self):
+        '''Tests LRU eviction in MemoryCache with a readers-writer lock.'''
+        testcache = memory.MemoryCache(
+            max_entries=2, eviction='lru', lock='rw')
+        testcache.set('test', 'test')
+        testcache.set('test2', 'test2')
+        testcache.get('test')
+        testcache.set('test3', 'test3')
+        self.assertEqual(testcache.get('test2'), None)
+        self.assertEqual(testcache.get('test'), 'test')
+        self.assertEqual(testcache.get('test3'), 'test3')
+
+    def test_mc_rw_threads(self):
+        '''Tests concurrent use of MemoryCache with a readers-writer lock.'''
+        testcache = memory.MemoryCache(max_entries=50, lock='rw')
+        errors = []
+
+        def worker(num):
+            try:
+                for i in range(500):
+                    key = 'test%d' % (i % 60)
+                    if i % 5 == num % 5:
+                        testcache.set(key, key)
+                    else:
+                        value = testcache.get(key)
+                        if value is not None and value != key:
+                            errors.append(value)
+            except Exception as e:
+                errors.append(e)
+        threads = [
+            threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(testcache.keys()) <= 50, True)
+
+    def test_mc_copy(self):
+        '''Tests copy strategies on MemoryCache.'''
+        value = {'data': ['test']}
+        for strategy in ('deep', 'shallow', 'frozen'):
+            testcache = memory.MemoryCache(copy=strategy)
+            testcache.set('test', value)
+            result = testcache.get('test')
+            self.assertEqual(result, value)
+            self.assertEqual(result is value, False)
+        testcache = memory.MemoryCache(copy='none')
+        testcache.set('test', value)
+        self.assertEqual(testcache.get('test') is value, True)
+        self.assertRaises(ValueError, memory.MemoryCache, copy='test')
+
+    def test_mc_max_bytes(self):
+        '''Tests byte budget in MemoryCache.'''
+        testcache = memory.MemoryCache(max_bytes=1000, copy='frozen')
+        for i in range(100):
+            testcache.set('test%d' % i, 'x' * 100)
+        self.assertEqual(0 < testcache.nbytes <= 1000, True)
+
+    def test_mc_get_default(self):
+        '''Tests get on MemoryCache returns the default for missing keys.'''
+        testcache = memory.MemoryCache()
+        self.assertEqual(testcache.get('test', 'test'), 'test')
+
+    def test_smc_set_get(self):
+        '''Tests set, get and delete on ShardedMemoryCache.'''
+        testcache = memory.ShardedMemoryCache(shards=4)
+        for i in range(20):
+            testcache.set('test%d' % i, i)
+        self.assertEqual(testcache.get('test7'), 7)
+        testcache.delete('test7')
+        self.assertEqual(testcache.get('test7'), None)
+        self.assertEqual(len(testcache.keys()), 19)
+
+    def test_smc_max_entries(self):
+        '''Tests ShardedMemoryCache splits max_entries between shards.'''
+        testcache = memory.ShardedMemoryCache(
+            shards=4, max_entries=40, eviction='lru')
+        for i in range(100):
+            testcache.set('test%d' % i, i)
+        self.assertEqual(len(testcache.keys()) <= 40, True)
+
+    def test_dec_wsgimemoize_sharded_mc(self):
+        '''Tests memoizing with a sharded MemoryCache.'''
+        @memory.memoize(shards=4)
+        def cacheapp(environ, start_response):
+            start_response('200 OK', [])
+            return [str(time.time())]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        result1 = cacheapp(env, self.dummy_sr)
+        result2 = cacheapp(env, self.dummy_sr)
+        self.assertEqual(result1 == result2, True)
+
     def test_fc_set_getitem(self):
         '''Tests __setitem__ and __setitem__ on FileCache.'''
         testcache = file.FileCache('test_wsgistate')
@@ -205,6 +583,18 @@ class TestWsgiState(unittest.TestCase):
             sorted(testcache.get_many(('test', 'test2')).values()),
             ['test', 'test2'])
 
+
+    def test_fc_setmany_deletemany(self):
+        '''Tests set_many and delete_many on FileCache.'''
+        testcache = file.FileCache('test_wsgistate')
+        testcache.set_many({'test': 'test', 'test2': 'test2'})
+        self.assertEqual(testcache.get('test2'), 'test2')
+        self.assertEqual(
+            testcache.get_many(('test', 'test2', 'test3')),
+            {'test': 'test', 'test2': 'test2'})
+        testcache.delete_many(('test', 'test3'))
+        self.assertEqual(testcache.get_many(('test', 'test2')),
+                         {'test2': 'test2'})
     def test_fc_in_true(self):
         '''Tests in (true) on FileCache.'''
         testcache = file.FileCache('test_wsgistate')
@@ -224,6 +614,84 @@ class TestWsgiState(unittest.TestCase):
         time.sleep(1)
         self.assertEqual(testcache.get('test'), None)
 
+    def test_fc_set_timeout(self):
+        '''Tests per item timeout in FileCache.'''
+        testcache = file.FileCache('test_wsgistate')
+        testcache.set('test', 'test', 1)
+        testcache.set('test2', 'test2')
+        time.sleep(1)
+        self.assertEqual(testcache.get('test'), None)
+        self.assertEqual(testcache.get('test2'), 'test2')
+
+    def test_fc_add_touch(self):
+        '''Tests add and touch on FileCache.'''
+        testcache = file.FileCache('test_wsgistate', timeout=1)
+        testcache.delete('test')
+        self.assertEqual(testcache.add('test', 'test'), True)
+        self.assertEqual(testcache.add('test', 'test2'), False)
+        self.assertEqual(testcache.touch('test', 300), True)
+        time.sleep(1)
+        self.assertEqual(testcache.get('test'), 'test')
+
+    def test_fc_stats(self):
+        '''Tests statistics on FileCache.'''
+        testcache = file.FileCache(
+            os.path.join('test_wsgistate', 'stats'), stats=True)
+        for name in testcache.keys():
+            os.remove(os.path.join('test_wsgistate', 'stats', name))
+        testcache.set('test', 'test')
+        testcache.set('test2', 'test2', -1)
+        testcache.get('test')
+        testcache.get('test2')
+        stats = testcache.stats()
+        self.assertEqual(
+            (stats['hits'], stats['misses'], stats['sets'],
+             stats['expirations'], stats['entries']), (1, 1, 2, 1, 1))
+        self.assertEqual(stats['bytes'] > 0, True)
+
+    def test_fc_reap(self):
+        '''Tests background reaping in FileCache.'''
+        testcache = file.FileCache(
+            'test_wsgistate', reap_interval=0.1, reap_batch=2)
+        for i in range(5):
+            testcache.set('reap%d' % i, 'test', 1)
+        testcache.set('reap 5', 'test', 1)
+        testcache.set('test2', 'test2')
+        time.sleep(1.5)
+        testcache.close()
+        self.assertEqual(
+            [k for k in testcache.keys() if k.startswith('reap')], [])
+        # Reaped keys leave the eviction policy too
+        self.assertEqual(len(testcache._policy), 1)
+        self.assertEqual(testcache.get('test2'), 'test2')
+
+    def test_fc_threads(self):
+        '''Tests concurrent use of FileCache's eviction policy.'''
+        testcache = file.FileCache(
+            'test_wsgistate', max_entries=20, eviction='lru')
+        errors = []
+
+        def worker(num):
+            try:
+                for i in range(100):
+                    key = 'thread%d' % ((i + num) % 30)
+                    if i % 3:
+                        testcache.get(key)
+                    elif i % 2:
+                        testcache.delete(key)
+                    else:
+                        testcache.set(key, key)
+            except Exception as e:
+                errors.append(e)
+        threads = [
+            threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(testcache._policy) <= 30, True)
+
     def test_db_set_getitem(self):
         '''Tests __setitem__ and __setitem__ on DbCache.'''
         testcache = db.DbCache('sqlite://')
@@ -259,6 +727,18 @@ class TestWsgiState(unittest.TestCase):
             sorted(testcache.get_many(('test', 'test2'))),
             ['test', 'test2'])
 
+
+    def test_db_setmany_deletemany(self):
+        '''Tests set_many and delete_many on DbCache.'''
+        testcache = db.DbCache('sqlite://')
+        testcache.set_many({'test': 'test', 'test2': 'test2'})
+        self.assertEqual(testcache.get('test2'), 'test2')
+        self.assertEqual(
+            testcache.get_many(('test', 'test2', 'test3')),
+            {'test': 'test', 'test2': 'test2'})
+        testcache.delete_many(('test', 'test3'))
+        self.assertEqual(testcache.get_many(('test', 'test2')),
+                         {'test2': 'test2'})
     def test_db_in_true(self):
         '''Tests in (true) on DbCache.'''
         testcache = db.DbCache('sqlite://')
@@ -278,6 +758,24 @@ class TestWsgiState(unittest.TestCase):
         time.sleep(2)
         self.assertEqual(testcache.get('test'), None)
 
+    def test_db_set_timeout(self):
+        '''Tests per item timeout in DbCache.'''
+        testcache = db.DbCache('sqlite://')
+        testcache.set('test', 'test', 1)
+        testcache.set('test2', 'test2')
+        time.sleep(2)
+        self.assertEqual(testcache.get('test'), None)
+        self.assertEqual(testcache.get('test2'), 'test2')
+
+    def test_db_add_touch(self):
+        '''Tests add and touch on DbCache.'''
+        testcache = db.DbCache('sqlite://', timeout=1)
+        self.assertEqual(testcache.add('test', 'test'), True)
+        self.assertEqual(testcache.add('test', 'test2'), False)
+        self.assertEqual(testcache.touch('test', 300), True)
+        time.sleep(2)
+        self.assertEqual(testcache.get('test'), 'test')
+
     def test_mcd_set_getitem(self):
         '''Tests __setitem__ and __setitem__ on MemCache.'''
         testcache = memcached.MemCached('localhost')
@@ -313,6 +811,18 @@ class TestWsgiState(unittest.TestCase):
             sorted(testcache.get_many(('test', 'test2')).values()),
             ['test', 'test2'])
 
+
+    def test_mcd_setmany_deletemany(self):
+        '''Tests set_many and delete_many on MemCached.'''
+        testcache = memcached.MemCached('localhost')
+        testcache.set_many({'test': 'test', 'test2': 'test2'})
+        self.assertEqual(testcache.get('test2'), 'test2')
+        self.assertEqual(
+            testcache.get_many(('test', 'test2', 'test3')),
+            {'test': 'test', 'test2': 'test2'})
+        testcache.delete_many(('test', 'test3'))
+        self.assertEqual(testcache.get_many(('test', 'test2')),
+                         {'test2': 'test2'})
     def test_mcd_in_true(self):
         '''Tests in (true) on MemCache.'''
         testcache = memcached.MemCached('localhost')
@@ -332,6 +842,385 @@ class TestWsgiState(unittest.TestCase):
         time.sleep(1)
         self.assertEqual(testcache.get('test'), None)
 
+    def test_shm_set_get(self):
+        '''Tests set, get and delete on ShmCache.'''
+        testcache = shm.ShmCache()
+        testcache.set('test', {'test': 'test'})
+        self.assertEqual(testcache.get('test'), {'test': 'test'})
+        self.assertEqual('test' in testcache, True)
+        testcache.delete('test')
+        self.assertEqual(testcache.get('test'), None)
+
+    def test_shm_timeout(self):
+        '''Tests timeout in ShmCache.'''
+        testcache = shm.ShmCache()
+        testcache.set('test', 'test', 1)
+        self.assertEqual(testcache.add('test', 'test2'), False)
+        time.sleep(1)
+        self.assertEqual(testcache.get('test'), None)
+        self.assertEqual(testcache.add('test', 'test2'), True)
+
+    def test_shm_eviction(self):
+        '''Tests least recently used eviction and oversized items in
+        ShmCache.'''
+        testcache = shm.ShmCache(max_entries=4, ways=4, slot_size=256)
+        for i in range(4):
+            testcache.set('test%d' % i, i)
+        testcache.get('test0')
+        testcache.set('test4', 4)
+        self.assertEqual(testcache.get('test1'), None)
+        self.assertEqual(testcache.get('test0'), 0)
+        testcache.set('test0', 'x' * 256)
+        self.assertEqual(testcache.get('test0'), None)
+        self.assertEqual(len(testcache.keys()), 3)
+
+    def test_shm_fork(self):
+        '''Tests ShmCache is shared with forked processes.'''
+        if not hasattr(os, 'fork'):
+            return
+        testcache = shm.ShmCache()
+        pid = os.fork()
+        if not pid:
+            testcache.set('test', 'test')
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(testcache.get('test'), 'test')
+
+    def test_mc_reap(self):
+        '''Tests background reaping in MemoryCache.'''
+        testcache = memory.MemoryCache(reap_interval=0.1, reap_batch=2)
+        for i in range(5):
+            testcache.set('reap%d' % i, 'test', 1)
+        testcache.set('test2', 'test2')
+        time.sleep(1.5)
+        self.assertEqual(sorted(testcache.keys()), ['test2'])
+        self.assertEqual(testcache.nbytes, 0)
+        testcache.close()
+        self.assertEqual(testcache._reaper, None)
+
+    def test_smc_reap(self):
+        '''Tests one background reaper sweeps every shard.'''
+        testcache = memory.ShardedMemoryCache(shards=4, reap_interval=0.1)
+        self.assertEqual(
+            [s._reaper for s in testcache._shards], [None] * 4)
+        for i in range(20):
+            testcache.set('reap%d' % i, 'test', 1)
+        time.sleep(1.5)
+        testcache.close()
+        self.assertEqual(list(testcache.keys()), [])
+
+    def test_reap_shutdown(self):
+        '''Tests SessionCache.shutdown stops the background reaper.'''
+        testcache = memory.MemoryCache(reap_interval=0.1)
+        reaper = testcache._reaper
+        self.assertEqual(reaper.alive, True)
+        session.SessionCache(testcache).shutdown()
+        self.assertEqual(reaper.alive, False)
+
+    def test_reap_fork(self):
+        '''Tests background reapers restart in forked processes.'''
+        if not hasattr(os, 'register_at_fork'):
+            return
+        testcache = memory.MemoryCache(reap_interval=0.1)
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.write(wfd, str(int(testcache._reaper.alive)).encode())
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(rfd, 1), '1'.encode())
+        testcache.close()
+
+    def test_reap_fork_write(self):
+        '''Tests background reapers run in a forked process once it writes
+        to the cache, with or without os.register_at_fork().'''
+        testcache = memory.MemoryCache(reap_interval=0.1)
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            testcache.set('test', 'test', 1)
+            time.sleep(1.5)
+            alive = testcache._reaper.alive and 'test' not in testcache._cache
+            os.write(wfd, str(int(alive)).encode())
+            os._exit(0)
+        os.close(wfd)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(rfd, 1), '1'.encode())
+        testcache.close()
+
+    def test_reap_fork_locked(self):
+        '''Tests forks don't copy a cache lock held by the reaper.'''
+        if not hasattr(os, 'register_at_fork'):
+            return
+        import signal
+        from wsgistate import synchronized
+
+        class SlowCache(memory.MemoryCache):
+            @synchronized
+            def reap(self, limit=100):
+                time.sleep(0.2)
+                return False
+        testcache = SlowCache(reap_interval=0.01)
+        # Fork while the reaper holds the cache lock
+        time.sleep(0.05)
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            # Give up rather than hang if the lock was copied held
+            signal.alarm(2)
+            testcache.set('test', 'test')
+            os.write(wfd, '1'.encode())
+            os._exit(0)
+        os.close(wfd)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(rfd, 1), '1'.encode())
+        testcache.close()
+
+    def test_mc_setmany_rw(self):
+        '''Tests batch operations on MemoryCache in readers-writer mode.'''
+        testcache = memory.MemoryCache(lock='rw')
+        value = {'a': [1]}
+        testcache.set_many({'test': value, 'test2': 'test2'})
+        result = testcache.get_many(('test', 'test2', 'test3'))
+        self.assertEqual(result, {'test': value, 'test2': 'test2'})
+        # Batches copy values like single calls
+        self.assertEqual(result['test'] is value, False)
+        testcache.delete_many(('test', 'test2'))
+        self.assertEqual(testcache.get_many(('test', 'test2')), {})
+
+    def test_smc_setmany_deletemany(self):
+        '''Tests set_many and delete_many on ShardedMemoryCache.'''
+        testcache = memory.ShardedMemoryCache(shards=4)
+        items = dict(('test%d' % i, i) for i in range(20))
+        testcache.set_many(items)
+        self.assertEqual(testcache.get_many(items), items)
+        testcache.delete_many(['test%d' % i for i in range(10)])
+        self.assertEqual(
+            sorted(testcache.get_many(items).values()), list(range(10, 20)))
+
+    def test_tc_set_get(self):
+        '''Tests set, get and delete on TieredCache.'''
+        l2 = memory.MemoryCache()
+        testcache = tiered.TieredCache(l2)
+        testcache.set('test', 'test')
+        self.assertEqual(testcache.l1.get('test'), 'test')
+        self.assertEqual(l2.get('test'), 'test')
+        self.assertEqual(testcache.get('test'), 'test')
+        testcache.delete('test')
+        self.assertEqual(testcache.get('test'), None)
+        self.assertEqual(l2.get('test'), None)
+
+    def test_tc_backfill(self):
+        '''Tests TieredCache copies L2 hits into L1 for l1_timeout.'''
+        l2 = simple.SimpleCache()
+        testcache = tiered.TieredCache(l2, l1_timeout=1)
+        l2.set('test', 'test')
+        self.assertEqual(testcache.l1.get('test'), None)
+        self.assertEqual(testcache.get('test'), 'test')
+        self.assertEqual(testcache.l1.get('test'), 'test')
+        # Changes made behind L1 show up once it times out
+        l2.set('test', 'test2')
+        self.assertEqual(testcache.get('test'), 'test')
+        time.sleep(1.1)
+        self.assertEqual(testcache.get('test'), 'test2')
+
+    def test_tc_add_touch(self):
+        '''Tests add and touch on TieredCache go through L2.'''
+        l2 = simple.SimpleCache()
+        testcache = tiered.TieredCache(l2)
+        l2.set('test', 'test')
+        self.assertEqual(testcache.add('test', 'test2'), False)
+        self.assertEqual(testcache.add('test2', 'test2'), True)
+        self.assertEqual(l2.get('test2'), 'test2')
+        self.assertEqual(testcache.touch('test2', 60), True)
+        self.assertEqual(testcache.touch('none'), False)
+
+    def test_tc_many(self):
+        '''Tests batches on TieredCache.'''
+        l2 = memory.MemoryCache()
+        testcache = tiered.TieredCache(l2, l1_max_entries=5)
+        items = dict(('test%d' % i, i) for i in range(20))
+        testcache.set_many(items)
+        self.assertEqual(l2.get_many(items), items)
+        self.assertEqual(testcache.get_many(list(items) + ['none']), items)
+        testcache.delete_many(['test%d' % i for i in range(10)])
+        self.assertEqual(
+            sorted(testcache.get_many(items).values()), list(range(10, 20)))
+        self.assertEqual(testcache.stats()['entries'], 10)
+
+    def test_tc_copy(self):
+        '''Tests objects stored in or read from TieredCache can be changed
+        without changing L1.'''
+        # L2 keeps serialized copies like memcached does
+        l2 = memory.MemoryCache(copy='frozen')
+        for mode in ('none', 'shallow', 'deep', 'frozen'):
+            testcache = tiered.TieredCache(l2, l1_copy=mode)
+            value = {'list': [1]}
+            testcache.set('test', value)
+            value['list'].append(2)
+            testcache.set_many({'test2': value})
+            value['list'].append(3)
+            self.assertEqual(testcache.get('test'), {'list': [1]})
+            self.assertEqual(testcache.get('test2'), {'list': [1, 2]})
+            # L2 hits are copied into L1 too
+            testcache.l1.delete('test')
+            testcache.get('test')['list'].append(4)
+            self.assertEqual(testcache.l1.get('test'), {'list': [1]})
+
+    def test_tc_session(self):
+        '''Tests checking sessions out of and in to TieredCache.'''
+        l2 = simple.SimpleCache()
+        tc = tiered.TieredCache(l2)
+        testcache = session.SessionCache(tc)
+        tc.set('sid', {})
+        for i in range(3):
+            sid, sess = testcache.checkout('sid')
+            self.assertEqual(sid, 'sid')
+            sess['count'] = sess.get('count', 0) + 1
+            testcache.checkin(sid, sess)
+        self.assertEqual(testcache.checkedout, {})
+        self.assertEqual(l2.get('sid'), {'count': 3})
+        self.assertEqual(tc.get('sid'), {'count': 3})
+        self.assertEqual(testcache.checkout('none'), (None, None))
+
+    def test_tc_memoize(self):
+        '''Tests memoizing with TieredCache.'''
+        calls = list()
+
+        @tiered.memoize(memory.MemoryCache(), lease=True)
+        def app(environ, start_response):
+            calls.append(1)
+            start_response('200 OK', [])
+            return ['test']
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        self.assertEqual(app(dict(env), self.dummy_sr), ['test'])
+        self.assertEqual(app(dict(env), self.dummy_sr), ['test'])
+        self.assertEqual(len(calls), 1)
+
+    def test_shc_set_get(self):
+        '''Tests set, get and delete on ShardedCache.'''
+        shards = [simple.SimpleCache() for i in range(4)]
+        testcache = sharded.ShardedCache(shards)
+        for i in range(100):
+            testcache.set('test%d' % i, i)
+        self.assertEqual(testcache.get('test7'), 7)
+        self.assertEqual(testcache.get('none'), None)
+        # Every shard gets a share of the keys
+        self.assertEqual(all(len(s.keys()) > 10 for s in shards), True)
+        self.assertEqual(testcache.add('test7', 8), False)
+        testcache.delete('test7')
+        self.assertEqual(testcache.get('test7'), None)
+        self.assertEqual(testcache.stats()['entries'], 99)
+
+    def test_shc_remap(self):
+        '''Tests adding or removing a shard moves about 1/N of the keys.'''
+        testcache = sharded.ShardedCache(dict(
+            ('shard%d' % i, simple.SimpleCache()) for i in range(4)))
+        keys = ['test%d' % i for i in range(2000)]
+        before = dict((k, testcache.shardname(k)) for k in keys)
+        testcache.add_shard('shard4', simple.SimpleCache())
+        after = dict((k, testcache.shardname(k)) for k in keys)
+        moved = [k for k in keys if before[k] != after[k]]
+        self.assertEqual(all(after[k] == 'shard4' for k in moved), True)
+        self.assertEqual(200 < len(moved) < 600, True)
+        testcache.remove_shard('shard4')
+        self.assertEqual(
+            dict((k, testcache.shardname(k)) for k in keys), before)
+
+    def test_shc_many(self):
+        '''Tests batches on ShardedCache.'''
+        testcache = sharded.ShardedCache(
+            [memory.MemoryCache() for i in range(3)], workers=2)
+        items = dict(('test%d' % i, i) for i in range(30))
+        testcache.set_many(items)
+        self.assertEqual(testcache.get_many(list(items) + ['none']), items)
+        testcache.delete_many(['test%d' % i for i in range(10)])
+        self.assertEqual(
+            sorted(testcache.get_many(items).values()), list(range(10, 30)))
+        testcache.close()
+
+    def test_shc_backends(self):
+        '''Tests making ShardedCache shards from specifications.'''
+        caches = sharded.backends('simple memory', max_entries=10)
+        self.assertEqual(sorted(caches), ['memory', 'simple'])
+        self.assertEqual(caches['simple']._max_entries, 10)
+        self.assertRaises(ValueError, sharded.backends, 'none:')
+        app = sharded.shardedmemo_deploy(
+            {}, backends='simple memory')(self.my_app3)
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        self.assertEqual(app(env, self.dummy_sr), ['passed'])
+        self.assertEqual(app(env, self.dummy_sr), ['passed'])
+
+    def test_shc_reap(self):
+        '''Tests ShardedCache's reaper is the only one sweeping shards made
+        from specifications, and leaves out shards that aren't
+        thread-safe.'''
+        caches = sharded.backends('simple memory', reap_interval=0.1)
+        self.assertEqual(
+            [c._reaper for c in caches.values()], [None, None])
+        testcache = sharded.ShardedCache(caches, reap_interval=0.1)
+        for name, shard in caches.items():
+            shard.set('test', 'test', 1)
+        time.sleep(1.5)
+        testcache.close()
+        self.assertEqual(caches['memory']._cache, {})
+        self.assertEqual(list(caches['simple']._cache), ['test'])
+
+    def test_shm_setmany_deletemany(self):
+        '''Tests set_many and delete_many on ShmCache.'''
+        testcache = shm.ShmCache(locks=2)
+        items = dict(('test%d' % i, i) for i in range(20))
+        testcache.set_many(items)
+        self.assertEqual(testcache.get('test3'), 3)
+        self.assertEqual(testcache.get_many(list(items) + ['none']), items)
+        testcache.delete_many(['test%d' % i for i in range(10)])
+        self.assertEqual(
+            sorted(testcache.get_many(items).values()), list(range(10, 20)))
+
+    def test_shm_stats(self):
+        '''Tests statistics on ShmCache.'''
+        testcache = shm.ShmCache(max_entries=2, ways=2, stats=True)
+        testcache.set('test', 'test')
+        testcache.set('test2', 'test2')
+        testcache.set('test3', 'test3')
+        testcache.get('test3')
+        testcache.set('test4', 'x' * 70000)
+        stats = testcache.stats()
+        self.assertEqual(
+            (stats['sets'], stats['hits'], stats['evictions'],
+             stats['rejections'], stats['entries']), (4, 1, 1, 1, 2))
+        # Slots hold their full size of data by default
+        testcache.set('test5', 'x' * 60000)
+        self.assertEqual(len(testcache.get('test5')), 60000)
+
+    def test_dec_wsgimemoize_shm(self):
+        '''Tests memoizing with ShmCache.'''
+        @shm.memoize()
+        def cacheapp(environ, start_response):
+            start_response('200 OK', [])
+            return [str(time.time())]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        result1 = cacheapp(env, self.dummy_sr)
+        result2 = cacheapp(env, self.dummy_sr)
+        self.assertEqual(result1 == result2, True)
+
+    def test_mcd_set_timeout(self):
+        '''Tests per item timeout in MemCached.'''
+        testcache = memcached.MemCached('localhost')
+        testcache.set('test', 'test', 1)
+        testcache.set('test2', 'test2')
+        time.sleep(2)
+        self.assertEqual(testcache.get('test'), None)
+        self.assertEqual(testcache.get('test2'), 'test2')
+
+    def test_mcd_add(self):
+        '''Tests add on MemCached.'''
+        testcache = memcached.MemCached('localhost')
+        testcache.delete('test')
+        self.assertEqual(testcache.add('test', 'test'), True)
+        self.assertEqual(testcache.add('test', 'test2'), False)
+        self.assertEqual(testcache.get('test'), 'test')
+
     def test_cookiesession_sc(self):
         '''Tests session cookies with SimpleCache.'''
         testc = simple.SimpleCache()
@@ -1022,6 +1911,662 @@ class TestWsgiState(unittest.TestCase):
         result2 = cacheapp(env, self.dummy_sr)
         self.assertEqual(result1 == result2, True)
 
+    def test_wsgimemoize_ttl(self):
+        '''Tests memoizing honors the application's max-age.'''
+        testc = simple.SimpleCache()
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Cache-Control', 'max-age=1')])
+            return [str(time.time())]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        result1 = cacheapp(env, self.dummy_sr)
+        self.assertEqual(cacheapp(env, self.dummy_sr), result1)
+        time.sleep(1.1)
+        self.assertNotEqual(cacheapp(env, self.dummy_sr), result1)
+
+    def test_wsgimemoize_coalesce(self):
+        '''Tests concurrent misses for a key render once.'''
+        testc = memory.MemoryCache()
+        calls = list()
+
+        def app(environ, start_response):
+            calls.append(1)
+            time.sleep(0.2)
+            start_response('200 OK', [])
+            return [str(time.time())]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        results = list()
+
+        def request():
+            results.append(cacheapp(dict(env), self.dummy_sr))
+        threads = [threading.Thread(target=request) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results.count(results[0]), 5)
+
+    def test_wsgimemoize_coalesce_timeout(self):
+        '''Tests requests stop waiting for a slow render.'''
+        testc = memory.MemoryCache()
+        calls = list()
+
+        def app(environ, start_response):
+            calls.append(1)
+            time.sleep(0.5)
+            start_response('200 OK', [])
+            return ['test']
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc, wait_timeout='0.1')
+        threads = [
+            threading.Thread(target=cacheapp, args=(dict(env), self.dummy_sr))
+            for i in range(2)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 2)
+
+    def test_wsgimemoize_lease(self):
+        '''Tests requests wait for another process holding a lease.'''
+        testc = memory.MemoryCache()
+
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return ['local']
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(
+            app, testc, lease='true', wait_timeout=2)
+        # Another process renders the key and releases its lease
+        testc.add('wsgistate.lease:/', True)
+
+        def render():
+            time.sleep(0.1)
+            testc.set('/', {'status': '200 OK', 'headers': [],
+                            'exc_info': None, 'data': ['remote']})
+            testc.delete('wsgistate.lease:/')
+        threading.Thread(target=render).start()
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['remote'])
+        # A lease that is given up without a response is rendered locally
+        testc.delete('/')
+        testc.add('wsgistate.lease:/', True, 1)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['local'])
+        self.assertEqual(testc.get('wsgistate.lease:/'), None)
+
+    def test_wsgimemoize_pass(self):
+        '''Tests requests don't wait on responses that can't be cached.'''
+        testc = memory.MemoryCache()
+        calls = list()
+
+        def app(environ, start_response):
+            calls.append(1)
+            start_response('200 OK', [('Set-Cookie', 'a=b')])
+            time.sleep(0.3)
+            return ['test']
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc, lease='true')
+        threads = [
+            threading.Thread(target=cacheapp, args=(dict(env), self.dummy_sr))
+            for i in range(4)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(time.time() - start < 0.55, True)
+        # Other processes learn to pass from the lease key
+        self.assertEqual(testc.get('wsgistate.lease:/'), 'pass')
+        # Later requests render at once
+        start = time.time()
+        threads = [
+            threading.Thread(target=cacheapp, args=(dict(env), self.dummy_sr))
+            for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 6)
+        self.assertEqual(time.time() - start < 0.55, True)
+
+    def test_wsgimemoize_stale(self):
+        '''Tests stale responses are served while they are rendered again.'''
+        testc = memory.MemoryCache()
+        calls = list()
+
+        def app(environ, start_response):
+            calls.append(1)
+            start_response('200 OK', [('Cache-Control', 'max-age=1')])
+            return [str(len(calls))]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc, grace='5')
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['1'])
+        time.sleep(1.1)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['1'])
+        time.sleep(0.2)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['2'])
+        self.assertEqual(len(calls), 2)
+
+    def test_wsgimemoize_stale_if_error(self):
+        '''Tests stale responses are kept when rendering them fails.'''
+        testc = memory.MemoryCache()
+        calls = list()
+
+        def app(environ, start_response):
+            calls.append(1)
+            if len(calls) == 2:
+                raise ValueError()
+            if len(calls) == 3:
+                start_response('503 Service Unavailable', [])
+                return ['error']
+            start_response('200 OK', [('Cache-Control', 'max-age=1')])
+            return [str(len(calls))]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc, grace=5)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['1'])
+        time.sleep(1.1)
+        for i in range(2):
+            self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['1'])
+            time.sleep(0.2)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['1'])
+        time.sleep(0.2)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['4'])
+        self.assertEqual(len(calls), 4)
+
+    def test_wsgimemoize_stale_if_error_window(self):
+        '''Tests stale responses are served past their grace period only if
+        rendering them fails.'''
+        testc = memory.MemoryCache()
+        calls = list()
+
+        def app(environ, start_response):
+            calls.append(1)
+            if len(calls) == 2:
+                raise ValueError()
+            if len(calls) == 3:
+                start_response('503 Service Unavailable', [])
+                return ['error']
+            start_response('200 OK', [('Cache-Control', 'max-age=1')])
+            return [str(len(calls))]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc, stale_if_error='5')
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['1'])
+        time.sleep(1.1)
+        # Failed renders send the stale copy
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['1'])
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['1'])
+        # A good render is sent and replaces it
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['4'])
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['4'])
+        self.assertEqual(len(calls), 4)
+
+    def test_wsgimemoize_single_write(self):
+        '''Tests a miss writes the response to the cache once.'''
+        testc = memory.MemoryCache(stats=True)
+
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return ['test']
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        cacheapp(dict(env), self.dummy_sr)
+        stats = testc.stats()
+        self.assertEqual(
+            (stats['sets'], stats['hits'], stats['misses']), (1, 0, 1))
+
+    def test_wsgimemoize_lazy_start_response(self):
+        '''Tests memoizing apps that start responses while iterating.'''
+        testc = simple.SimpleCache()
+
+        def app(environ, start_response):
+            write = start_response('200 OK', [])
+            write('1')
+            yield '2'
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        written = list()
+
+        def sr(status, headers, exc_info=None):
+            return written.append
+        self.assertEqual(cacheapp(dict(env), sr), ['2'])
+        self.assertEqual(written, ['1'])
+        self.assertEqual(cacheapp(dict(env), sr), ['1', '2'])
+
+    def test_wsgimemoize_exc_info(self):
+        '''Tests error pages started with exc_info aren't cached.'''
+        testc = simple.SimpleCache()
+
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            try:
+                raise ValueError()
+            except ValueError:
+                start_response('500 Error', [], sys.exc_info())
+            return ['error']
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['error'])
+        self.assertEqual(testc.get('/'), None)
+
+    def test_wsgimemoize_stream(self):
+        '''Tests streaming responses are cached once sent in full.'''
+        testc = simple.SimpleCache()
+        produced, closed = list(), list()
+
+        class Body(object):
+            def __iter__(self):
+                for chunk in ('1', '2', '3'):
+                    produced.append(chunk)
+                    yield chunk
+
+            def close(self):
+                closed.append(1)
+
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return Body()
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc, stream='true')
+        result = cacheapp(dict(env), self.dummy_sr)
+        chunks = iter(result)
+        self.assertEqual(next(chunks), '1')
+        self.assertEqual(produced, ['1'])
+        # Responses cut short aren't cached
+        result.close()
+        self.assertEqual(closed, [1])
+        self.assertEqual(testc.get('/'), None)
+        result = cacheapp(dict(env), self.dummy_sr)
+        self.assertEqual(list(result), ['1', '2', '3'])
+        result.close()
+        self.assertEqual(closed, [1, 1])
+        self.assertEqual(testc.get('/')['data'], ['1', '2', '3'])
+
+    def test_wsgimemoize_max_cacheable_bytes(self):
+        '''Tests responses over max_cacheable_bytes aren't cached.'''
+        for stream in (False, True):
+            testc = simple.SimpleCache()
+
+            def app(environ, start_response):
+                start_response('200 OK', [])
+                return ['x' * 10] * int(environ['PATH_INFO'][1:])
+            cacheapp = cache.WsgiMemoize(
+                app, testc, stream=stream, max_cacheable_bytes='20')
+            for path in ('/2', '/3'):
+                env = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}
+                self.assertEqual(
+                    len(list(cacheapp(env, self.dummy_sr))), int(path[1:]))
+            self.assertEqual(testc.get('/2')['data'], ['x' * 10] * 2)
+            self.assertEqual(testc.get('/3'), None)
+
+    def test_wsgimemoize_etag(self):
+        '''Tests cached responses answer If-None-Match with 304.'''
+        testc = simple.SimpleCache()
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return ['test']
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        response = dict()
+
+        def sr(status, headers, exc_info=None):
+            response.update(status=status, headers=dict(headers))
+        # The response that is cached carries the validators too
+        self.assertEqual(cacheapp(dict(env), sr), ['test'])
+        etag = response['headers']['ETag']
+        modified = response['headers']['Last-Modified']
+        self.assertEqual(etag.startswith('"'), True)
+        self.assertEqual(cacheapp(dict(env), sr), ['test'])
+        self.assertEqual(response['headers']['ETag'], etag)
+        self.assertEqual(response['headers']['Last-Modified'], modified)
+        env['HTTP_IF_NONE_MATCH'] = 'W/"other", %s' % etag
+        self.assertEqual(cacheapp(dict(env), sr), [])
+        self.assertEqual(response['status'], '304 Not Modified')
+        self.assertEqual(response['headers']['ETag'], etag)
+        self.assertEqual('Content-Type' in response['headers'], False)
+        env['HTTP_IF_NONE_MATCH'] = '"other"'
+        self.assertEqual(cacheapp(dict(env), sr), ['test'])
+        self.assertEqual(response['status'], '200 OK')
+
+    def test_wsgimemoize_last_modified(self):
+        '''Tests cached responses answer If-Modified-Since with 304.'''
+        testc = simple.SimpleCache()
+        modified = 'Sat, 01 Jan 2000 00:00:00 GMT'
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Last-Modified', modified)])
+            return ['test']
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        cacheapp(dict(env), self.dummy_sr)
+        response = dict()
+
+        def sr(status, headers, exc_info=None):
+            response.update(status=status, headers=dict(headers))
+        env['HTTP_IF_MODIFIED_SINCE'] = modified
+        self.assertEqual(cacheapp(dict(env), sr), [])
+        self.assertEqual(response['status'], '304 Not Modified')
+        env['HTTP_IF_MODIFIED_SINCE'] = 'Fri, 31 Dec 1999 00:00:00 GMT'
+        self.assertEqual(cacheapp(dict(env), sr), ['test'])
+        self.assertEqual(response['headers']['Last-Modified'], modified)
+
+    def test_wsgimemoize_compress(self):
+        '''Tests responses are stored gzipped and decompressed as needed.'''
+        import zlib
+        testc = simple.SimpleCache()
+        body = 'test ' * 500
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/html')])
+            return [body]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc, compress='true')
+        response = dict()
+
+        def sr(status, headers, exc_info=None):
+            response.update(status=status, headers=dict(headers))
+        cacheapp(dict(env), sr)
+        self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+        # Hits decompressed for the client are sent as bytes
+        self.assertEqual(cacheapp(dict(env), sr), [body.encode('latin-1')])
+        self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+        self.assertEqual('Content-Encoding' in response['headers'], False)
+        self.assertEqual(
+            response['headers']['Content-Length'], str(len(body)))
+        etag = response['headers']['ETag']
+        env['HTTP_ACCEPT_ENCODING'] = 'deflate, gzip;q=0.5'
+        data = cacheapp(dict(env), sr)
+        self.assertEqual(response['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(len(data[0]) < len(body), True)
+        self.assertEqual(zlib.decompress(data[0], 16 + zlib.MAX_WBITS),
+                         body.encode('latin-1'))
+        self.assertNotEqual(response['headers']['ETag'], etag)
+        env['HTTP_IF_NONE_MATCH'] = response['headers']['ETag']
+        self.assertEqual(cacheapp(dict(env), sr), [])
+        self.assertEqual(response['status'], '304 Not Modified')
+        env['HTTP_ACCEPT_ENCODING'] = 'gzip;q=0, identity'
+        del env['HTTP_IF_NONE_MATCH']
+        self.assertEqual(cacheapp(dict(env), sr), [body.encode('latin-1')])
+        self.assertEqual('Content-Encoding' in response['headers'], False)
+
+    def test_wsgimemoize_compress_small(self):
+        '''Tests small or binary responses aren't compressed.'''
+        testc = simple.SimpleCache()
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', environ['type'])])
+            return ['test' * 400]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET',
+               'HTTP_ACCEPT_ENCODING': 'gzip', 'type': 'image/png'}
+        cacheapp = cache.WsgiMemoize(app, testc, compress=True)
+        response = dict()
+
+        def sr(status, headers, exc_info=None):
+            response.update(headers=dict(headers))
+        cacheapp(dict(env), sr)
+        self.assertEqual('gzip' in testc.get('/'), False)
+        # Responses sent one way only don't vary on the client's encodings
+        self.assertEqual('Vary' in response['headers'], False)
+        self.assertEqual(
+            'Vary' in dict(testc.get('/')['headers']), False)
+        testc.delete('/')
+        env['type'] = 'text/plain'
+        cacheapp = cache.WsgiMemoize(
+            app, testc, compress=True, compress_min_bytes=4096)
+        cacheapp(dict(env), sr)
+        self.assertEqual('gzip' in testc.get('/'), False)
+        self.assertEqual('Vary' in response['headers'], False)
+
+    def test_wsgimemoize_gzip_passthrough(self):
+        '''Tests responses the application gzipped are stored as they
+        are.'''
+        import zlib
+        testc = simple.SimpleCache()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = compressor.compress(b'test') + compressor.flush()
+
+        def app(environ, start_response):
+            start_response('200 OK', [
+                ('Content-Type', 'text/plain'),
+                ('Content-Encoding', 'gzip'),
+                ('Content-Length', str(len(body)))])
+            return [body]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc, compress=True)
+        cacheapp(dict(env), self.dummy_sr)
+        response = dict()
+
+        def sr(status, headers, exc_info=None):
+            response.update(headers=headers)
+        self.assertEqual(cacheapp(dict(env), sr), [b'test'])
+        self.assertEqual(
+            [v for k, v in response['headers'] if k == 'Content-Length'],
+            ['4'])
+        env['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        self.assertEqual(cacheapp(dict(env), sr), [body])
+
+    def test_wsgimemoize_vary(self):
+        '''Tests responses are cached per variant of their Vary headers.'''
+        testc = simple.SimpleCache()
+        calls = list()
+
+        def app(environ, start_response):
+            calls.append(1)
+            start_response('200 OK', [('Vary', 'Accept-Language')])
+            return [environ.get('HTTP_ACCEPT_LANGUAGE', 'none')]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        for lang in ('en', 'fr', 'en', ' fr ', 'fr'):
+            env['HTTP_ACCEPT_LANGUAGE'] = lang
+            self.assertEqual(
+                cacheapp(dict(env), self.dummy_sr), [lang.strip()])
+        del env['HTTP_ACCEPT_LANGUAGE']
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['none'])
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['none'])
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(testc.get('/'), {'vary': ['accept-language']})
+
+    def test_wsgimemoize_vary_nonascii(self):
+        '''Tests variants of headers holding raw UTF-8 bytes.'''
+        testc = simple.SimpleCache()
+        calls = list()
+
+        def app(environ, start_response):
+            calls.append(1)
+            start_response('200 OK', [('Vary', 'Accept-Language, Cookie')])
+            return [environ['HTTP_ACCEPT_LANGUAGE']]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET',
+               'HTTP_COOKIE': 'name=caf\xc3\xa9'}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        for lang in ('fr-\xc3\xa9', 'fr', 'fr-\xc3\xa9'):
+            env['HTTP_ACCEPT_LANGUAGE'] = lang
+            self.assertEqual(cacheapp(dict(env), self.dummy_sr), [lang])
+        self.assertEqual(len(calls), 2)
+
+    def test_wsgimemoize_vary_star(self):
+        '''Tests responses that vary on anything aren't cached.'''
+        testc = simple.SimpleCache()
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Vary', '*')])
+            return ['test']
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        cacheapp(dict(env), self.dummy_sr)
+        self.assertEqual(list(testc.keys()), [])
+
+    def test_wsgimemoize_vary_compress(self):
+        '''Tests compressed responses keep one variant for every
+        encoding.'''
+        testc = simple.SimpleCache()
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return ['test' * 400]
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET',
+               'HTTP_ACCEPT_ENCODING': 'gzip'}
+        cacheapp = cache.WsgiMemoize(app, testc, compress=True)
+        cacheapp(dict(env), self.dummy_sr)
+        self.assertEqual(testc.get('/')['gzip'], True)
+
+    def test_wsgimemoize_canonical_query(self):
+        '''Tests equivalent queries share a cache entry.'''
+        testc = simple.SimpleCache()
+        calls = list()
+
+        def app(environ, start_response):
+            calls.append(1)
+            start_response('200 OK', [])
+            return ['test']
+        cacheapp = cache.WsgiMemoize(
+            app, testc, key_user_info=True, key_ignore='utm_*, fbclid')
+        for qs in ('b=2&a=1', 'a=1&b=2', 'a=1&utm_source=x&b=2&fbclid=y',
+                   'a=%31&b=2'):
+            env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET',
+                   'QUERY_STRING': qs}
+            cacheapp(env, self.dummy_sr)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(list(testc.keys()), ['/a=1&b=2'])
+        env['QUERY_STRING'] = 'a=1&b=3'
+        cacheapp(env, self.dummy_sr)
+        self.assertEqual(len(calls), 2)
+
+    def test_wsgimemoize_hashed_keys(self):
+        '''Tests keys are hashed to a fixed length.'''
+        testc = simple.SimpleCache()
+        env = {'PATH_INFO': '/' + 'x' * 500, 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(
+            self.my_app3, testc, key_hash=True, key_prefix='pages:')
+        cacheapp(dict(env), self.dummy_sr)
+        key = list(testc.keys())[0]
+        self.assertEqual(len(key), 46)
+        self.assertEqual(key.startswith('pages:'), True)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['passed'])
+        testc = simple.SimpleCache()
+        cacheapp = cache.WsgiMemoize(
+            self.my_app3, testc, key_hash='true', key_readable='10')
+        cacheapp(dict(env), self.dummy_sr)
+        key = list(testc.keys())[0]
+        self.assertEqual(key.startswith('/xxxxxxxxx#'), True)
+        self.assertEqual(len(key), 51)
+        # Characters memcached keys can't hold are left out
+        self.assertEqual(
+            cache.hashkey('/a b\tc\x7fd', readable=10)[:6], '/abcd#')
+
+    def test_wsgimemoize_hashed_derived_keys(self):
+        '''Tests variant and lease keys are hashed to the same length.'''
+        testc = memory.MemoryCache()
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Vary', 'Accept-Language')])
+            return ['test']
+        env = {'PATH_INFO': '/' + 'x' * 500, 'REQUEST_METHOD': 'GET',
+               'HTTP_ACCEPT_LANGUAGE': 'en'}
+        cacheapp = cache.WsgiMemoize(
+            app, testc, key_hash=True, key_readable=5, lease=True)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['test'])
+        keys = list(testc.keys())
+        self.assertEqual(len(keys), 2)
+        self.assertEqual([len(k) for k in keys], [46, 46])
+        self.assertEqual(
+            [k.startswith('/xxxx#') for k in keys], [True, True])
+        key = cacheapp._keygen(dict(env))
+        self.assertEqual(len(cacheapp._leasekey(key)), 46)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['test'])
+
+    def test_wsgimemoize_hashed_nonascii(self):
+        '''Tests hashed keys for paths holding raw UTF-8 bytes.'''
+        testc = memory.MemoryCache()
+        calls = list()
+
+        def app(environ, start_response):
+            calls.append(1)
+            start_response('200 OK', [])
+            return ['test']
+        env = {'PATH_INFO': '/caf\xc3\xa9', 'REQUEST_METHOD': 'GET'}
+        cacheapp = cache.WsgiMemoize(
+            app, testc, key_hash=True, key_readable=10, lease=True)
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['test'])
+        self.assertEqual(cacheapp(dict(env), self.dummy_sr), ['test'])
+        self.assertEqual(len(calls), 1)
+        key = cacheapp._keygen(dict(env))
+        self.assertEqual(len(cacheapp._leasekey(key)), len(key))
+
+    def test_wsgimemoize_policy(self):
+        '''Tests responses are cached according to their headers.'''
+        expired = 'Thu, 01 Dec 1994 16:00:00 GMT'
+        cases = [
+            ('200 OK', [('Cache-Control', 'no-store')], None),
+            ('200 OK', [('Cache-Control', 'private, max-age=60')], None),
+            ('200 OK', [('Set-Cookie', 'a=b')], None),
+            ('200 OK', [('Expires', expired)], None),
+            ('200 OK', [('Cache-Control', 'max-age=0')], None),
+            ('500 Internal Server Error', [], None),
+            ('302 Found', [], None),
+            ('302 Found', [('Cache-Control', 'max-age=60')], 60),
+            ('404 Not Found', [], 60),
+            ('404 Not Found', [('Cache-Control', 'max-age=5')], 5),
+            ('200 OK', [], 300)]
+        for status, headers, timeout in cases:
+            testc = simple.SimpleCache()
+
+            def app(environ, start_response):
+                start_response(status, list(headers))
+                return ['test']
+            env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+            cache.WsgiMemoize(app, testc)(env, self.dummy_sr)
+            info = testc.get('/')
+            if timeout is None:
+                self.assertEqual(info, None)
+            else:
+                self.assertEqual(info['timeout'], timeout)
+
+    def test_wsgimemoize_policy_options(self):
+        '''Tests the negative timeout and caching responses with
+        cookies.'''
+        testc = simple.SimpleCache()
+
+        def app(environ, start_response):
+            start_response(environ['status'], [('Set-Cookie', 'a=b')])
+            return ['test']
+        env = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET',
+               'status': '404 Not Found'}
+        cacheapp = cache.WsgiMemoize(
+            app, testc, negative_timeout='0', cache_cookies='true')
+        cacheapp(env, self.dummy_sr)
+        self.assertEqual(testc.get('/'), None)
+        env['status'] = '200 OK'
+        cacheapp(env, self.dummy_sr)
+        self.assertEqual(testc.get('/')['timeout'], 300)
+
+    def test_wsgimemoize_control_headers(self):
+        '''Tests memoizing adds cache control headers only if the
+        application set none.'''
+        testc = simple.SimpleCache()
+
+        def app(environ, start_response):
+            start_response('200 OK', list(environ['headers']))
+            return ['test']
+        env = {'PATH_INFO': '/a', 'REQUEST_METHOD': 'GET',
+               'headers': [('Cache-Control', 'public, max-age=30')]}
+        cacheapp = cache.WsgiMemoize(app, testc)
+        cacheapp(env, self.dummy_sr)
+        headers = testc.get('/a')['headers']
+        self.assertEqual(
+            [v for k, v in headers if k == 'Cache-Control'],
+            ['public, max-age=30'])
+        self.assertEqual('Expires' in dict(headers), False)
+        env = {'PATH_INFO': '/b', 'REQUEST_METHOD': 'GET', 'headers': []}
+        cacheapp(env, self.dummy_sr)
+        headers = testc.get('/b')['headers']
+        self.assertEqual(dict(headers)['Cache-Control'], 's-maxage=300')
+        self.assertEqual('Expires' in dict(headers), True)
+
     def test_public(self):
         '''Tests correct setting of Cache-Control header "public".'''
         @cache.public
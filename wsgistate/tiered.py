@@ -0,0 +1,240 @@
+# Copyright (c) 2026 the wsgistate contributors
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+'''Two-tier cache with an in-process cache in front of a shared one.'''
+
+import copy
+
+from wsgistate import BaseCache
+from wsgistate.memory import MemoryCache, _identity
+from wsgistate.cache import WsgiMemoize
+from wsgistate.session import CookieSession, URLSession, SessionCache
+
+__all__ = ['TieredCache', 'memoize', 'session', 'urlsession']
+
+_MISSING = object()
+
+
+def memoize(cache, **kw):
+    '''Decorator for caching in front of another cache.'''
+    def decorator(application):
+        _tiered_memo_cache = TieredCache(cache, **kw)
+        return WsgiMemoize(application, _tiered_memo_cache, **kw)
+    return decorator
+
+
+def session(cache, **kw):
+    '''Decorator for sessions in front of another cache.'''
+    def decorator(application):
+        _tiered_base_cache = TieredCache(cache, **kw)
+        _tiered_session_cache = SessionCache(_tiered_base_cache, **kw)
+        return CookieSession(application, _tiered_session_cache, **kw)
+    return decorator
+
+
+def urlsession(cache, **kw):
+    '''Decorator for URL encoded sessions in front of another cache.'''
+    def decorator(application):
+        _tiered_ubase_cache = TieredCache(cache, **kw)
+        _tiered_url_cache = SessionCache(_tiered_ubase_cache, **kw)
+        return URLSession(application, _tiered_url_cache, **kw)
+    return decorator
+
+
+class TieredCache(BaseCache):
+
+    '''Two-tier cache: a small MemoryCache (L1) in front of any other cache
+    (L2), such as a memcached or database cache.
+
+    Reads try L1 first, then L2, copying L2 hits into L1. Writes and
+    deletes go to both. L1 keeps items for at most `l1_timeout` seconds
+    (default: 5) and holds `l1_max_entries` of them (default: 100), so
+    changes other processes make to L2 show up within `l1_timeout`
+    seconds. add() goes to L2 alone so it stays as atomic as L2's.
+
+    `l1_copy` sets how L1 hands out values (default: 'deep', see
+    MemoryCache). Values written to L1 are always copies, so a caller that
+    changes an object after storing or reading it doesn't change L1's copy
+    of what L2 holds, whatever `l1_copy` is.
+    '''
+
+    def __init__(self, cache, **kw):
+        # Default to the timeout of the cache behind
+        kw.setdefault('timeout', cache.timeout)
+        super(TieredCache, self).__init__(cache, **kw)
+        self.l2 = cache
+        try:
+            self._l1_timeout = max(1, int(kw.get('l1_timeout', 5)))
+        except (ValueError, TypeError):
+            self._l1_timeout = 5
+        strategy = kw.get('l1_copy', 'deep')
+        # Frozen values are already serialized copies
+        if strategy == 'frozen':
+            self._l1value = _identity
+        else:
+            self._l1value = copy.deepcopy
+        l1kw = dict(
+            timeout=self._l1_timeout,
+            max_entries=kw.get('l1_max_entries', 100),
+            max_bytes=kw.get('l1_max_bytes'),
+            eviction=kw.get('l1_eviction', 'lru'),
+            copy=strategy,
+            lock=kw.get('lock', 'exclusive'),
+            # Calls are recorded by the tiered cache
+            stats=False)
+        self.l1 = MemoryCache(**l1kw)
+        self._startreaper(kw)
+
+    @property
+    def threadsafe(self):
+        '''Tells if L2 is thread-safe, as L1 always is.'''
+        return getattr(self.l2, 'threadsafe', False)
+
+    def _l1values(self, mapping):
+        '''Gives the copies of a dict's values to write to L1.'''
+        return dict((k, self._l1value(v)) for k, v in mapping.items())
+
+    def _l1timeout(self, timeout):
+        '''Gives the timeout of an item in L1.'''
+        return min(self._timeout(timeout), self._l1_timeout)
+
+    def get(self, key, default=None):
+        '''Fetch a given key from the cache.  If the key does not exist, return
+        default, which itself defaults to None.
+
+        @param key Keyword of item in cache.
+        @param default Default value (default: None)
+        '''
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = self.l2.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        self.l1.set(key, self._l1value(value))
+        return value
+
+    def set(self, key, value, timeout=None):
+        '''Set a value in the cache.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        self.l2.set(key, value, self._timeout(timeout))
+        self.l1.set(key, self._l1value(value), self._l1timeout(timeout))
+
+    def add(self, key, value, timeout=None):
+        '''Set a value in the cache only if the key is not already in the
+        cache. Returns True if the value was stored.
+
+        @param key Keyword of item in cache.
+        @param value Value to be inserted in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        if not self.l2.add(key, value, self._timeout(timeout)):
+            return False
+        self.l1.set(key, self._l1value(value), self._l1timeout(timeout))
+        return True
+
+    def touch(self, key, timeout=None):
+        '''Reset the expiration time of a key in the cache. Returns True if
+        the key was in the cache.
+
+        @param key Keyword of item in cache.
+        @param timeout Seconds until item expires (default: self.timeout)
+        '''
+        if self.l2.touch(key, self._timeout(timeout)):
+            self.l1.touch(key, self._l1timeout(timeout))
+            return True
+        self.l1.delete(key)
+        return False
+
+    def delete(self, key):
+        '''Delete a key from the cache, failing silently.
+
+        @param key Keyword of item in cache.
+        '''
+        self.l1.delete(key)
+        self.l2.delete(key)
+
+    def get_many(self, keys):
+        '''Fetch a bunch of keys from the cache, reading the keys missing
+        from L1 from L2 in one batch. Returns a dict mapping each key in keys
+        to its value. If the given key is missing, it will be missing from
+        the response dict.
+
+        @param keys Keywords of items in cache.
+        '''
+        keys = list(keys)
+        d = self.l1.get_many(keys)
+        missing = [k for k in keys if k not in d]
+        if missing:
+            found = self.l2.get_many(missing)
+            if found:
+                self.l1.set_many(self._l1values(found))
+                d.update(found)
+        return d
+
+    def set_many(self, mapping, timeout=None):
+        '''Set a bunch of values in the cache.
+
+        @param mapping Dict of keys and values to be inserted in cache.
+        @param timeout Seconds until items expire (default: self.timeout)
+        '''
+        self.l2.set_many(mapping, self._timeout(timeout))
+        self.l1.set_many(self._l1values(mapping), self._l1timeout(timeout))
+
+    def delete_many(self, keys):
+        '''Delete a bunch of keys from the cache, failing silently.
+
+        @param keys Keywords of items in cache.
+        '''
+        keys = list(keys)
+        self.l1.delete_many(keys)
+        self.l2.delete_many(keys)
+
+    def _usage(self):
+        '''Gives the number of items in L2 and their size in bytes.'''
+        return self.l2._usage()
+
+    def reap(self, limit=100):
+        '''Remove up to limit timed out items from L1. Returns True if more
+        items have timed out. L2 reaps itself.
+
+        @param limit Most items to examine (default: 100)
+        '''
+        return self.l1.reap(limit)
+
+    def _cull(self):
+        '''Remove items in both tiers to make room.'''
+        self.l1._cull()
+        self.l2._cull()
+
+    def close(self):
+        '''Stop any background reapers of both tiers.'''
+        super(TieredCache, self).close()
+        self.l1.close()
+        self.l2.close()